@@ -0,0 +1,342 @@
+"""
+Detection resolution autotuner and per-image-size detection profiles.
+
+PaddleOCR resizes every page so its longest side is at most det_limit_side_len (960 by default) before
+text detection, whatever the input: a 6000px scan is detected at a sixth of its resolution and small
+text is lost, while small inputs gain nothing from a larger limit. The autotuner sweeps the detection
+input size, the DB thresholds and the recognition batch size on a sample of images, compares every
+setting with the pipeline's own output at full resolution and writes a JSON profile that maps
+image-size buckets (by longest side) to the fastest settings within an accuracy tolerance:
+
+    python det_autotune.py ./scans --sample 12 --output det_profile.json
+
+ocrtest.py and ocrtest_fixed.py load the profile with --det_profile and apply the settings of each
+image's bucket to the engine before running it (DetProfile.apply).
+"""
+import argparse
+import difflib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from ocr_result import OCRLines
+from ocr_workers import collect_image_inputs, warmup_ocr_engine
+from page_orientation import sample_evenly
+
+PROFILE_VERSION = 1
+
+# Upper edges (longest image side in pixels) of the size buckets; the last bucket is unbounded
+DEFAULT_BUCKET_EDGES = (1024, 2048, 3072, 4096)
+DEFAULT_SIDE_LENS = (640, 736, 960, 1280, 1600, 1920, 2560, 3200)
+DEFAULT_DB_THRESHS = (0.3,)
+DEFAULT_BOX_THRESHS = (0.5, 0.6)
+DEFAULT_REC_BATCH_NUMS = (6, 16, 32)
+
+# Mean match score against the full-resolution reference a setting must keep (1 - tolerance)
+DEFAULT_TOLERANCE = 0.01
+# Boxes overlapping at least this much are compared as the same text line
+MATCH_IOU = 0.5
+# Detector inputs are padded to multiples of this
+SIZE_ALIGN = 32
+
+
+# --- Engine settings ---
+
+def _resize_op(text_detector):
+    """Returns the detector's DetResizeForTest operator (the one holding limit_side_len), or None."""
+    for op in getattr(text_detector, "preprocess_op", None) or []:
+        if hasattr(op, "limit_side_len"):
+            return op
+    return None
+
+
+def get_det_settings(text_system):
+    """Returns the tunable settings of a PaddleOCR TextSystem (or PaddleOCR engine) as a dict."""
+    settings = {}
+    detector = text_system.text_detector
+    resize = _resize_op(detector)
+    if resize is not None:
+        settings["det_limit_side_len"] = resize.limit_side_len
+        settings["det_limit_type"] = resize.limit_type
+    postprocess = getattr(detector, "postprocess_op", None)
+    if hasattr(postprocess, "box_thresh"):
+        settings["det_db_thresh"] = postprocess.thresh
+        settings["det_db_box_thresh"] = postprocess.box_thresh
+    settings["rec_batch_num"] = text_system.text_recognizer.rec_batch_num
+    return settings
+
+
+def set_det_settings(text_system, settings):
+    """Applies settings (as returned by get_det_settings) to a TextSystem; keys the engine lacks are ignored."""
+    detector = text_system.text_detector
+    resize = _resize_op(detector)
+    if resize is not None:
+        resize.limit_side_len = settings.get("det_limit_side_len", resize.limit_side_len)
+        resize.limit_type = settings.get("det_limit_type", resize.limit_type)
+    postprocess = getattr(detector, "postprocess_op", None)
+    if hasattr(postprocess, "box_thresh"):
+        postprocess.thresh = settings.get("det_db_thresh", postprocess.thresh)
+        postprocess.box_thresh = settings.get("det_db_box_thresh", postprocess.box_thresh)
+    if "rec_batch_num" in settings:
+        text_system.text_recognizer.rec_batch_num = settings["rec_batch_num"]
+
+
+def full_resolution_side(shape):
+    """det_limit_side_len at which an image of this shape is detected without downscaling."""
+    return -(-max(shape[:2]) // SIZE_ALIGN) * SIZE_ALIGN
+
+
+class DetProfile:
+    """
+    Maps image-size buckets to engine settings. buckets is a list of dicts with "max_side" (upper edge
+    of the bucket's longest image side, None for unbounded) and "settings", sorted by max_side.
+    """
+
+    def __init__(self, buckets, tolerance=DEFAULT_TOLERANCE):
+        self.buckets = sorted(buckets, key=lambda b: float("inf") if b["max_side"] is None else b["max_side"])
+        self.tolerance = tolerance
+        self._defaults = {} # Engine settings before the first apply, per text system
+        self._applied = {} # Settings last applied, per text system
+
+    def settings_for(self, shape):
+        """
+        Returns the settings for an image of this shape: those of the smallest profiled bucket that
+        holds it, or None (engine defaults) for images larger than every profiled bucket.
+        """
+        long_side = max(shape[:2])
+        for bucket in self.buckets:
+            if bucket["max_side"] is None or long_side <= bucket["max_side"]:
+                return bucket["settings"]
+        return None
+
+    def apply(self, text_system, img):
+        """Sets the settings for img's size on a TextSystem (or PaddleOCR engine). Returns them (None: defaults)."""
+        key = id(text_system)
+        if key not in self._defaults:
+            self._defaults[key] = get_det_settings(text_system)
+        settings = self.settings_for(img.shape)
+        target = settings if settings is not None else self._defaults[key]
+        if self._applied.get(key) is not target:
+            set_det_settings(text_system, target)
+            self._applied[key] = target
+        return settings
+
+    def to_dict(self):
+        return {"version": PROFILE_VERSION, "tolerance": self.tolerance, "buckets": self.buckets}
+
+    def save(self, path):
+        output_dir = os.path.dirname(os.path.abspath(path))
+        os.makedirs(output_dir, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+def load_det_profile(path):
+    """Loads a profile written by det_autotune.py."""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("version") != PROFILE_VERSION:
+        raise ValueError(f"{path} is not a version {PROFILE_VERSION} detection profile")
+    return DetProfile(data["buckets"], data.get("tolerance", DEFAULT_TOLERANCE))
+
+
+# --- Autotuning ---
+
+def match_score(reference, candidate):
+    """
+    Scores candidate lines against reference lines (both OCRLines) between 0 and 1: lines are paired
+    greedily by box overlap (IoU >= MATCH_IOU) and each pair counts with the similarity of its texts,
+    relative to the mean number of lines. Missed, extra and misread lines all lower the score.
+    """
+    if not len(reference) and not len(candidate):
+        return 1.0
+    if not len(reference) or not len(candidate):
+        return 0.0
+    a, b = reference.bounds(), candidate.bounds()
+    inter_w = np.clip(np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0]), 0, None)
+    inter_h = np.clip(np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1]), 0, None)
+    inter = inter_w * inter_h
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    iou = inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+
+    used_a, used_b = set(), set()
+    similarity = 0.0
+    for flat in np.argsort(-iou, axis=None, kind="stable"):
+        i, j = divmod(int(flat), iou.shape[1])
+        if iou[i, j] < MATCH_IOU:
+            break
+        if i in used_a or j in used_b:
+            continue
+        used_a.add(i)
+        used_b.add(j)
+        similarity += difflib.SequenceMatcher(None, reference.texts[i], candidate.texts[j]).ratio()
+    return 2 * similarity / (len(reference) + len(candidate))
+
+
+def run_setting(ocr, images, settings, repeats=1):
+    """
+    Runs the det/cls/rec pipeline on every image with settings (a dict, or a function of the image
+    returning one). Returns (lines, seconds): the OCRLines of each image and its fastest run time.
+    """
+    results, seconds = [], []
+    for img in images:
+        set_det_settings(ocr, settings(img) if callable(settings) else settings)
+        best = float("inf")
+        for _ in range(repeats):
+            start = time.perf_counter()
+            dt_boxes, rec_res, _ = ocr(img, cls=True)
+            best = min(best, time.perf_counter() - start)
+        results.append(OCRLines.from_text_system(dt_boxes, rec_res))
+        seconds.append(best)
+    return results, seconds
+
+
+def tune_bucket(ocr, images, defaults, side_lens, db_threshs, box_threshs, rec_batch_nums, tolerance, repeats=1):
+    """
+    Finds the fastest settings for one bucket of images whose mean match score against the
+    full-resolution reference (engine defaults otherwise) is at least 1 - tolerance. Detection
+    settings are swept first with the default batch size, then the batch size for the chosen one.
+    Returns the profile entry without "max_side".
+    """
+    def report(label, accuracy, secs):
+        print(f"  {label:<44} accuracy {accuracy:.4f}  {secs:.3f}s/image")
+
+    reference_settings = lambda img: dict(defaults, det_limit_side_len=full_resolution_side(img.shape),
+                                          det_limit_type="max")
+    reference, reference_seconds = run_setting(ocr, images, reference_settings, repeats)
+    reference_time = float(np.mean(reference_seconds))
+    report("full resolution (reference)", 1.0, reference_time)
+
+    def evaluate(settings):
+        lines, seconds = run_setting(ocr, images, settings, repeats)
+        accuracy = float(np.mean([match_score(ref, cand) for ref, cand in zip(reference, lines)]))
+        return accuracy, float(np.mean(seconds))
+
+    # Limits at or above the largest image all mean full resolution; keep one of them
+    full_side = max(full_resolution_side(img.shape) for img in images)
+    best = (dict(defaults, det_limit_side_len=full_side, det_limit_type="max"), 1.0, reference_time)
+    for side_len in sorted({min(s, full_side) for s in side_lens}):
+        for db_thresh in db_threshs:
+            for box_thresh in box_threshs:
+                settings = dict(defaults, det_limit_side_len=side_len, det_limit_type="max", det_db_thresh=db_thresh,
+                                det_db_box_thresh=box_thresh)
+                accuracy, secs = evaluate(settings)
+                report(f"side {side_len}, thresh {db_thresh}, box_thresh {box_thresh}", accuracy, secs)
+                if accuracy >= 1 - tolerance and secs < best[2]:
+                    best = (settings, accuracy, secs)
+
+    det_settings = best[0]
+    for rec_batch_num in rec_batch_nums:
+        if rec_batch_num == det_settings.get("rec_batch_num"):
+            continue
+        settings = dict(det_settings, rec_batch_num=rec_batch_num)
+        accuracy, secs = evaluate(settings)
+        report(f"  rec_batch_num {rec_batch_num}", accuracy, secs)
+        if accuracy >= 1 - tolerance and secs < best[2]:
+            best = (settings, accuracy, secs)
+
+    settings, accuracy, secs = best
+    return {"settings": settings, "images": len(images), "accuracy": round(accuracy, 4),
+            "seconds_per_image": round(secs, 4), "reference_seconds_per_image": round(reference_time, 4)}
+
+
+def bucket_images(paths, edges):
+    """Groups image paths by size bucket. Returns {bucket index: [path, ...]}; unreadable images are skipped."""
+    from PIL import Image # Reads the size from the header without decoding the pixels
+    buckets = {}
+    for path in paths:
+        try:
+            with Image.open(path) as image:
+                long_side = max(image.size)
+        except OSError as e:
+            print(f"Warning: skipping {path}: {e}")
+            continue
+        index = sum(long_side > edge for edge in edges)
+        buckets.setdefault(index, []).append(path)
+    return buckets
+
+
+def autotune(ocr, paths, edges=DEFAULT_BUCKET_EDGES, sample=12, side_lens=DEFAULT_SIDE_LENS,
+             db_threshs=DEFAULT_DB_THRESHS, box_threshs=DEFAULT_BOX_THRESHS, rec_batch_nums=DEFAULT_REC_BATCH_NUMS,
+             tolerance=DEFAULT_TOLERANCE, repeats=1):
+    """Tunes every size bucket that has images on up to sample of them. Returns a DetProfile."""
+    import cv2
+    edges = sorted(edges)
+    defaults = get_det_settings(ocr)
+    buckets = []
+    for index, bucket_paths in sorted(bucket_images(paths, edges).items()):
+        max_side = edges[index] if index < len(edges) else None
+        low = edges[index - 1] if index > 0 else 0
+        label = f"{low + 1}-{max_side}px" if max_side is not None else f"over {low}px"
+        images = [img for img in (cv2.imread(p) for p in sample_evenly(bucket_paths, sample)) if img is not None]
+        if not images:
+            continue
+        print(f"\nBucket {label}: tuning on {len(images)} of {len(bucket_paths)} images")
+        entry = tune_bucket(ocr, images, defaults, side_lens, db_threshs, box_threshs, rec_batch_nums, tolerance,
+                            repeats)
+        print(f"  -> {entry['settings']} ({entry['reference_seconds_per_image'] / entry['seconds_per_image']:.2f}x "
+              f"faster than full resolution, accuracy {entry['accuracy']:.4f})")
+        buckets.append(dict(max_side=max_side, **entry))
+    set_det_settings(ocr, defaults)
+    return DetProfile(buckets, tolerance)
+
+
+def _parse_list(text, cast):
+    return tuple(cast(v.strip()) for v in text.split(",") if v.strip())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tune detection input size, DB thresholds and recognition batch "
+                                                 "size per image-size bucket against full-resolution results.")
+    parser.add_argument("inputs", type=str, nargs="*", help="Image files, directories or glob patterns.")
+    parser.add_argument("--file_list", type=str, default=None, help="Text file with one image path per line.")
+    parser.add_argument("--output", type=str, default="./det_profile.json",
+                        help="Profile file for --det_profile (default: ./det_profile.json).")
+    parser.add_argument("--sample", type=int, default=12, help="Images tuned on per size bucket (default: 12).")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"Largest accepted drop of the mean match score against full resolution (default: {DEFAULT_TOLERANCE}).")
+    parser.add_argument("--buckets", type=str, default=",".join(map(str, DEFAULT_BUCKET_EDGES)),
+                        help="Comma-separated upper edges of the size buckets, by longest image side in pixels "
+                             f"(default: {','.join(map(str, DEFAULT_BUCKET_EDGES))}).")
+    parser.add_argument("--side_lens", type=str, default=",".join(map(str, DEFAULT_SIDE_LENS)),
+                        help="Comma-separated det_limit_side_len values to try.")
+    parser.add_argument("--db_threshs", type=str, default=",".join(map(str, DEFAULT_DB_THRESHS)),
+                        help="Comma-separated det_db_thresh values to try.")
+    parser.add_argument("--box_threshs", type=str, default=",".join(map(str, DEFAULT_BOX_THRESHS)),
+                        help="Comma-separated det_db_box_thresh values to try.")
+    parser.add_argument("--rec_batch_nums", type=str, default=",".join(map(str, DEFAULT_REC_BATCH_NUMS)),
+                        help="Comma-separated rec_batch_num values to try.")
+    parser.add_argument("--repeats", type=int, default=1, help="Timed runs per image and setting; the fastest counts (default: 1).")
+    parser.add_argument("--cpu_threads", type=int, default=10, help="CPU threads of the engine, as at runtime (default: 10).")
+    args = parser.parse_args()
+
+    if not args.inputs and not args.file_list:
+        parser.error("at least one image, directory, glob pattern or --file_list is required")
+    try:
+        edges = _parse_list(args.buckets, int)
+        side_lens = _parse_list(args.side_lens, int)
+        db_threshs = _parse_list(args.db_threshs, float)
+        box_threshs = _parse_list(args.box_threshs, float)
+        rec_batch_nums = _parse_list(args.rec_batch_nums, int)
+    except ValueError as e:
+        print(f"Error: Invalid comma-separated list: {e}")
+        sys.exit(1)
+    paths = [path for path, _ in collect_image_inputs(args.inputs, args.file_list)]
+    if not paths:
+        print("Error: No images found for the given inputs.")
+        sys.exit(1)
+
+    import ocrtest
+    ocr = ocrtest.create_ocr_engine(cpu_threads=args.cpu_threads)
+    warmup_ocr_engine(ocr)
+    profile = autotune(ocr, paths, edges, args.sample, side_lens, db_threshs, box_threshs, rec_batch_nums,
+                       args.tolerance, args.repeats)
+    if not profile.buckets:
+        print("Error: None of the images could be read.")
+        sys.exit(1)
+    profile.save(args.output)
+    print(f"\nProfile with {len(profile.buckets)} buckets written to {args.output}")
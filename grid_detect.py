@@ -0,0 +1,159 @@
+"""
+Automatic grid geometry detection for table scans.
+
+Finds row and column boundaries from the image itself so ocrtest_fixed.py does not depend on
+hand-tuned --row_height / --col_widths. Ruling lines are used when the sheet has them; otherwise
+boundaries are placed in the blank gaps of the horizontal / vertical ink projection profiles, which
+also handles variable row heights. A small page skew is estimated and removed first, so the returned
+cell rectangles refer to the deskewed image.
+"""
+import numpy as np
+import cv2
+
+# Points used for skew estimation; larger pages are subsampled with a fixed stride
+SKEW_MAX_POINTS = 200000
+
+
+def ink_mask(img_np, dark_level=None):
+    """Returns a uint8 mask (255 = ink). Uses Otsu's threshold when dark_level is None."""
+    gray = cv2.cvtColor(img_np, cv2.COLOR_RGB2GRAY) if img_np.ndim == 3 else img_np
+    if dark_level is None:
+        _, mask = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        return mask
+    return np.where(gray < dark_level, 255, 0).astype(np.uint8)
+
+
+def estimate_skew(mask, max_angle=3.0, step=0.1):
+    """
+    Estimates the page skew in degrees (positive when lines run down to the right).
+
+    For each candidate angle the ink pixels are sheared onto the y axis and the sharpness (sum of
+    squares) of the resulting row profile is measured; text lines and ruling lines give the sharpest
+    profile when the shear cancels the skew.
+    """
+    ys, xs = np.nonzero(mask)
+    if len(ys) == 0 or max_angle <= 0:
+        return 0.0
+    stride = max(1, len(ys) // SKEW_MAX_POINTS)
+    ys = ys[::stride].astype(np.float64)
+    xs = xs[::stride].astype(np.float64)
+
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-max_angle, max_angle + step / 2, step):
+        shifted = ys - xs * np.tan(np.radians(angle))
+        profile = np.bincount(np.round(shifted - shifted.min()).astype(np.int64))
+        score = float(np.square(profile, dtype=np.float64).sum())
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+
+def deskew(img_np, angle):
+    """Rotates the image around its center to undo a skew of angle degrees, filling the border with white."""
+    if abs(angle) < 1e-3:
+        return img_np
+    height, width = img_np.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width / 2.0, height / 2.0), angle, 1.0)
+    border = (255,) * img_np.shape[2] if img_np.ndim == 3 else 255
+    return cv2.warpAffine(img_np, matrix, (width, height), flags=cv2.INTER_LINEAR,
+                          borderMode=cv2.BORDER_CONSTANT, borderValue=border)
+
+
+def _runs(flags):
+    """Returns (start, end) index pairs of the runs of True values in a 1-D boolean array."""
+    padded = np.concatenate(([False], flags, [False]))
+    changes = np.flatnonzero(padded[1:] != padded[:-1])
+    return changes.reshape(-1, 2)
+
+
+def find_ruling_lines(mask, axis, min_length_fraction=0.5):
+    """
+    Returns the center positions of long ruling lines: horizontal lines (y positions) for axis=0,
+    vertical lines (x positions) for axis=1. A line must cover min_length_fraction of the mask's
+    width (horizontal) or height (vertical).
+    """
+    height, width = mask.shape
+    if axis == 0:
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(10, width // 20), 1))
+    else:
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, max(10, height // 20)))
+    lines = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+    profile = (lines > 0).sum(axis=1 - axis)
+    length = width if axis == 0 else height
+    runs = _runs(profile >= min_length_fraction * length)
+    return [int((start + end - 1) // 2) for start, end in runs]
+
+
+def _gap_edges(profile, min_gap, min_size, noise):
+    """
+    Places boundaries in the blank gaps of a projection profile.
+    Content runs separated by less than min_gap are merged; the outer edges are padded by half the
+    median gap. Returns strictly increasing edge positions (empty if there is no content).
+    """
+    length = len(profile)
+    content = _runs(profile > noise)
+    if len(content) == 0:
+        return []
+    merged = [list(content[0])]
+    for start, end in content[1:]:
+        if start - merged[-1][1] < min_gap:
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    merged = [run for run in merged if run[1] - run[0] >= min_size] or merged
+
+    gaps = [merged[i + 1][0] - merged[i][1] for i in range(len(merged) - 1)]
+    pad = int(np.median(gaps) // 2) if gaps else min_gap
+    edges = [max(0, merged[0][0] - pad)]
+    for i in range(len(merged) - 1):
+        edges.append((merged[i][1] + merged[i + 1][0]) // 2)
+    edges.append(min(length, merged[-1][1] + pad))
+    return edges
+
+
+def _clean_edges(edges, min_cell):
+    """Sorts edges and drops any that would create a cell thinner than min_cell pixels."""
+    cleaned = []
+    for edge in sorted(edges):
+        if not cleaned or edge - cleaned[-1] >= min_cell:
+            cleaned.append(int(edge))
+    return cleaned
+
+
+def detect_grid(img_np, dark_level=None, max_skew=3.0, use_lines=True, min_row_gap=2, min_col_gap=8, min_cell=6):
+    """
+    Detects the table grid of an image.
+
+    Returns (deskewed_img, row_edges, col_edges, skew_angle). Cells are the rectangles between
+    consecutive row and column edges, in the coordinates of deskewed_img. Either edge list may be
+    empty if no grid could be found.
+    """
+    mask = ink_mask(img_np, dark_level)
+    angle = round(estimate_skew(mask, max_skew), 2)
+    if abs(angle) >= 0.05:
+        img_np = deskew(img_np, angle)
+        mask = ink_mask(img_np, dark_level)
+    height, width = mask.shape
+    ink = mask > 0
+
+    row_edges = find_ruling_lines(mask, axis=0) if use_lines else []
+    if len(row_edges) >= 2:
+        row_method = "ruling lines"
+    else:
+        row_method = "projection profile"
+        row_edges = _gap_edges(ink.sum(axis=1), min_row_gap, 2, max(1, width // 500))
+    row_edges = _clean_edges(row_edges, min_cell)
+
+    # Only the table area counts for columns, so titles above the grid do not fill the column gaps
+    top, bottom = (row_edges[0], row_edges[-1] + 1) if len(row_edges) >= 2 else (0, height)
+    col_edges = find_ruling_lines(mask[top:bottom], axis=1) if use_lines else []
+    if len(col_edges) >= 2:
+        col_method = "ruling lines"
+    else:
+        col_method = "projection profile"
+        col_edges = _gap_edges(ink[top:bottom].sum(axis=0), min_col_gap, 2, max(1, (bottom - top) // 500))
+    col_edges = _clean_edges(col_edges, min_cell)
+
+    print(f"Auto grid: skew {angle:+.2f} deg, {max(len(row_edges) - 1, 0)} rows ({row_method}), "
+          f"{max(len(col_edges) - 1, 0)} columns ({col_method})")
+    return img_np, row_edges, col_edges, angle
@@ -0,0 +1,256 @@
+"""
+Confidence-gated hybrid OCR: local PaddleOCR first, the Mistral OCR API only for the hard lines.
+
+Every page goes through the local det/cls/rec pipeline. Lines whose recognition score is below
+--threshold are cropped (with a small margin) and sent to the remote OCR backend, concurrently and
+rate limited over one pooled HTTP client (see mistral_batch); the remote text replaces the local text
+of that line, matched by its box. Everything else stays local, so remote latency and cost are only
+paid for the hard parts of a page. Local OCR of the next page overlaps with the remote requests of
+the previous ones.
+
+Each page is written as one JSON line with its lines (marked "local" or "remote"), the fraction of
+lines and of the page area that went remote and the end-to-end latency. --base_url can point at
+mistral_stub_server.py to test the routing without an API key.
+"""
+import argparse
+import asyncio
+import base64
+import collections
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+from mistral_batch import DEFAULT_BASE_URL, OCR_MODEL, OCRRequestError, TokenBucket, request_with_retry
+from ocr_result import OCRLines
+from ocr_trace import percentile
+from ocr_workers import collect_image_inputs
+from ocr_writers import RowWriter
+
+# Pixels added around a line box before it is cropped for the remote backend
+CROP_MARGIN = 4
+# Pages whose remote requests may still be running while the next pages are OCRed locally
+MAX_PAGES_IN_FLIGHT = 4
+
+_MARKDOWN_IMAGE = re.compile(r"!\[[^\]]*\]\([^)]*\)")
+_MARKDOWN_PREFIX = re.compile(r"^\s*(#+|[-*+>]|\d+\.)\s+")
+
+
+def markdown_to_text(markdown):
+    """Flattens the markdown the OCR API returns for a crop into one line of plain text."""
+    parts = []
+    for line in _MARKDOWN_IMAGE.sub("", markdown).splitlines():
+        line = _MARKDOWN_PREFIX.sub("", line).replace("|", " ").replace("**", "").replace("`", "")
+        if line.strip() and not set(line.strip()) <= set("-: "): # Skip table separator rows
+            parts.append(" ".join(line.split()))
+    return " ".join(parts)
+
+
+def crop_lines(img, lines, index, margin=CROP_MARGIN):
+    """Returns the axis-aligned crops (with margin) of the selected lines and their total area in pixels."""
+    height, width = img.shape[:2]
+    bounds = lines.bounds()[index]
+    x0 = np.clip(np.floor(bounds[:, 0]) - margin, 0, width).astype(int)
+    y0 = np.clip(np.floor(bounds[:, 1]) - margin, 0, height).astype(int)
+    x1 = np.clip(np.ceil(bounds[:, 2]) + margin, 0, width).astype(int)
+    y1 = np.clip(np.ceil(bounds[:, 3]) + margin, 0, height).astype(int)
+    crops = [img[a:c, b:d] for a, b, c, d in zip(y0, x0, y1, x1)]
+    return crops, int(((x1 - x0) * (y1 - y0)).sum())
+
+
+class RemoteOCRBackend:
+    """Sends image crops to the Mistral OCR endpoint (or a stub of it) and returns their plain text."""
+
+    def __init__(self, base_url=DEFAULT_BASE_URL, api_key="", concurrency=8, rate=5.0, burst=None, max_retries=5,
+                 timeout=60.0):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.requests = 0
+        self.failures = 0
+
+    async def __aenter__(self):
+        import httpx
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+        self.client = httpx.AsyncClient(base_url=self.base_url, headers=headers, limits=limits, timeout=self.timeout)
+        self.bucket = TokenBucket(self.rate, self.burst)
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.client.aclose()
+
+    async def _recognize_one(self, crop):
+        import cv2
+        if crop.size == 0:
+            return None
+        async with self.semaphore:
+            ok, png = await asyncio.to_thread(cv2.imencode, ".png", crop)
+            if not ok:
+                return None
+            image_url = "data:image/png;base64," + base64.b64encode(png.tobytes()).decode("ascii")
+            body = {"model": OCR_MODEL, "document": {"type": "image_url", "image_url": image_url}}
+            self.requests += 1
+            try:
+                response, _ = await request_with_retry(self.client, self.bucket, "POST", "/v1/ocr", self.max_retries,
+                                                       json=body)
+                pages = response.json().get("pages") or []
+            except (OCRRequestError, ValueError) as e:
+                print(f"Warning: remote OCR of a line failed, keeping the local text ({e})")
+                self.failures += 1
+                return None
+            return markdown_to_text("\n".join(page.get("markdown", "") for page in pages))
+
+    async def recognize(self, crops):
+        """Returns the remote text of each crop (None where the request failed), in order."""
+        return await asyncio.gather(*(self._recognize_one(crop) for crop in crops))
+
+
+def ocr_page_local(ocr, image_path, threshold):
+    """
+    Runs the local pipeline on one page. Returns (img, lines, routed, local_seconds), where lines is
+    an OCRLines with every detected line (ocr.drop_score must be 0) and routed the indices of the lines
+    scoring below threshold.
+    """
+    import cv2
+    start = time.perf_counter()
+    img = cv2.imread(image_path)
+    if img is None:
+        raise ValueError("unreadable image")
+    dt_boxes, rec_res, _ = ocr(img, cls=True)
+    lines = OCRLines.from_text_system(dt_boxes, rec_res)
+    routed = np.nonzero(lines.scores < threshold)[0]
+    return img, lines, routed, time.perf_counter() - start
+
+
+async def finish_page(backend, image_path, img, lines, routed, local_seconds, started, drop_score):
+    """Sends the routed lines of a page to the backend and merges the answers back. Returns the page record."""
+    crops, remote_area = crop_lines(img, lines, routed)
+    remote_start = time.perf_counter()
+    answers = await backend.recognize(crops) if crops else []
+    remote_seconds = time.perf_counter() - remote_start
+
+    texts = list(lines.texts)
+    sources = ["local"] * len(lines)
+    for i, answer in zip(routed, answers):
+        if answer: # Failed requests (None) and crops the API found no text in keep the local text
+            texts[i] = answer
+            sources[i] = "remote"
+    records = []
+    for i, (box, score) in enumerate(zip(lines.boxes, lines.scores)):
+        if not texts[i] or (sources[i] == "local" and score < drop_score):
+            continue # Nothing readable here, or a local result PaddleOCR would have dropped
+        record = {"text": texts[i], "confidence": float(score), "text_region": box.tolist(), "source": sources[i]}
+        if sources[i] == "remote":
+            record["local_text"] = lines.texts[i]
+        records.append(record)
+
+    page_area = img.shape[0] * img.shape[1]
+    return {
+        "image": image_path,
+        "lines": records,
+        "detected_lines": len(lines),
+        "remote_lines": len(routed),
+        "remote_line_fraction": len(routed) / len(lines) if len(lines) else 0.0,
+        "remote_area_fraction": min(1.0, remote_area / page_area) if page_area else 0.0,
+        "local_seconds": local_seconds,
+        "remote_seconds": remote_seconds,
+        "latency": time.perf_counter() - started,
+    }
+
+
+async def run_hybrid(ocr, paths, backend, writer, threshold=0.85, drop_score=0.5):
+    """
+    OCRs the pages locally one after the other while the remote requests of up to MAX_PAGES_IN_FLIGHT
+    earlier pages run, and writes one record per page to writer in input order. Returns the records
+    without their lines.
+    """
+    summaries = []
+    pending = collections.deque()
+
+    async def emit(image_path, task):
+        try:
+            record = await task
+        except Exception as e:
+            record = {"image": image_path, "error": str(e)}
+            print(f"Error processing {image_path}: {e}")
+        writer.write_row(record)
+        summaries.append({k: v for k, v in record.items() if k != "lines"})
+        if "error" not in record:
+            print(f"{record['image']}: {record['detected_lines']} lines, {record['remote_lines']} remote "
+                  f"({record['remote_area_fraction']:.1%} of the page), {record['latency']:.2f}s")
+
+    async with backend:
+        for image_path in paths:
+            started = time.perf_counter()
+            try:
+                img, lines, routed, local_seconds = await asyncio.to_thread(ocr_page_local, ocr, image_path, threshold)
+                task = asyncio.ensure_future(finish_page(backend, image_path, img, lines, routed, local_seconds,
+                                                         started, drop_score))
+            except Exception as e:
+                task = asyncio.get_running_loop().create_future()
+                task.set_exception(e)
+            pending.append((image_path, task))
+            while pending and (len(pending) > MAX_PAGES_IN_FLIGHT or pending[0][1].done()):
+                await emit(*pending.popleft())
+        while pending:
+            await emit(*pending.popleft())
+    return summaries
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local PaddleOCR with low-confidence lines sent to the Mistral OCR API.")
+    parser.add_argument("inputs", type=str, nargs="*", help="Image files, directories or glob patterns.")
+    parser.add_argument("--file_list", type=str, default=None, help="Text file with one image path per line.")
+    parser.add_argument("--output", type=str, default="./output/hybrid_results.jsonl",
+                        help="JSONL file with one record per page (default: ./output/hybrid_results.jsonl).")
+    parser.add_argument("--threshold", type=float, default=0.85,
+                        help="Lines with a local recognition score below this are sent to the remote backend (default: 0.85).")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum remote requests in flight (default: 8).")
+    parser.add_argument("--rate", type=float, default=5.0, help="Maximum remote requests per second, 0 for unlimited (default: 5).")
+    parser.add_argument("--max_retries", type=int, default=5, help="Retries on 429/5xx/connection errors (default: 5).")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout in seconds (default: 60).")
+    parser.add_argument("--base_url", type=str, default=os.environ.get("MISTRAL_BASE_URL", DEFAULT_BASE_URL),
+                        help="API base URL, e.g. http://127.0.0.1:8765 for mistral_stub_server.py.")
+    args = parser.parse_args()
+
+    if not args.inputs and not args.file_list:
+        parser.error("at least one image, directory, glob pattern or --file_list is required")
+    api_key = os.environ.get("MISTRAL_API_KEY")
+    if not api_key and args.base_url == DEFAULT_BASE_URL:
+        print("Error: MISTRAL_API_KEY is not set.")
+        sys.exit(1)
+    paths = [path for path, _ in collect_image_inputs(args.inputs, args.file_list)]
+    if not paths:
+        print("Error: No images found for the given inputs.")
+        sys.exit(1)
+
+    import ocrtest
+    ocr = ocrtest.create_ocr_engine()
+    ocr.drop_score = 0.0 # Keep the low-scoring lines; they are the ones routed to the remote backend
+
+    backend = RemoteOCRBackend(args.base_url, api_key or "", args.concurrency, args.rate, max_retries=args.max_retries,
+                               timeout=args.timeout)
+    start = time.perf_counter()
+    with RowWriter(args.output) as writer:
+        summaries = asyncio.run(run_hybrid(ocr, paths, backend, writer, args.threshold, ocrtest.OCR_DROP_SCORE))
+    elapsed = time.perf_counter() - start
+
+    done = [s for s in summaries if "error" not in s]
+    detected = sum(s["detected_lines"] for s in done)
+    remote = sum(s["remote_lines"] for s in done)
+    latencies = sorted(s["latency"] for s in done)
+    print(f"\nProcessed {len(summaries)} pages ({len(summaries) - len(done)} failed) in {elapsed:.1f}s")
+    print(f"Remote: {remote} of {detected} lines ({remote / max(detected, 1):.1%}), "
+          f"{np.mean([s['remote_area_fraction'] for s in done]) if done else 0.0:.1%} of the page area on average, "
+          f"{backend.requests} requests ({backend.failures} failed)")
+    print(f"Page latency p50 {percentile(latencies, 50):.3f}s, p90 {percentile(latencies, 90):.3f}s, "
+          f"p99 {percentile(latencies, 99):.3f}s")
+    print(f"Results written to {args.output}")
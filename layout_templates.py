@@ -0,0 +1,305 @@
+"""
+Layout templates for repeated forms.
+
+Hundreds of pages of one printed form share the same layout regions and the same table grid. A page's
+layout is fingerprinted from the projection profiles of its ruling lines (the ink profiles along an
+axis without ruling lines). The page is binarized at full resolution and the ink mask is downscaled
+by area, so thin rules keep their weight whatever their phase against the downscaled pixel grid, and
+the profiles are smoothed before they are reduced to a fixed number of bins, so offsets smaller than
+a bin still show. When a new page matches a known template, the
+template's layout regions and SLANet table structure (cell tokens and cell boxes) are moved onto the
+page, scaled and shifted by the offset found while matching the profiles. Layout analysis and table
+structure recognition are then skipped for that page (see ocrtest.run_shared_pipeline). Text the
+template does not cover (a stamp, a note, a page number outside its regions and cells) is found with
+uncovered_text_boxes and read by the normal detection. Pages that match nothing are analysed in full
+and stored as new templates.
+
+Templates are kept in a SQLite file that worker processes share. They are dropped when the table
+model files change.
+"""
+import json
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+from ocr_cache import model_fingerprint
+from ocr_trace import tracer
+
+# Ink masks are downscaled (by area) to this width before the ruling lines are extracted
+FINGERPRINT_WIDTH = 1024
+# Downscaled mask pixels with at least this ink coverage count as ink when finding ruling lines
+MIN_COVERAGE = 0.05
+# Number of bins every projection profile is reduced to, so pages scanned at other resolutions compare
+PROFILE_BINS = 256
+# Gaussian smoothing (in bins) of the profiles, so lines a bin apart still correlate and sub-bin offsets show
+PROFILE_SIGMA = 1.5
+# Largest offset (fraction of the page) searched between a page and a template
+MAX_SHIFT = 0.05
+# Pages whose height/width ratio differs more than this from a template's never match it
+ASPECT_TOLERANCE = 0.03
+# Smallest profile correlation (on both axes) accepted as the same layout
+MATCH_THRESHOLD = 0.9
+# Templates kept in a store; later new layouts are analysed in full without being stored
+MAX_TEMPLATES = 200
+
+# Ink runs at least this fraction of the page's shorter side long are ruling lines, not text
+TEXT_LINE_FRACTION = 1 / 25
+# Connected ink components smaller than this (pixels) are specks, not text
+MIN_TEXT_COMPONENT = 6
+# Pixels around the template's boxes that still count as covered (rounding, small misalignment)
+COVER_PAD = 3
+# Pixels added around uncovered text before detection runs on it; closer bands are merged
+UNCOVERED_MARGIN = 8
+
+# Page statuses reported per page: a template was used, or the page fell back to full analysis
+TEMPLATE_HIT = "hit"
+TEMPLATE_MISS = "miss"
+TEMPLATE_NO_FINGERPRINT = "no_fingerprint"
+
+
+def _profile(values):
+    """
+    Smooths a projection profile at its own resolution, samples it at PROFILE_BINS bin centers and
+    normalizes it (zero mean, unit norm).
+    """
+    values = np.asarray(values, dtype=np.float64)
+    sigma = PROFILE_SIGMA * len(values) / PROFILE_BINS
+    radius = max(1, int(3 * sigma))
+    kernel = np.exp(-0.5 * (np.arange(-radius, radius + 1) / sigma) ** 2)
+    smoothed = np.convolve(values, kernel / kernel.sum(), mode="same")
+    centers = (np.arange(PROFILE_BINS) + 0.5) * len(values) / PROFILE_BINS - 0.5
+    profile = np.interp(centers, np.arange(len(values)), smoothed)
+    profile -= profile.mean()
+    norm = np.linalg.norm(profile)
+    return profile / norm if norm > 0 else profile
+
+
+def layout_fingerprint(img):
+    """
+    Returns the layout fingerprint of a page: its aspect ratio and, per axis, the normalized profile
+    of its ruling lines (or of its ink where an axis has no ruling lines). Returns None for a blank page.
+    """
+    import cv2
+    from grid_detect import ink_mask
+    height, width = img.shape[:2]
+    mask = ink_mask(img)
+    if not mask.any():
+        return None
+    small_width = min(width, FINGERPRINT_WIDTH)
+    small_height = max(1, round(height * small_width / width))
+    coverage = cv2.resize(mask, (small_width, small_height), interpolation=cv2.INTER_AREA).astype(np.float32) / 255
+    present = (coverage >= MIN_COVERAGE).astype(np.uint8)
+    fingerprint = {"aspect": height / width}
+    # Ruling lines are ink runs at least an eighth of the page long; text strokes are shorter
+    for name, axis, kernel_size in (("rows", 1, (max(10, small_width // 8), 1)),
+                                    ("cols", 0, (1, max(10, small_height // 8)))):
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, kernel_size)
+        lines = cv2.morphologyEx(present, cv2.MORPH_OPEN, kernel)
+        kind = "lines" if lines.any() else "ink"
+        weights = coverage * lines if kind == "lines" else coverage
+        fingerprint[name] = _profile(weights.sum(axis=axis)).tolist()
+        fingerprint[f"{name}_kind"] = kind
+    return fingerprint
+
+
+def text_ink(img):
+    """Returns a boolean mask of the text ink of img: its ink without ruling lines and specks."""
+    import cv2
+    from grid_detect import ink_mask
+    mask = ink_mask(img)
+    height, width = mask.shape
+    length = max(20, int(min(height, width) * TEXT_LINE_FRACTION))
+    lines = cv2.morphologyEx(mask, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (length, 1)))
+    lines |= cv2.morphologyEx(mask, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (1, length)))
+    lines = cv2.dilate(lines, np.ones((3, 3), np.uint8)) # Also drops the ragged edges of the lines
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(mask & ~lines, connectivity=8)
+    keep = stats[:, cv2.CC_STAT_AREA] >= MIN_TEXT_COMPONENT
+    keep[0] = False # Background
+    return keep[labels]
+
+
+def uncovered_text_boxes(img, covered):
+    """
+    Returns [x1, y1, x2, y2] boxes around the text ink of img that lies outside the covered boxes,
+    one per horizontal band of such ink, with UNCOVERED_MARGIN pixels around it.
+    """
+    ink = text_ink(img)
+    height, width = ink.shape
+    for x1, y1, x2, y2 in covered:
+        ink[max(0, y1 - COVER_PAD):max(0, y2 + COVER_PAD), max(0, x1 - COVER_PAD):max(0, x2 + COVER_PAD)] = False
+    rows = np.flatnonzero(ink.any(axis=1))
+    if not len(rows):
+        return []
+    breaks = np.flatnonzero(np.diff(rows) > 2 * UNCOVERED_MARGIN)
+    boxes = []
+    for top, bottom in zip(np.r_[rows[0], rows[breaks + 1]], np.r_[rows[breaks], rows[-1]]):
+        cols = np.flatnonzero(ink[top:bottom + 1].any(axis=0))
+        boxes.append([max(0, int(cols[0]) - UNCOVERED_MARGIN), max(0, int(top) - UNCOVERED_MARGIN),
+                      min(width, int(cols[-1]) + 1 + UNCOVERED_MARGIN), min(height, int(bottom) + 1 + UNCOVERED_MARGIN)])
+    return boxes
+
+
+def _best_shift(page_profile, template_profile):
+    """
+    Returns (correlation, shift in bins) of the best alignment of two normalized profiles; the shift
+    is refined below one bin from the parabola through the correlation peak.
+    """
+    max_shift = int(MAX_SHIFT * PROFILE_BINS)
+    correlation = np.correlate(page_profile, template_profile, mode="full")
+    center = len(template_profile) - 1 # Index of zero shift
+    window = correlation[center - max_shift : center + max_shift + 1]
+    best = int(np.argmax(window))
+    shift = float(best - max_shift)
+    if 0 < best < len(window) - 1:
+        left, peak, right = window[best - 1 : best + 2]
+        curvature = left - 2 * peak + right
+        if curvature < 0:
+            shift += 0.5 * (left - right) / curvature
+    return float(window[best]), shift
+
+
+class TemplateMatch:
+    """A template matched to a page, with the transform from template to page coordinates."""
+
+    def __init__(self, template, page_shape, score, shift_x, shift_y):
+        height, width = page_shape[:2]
+        template_height, template_width = template["size"]
+        self.template = template
+        self.page_shape = (height, width)
+        self.score = score
+        self.scale_x = width / template_width
+        self.scale_y = height / template_height
+        self.dx = shift_x * width / PROFILE_BINS
+        self.dy = shift_y * height / PROFILE_BINS
+
+    def _to_page(self, coords):
+        """Maps flat x, y, x, y, ... template coordinates to the page."""
+        coords = np.asarray(coords, dtype=np.float64).copy()
+        coords[..., 0::2] = coords[..., 0::2] * self.scale_x + self.dx
+        coords[..., 1::2] = coords[..., 1::2] * self.scale_y + self.dy
+        return coords
+
+    def regions(self):
+        """
+        Returns the template's regions on the page as (label, [x1, y1, x2, y2], structure_res) with
+        structure_res = (tokens, cell boxes relative to the region) for tables, else None.
+        """
+        height, width = self.page_shape
+        regions = []
+        for region in self.template["regions"]:
+            x1, y1, x2, y2 = self._to_page(region["bbox"]).round().astype(int)
+            x1, x2 = np.clip([x1, x2], 0, width)
+            y1, y2 = np.clip([y1, y2], 0, height)
+            structure_res = None
+            structure = region.get("structure")
+            if structure is not None:
+                # Cells are stored relative to the template region: move them to the page, then into the new region
+                cells = np.asarray(structure["cells"], dtype=np.float64).reshape(len(structure["cells"]), -1)
+                cells[:, 0::2] += region["bbox"][0]
+                cells[:, 1::2] += region["bbox"][1]
+                cells = self._to_page(cells)
+                cells[:, 0::2] -= x1
+                cells[:, 1::2] -= y1
+                structure_res = (list(structure["tokens"]), cells.astype(np.float32))
+            regions.append((region["label"], [int(x1), int(y1), int(x2), int(y2)], structure_res))
+        return regions
+
+
+class LayoutTemplateStore:
+    """Known page layouts in memory and in a SQLite file; see module docstring."""
+
+    def __init__(self, db_path, model_dirs, threshold=MATCH_THRESHOLD, max_templates=MAX_TEMPLATES):
+        self.threshold = threshold
+        self.max_templates = max_templates
+        self.templates = []
+        self.last_id = 0
+        self.last_status = None
+
+        parent = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(parent, exist_ok=True)
+        self.db = sqlite3.connect(db_path, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL") # Lets several worker processes share one store
+        self.db.execute("CREATE TABLE IF NOT EXISTS templates (id INTEGER PRIMARY KEY AUTOINCREMENT, value TEXT, "
+                        "created REAL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        fingerprint = model_fingerprint(model_dirs)
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'models'").fetchone()
+        if row is not None and row[0] != fingerprint:
+            removed = self.db.execute("DELETE FROM templates").rowcount
+            print(f"Layout templates: model files changed, dropped {removed} templates")
+        self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('models', ?)", (fingerprint,))
+        self.db.commit()
+        self._load_new()
+
+    def _load_new(self):
+        """Loads templates added since the last load, e.g. by other worker processes."""
+        for template_id, value in self.db.execute("SELECT id, value FROM templates WHERE id > ? ORDER BY id",
+                                                  (self.last_id,)):
+            self.templates.append(json.loads(value))
+            self.last_id = template_id
+
+    def _best_match(self, fingerprint, page_shape):
+        best = None
+        for template in self.templates:
+            other = template["fingerprint"]
+            if abs(other["aspect"] - fingerprint["aspect"]) > ASPECT_TOLERANCE * other["aspect"]:
+                continue
+            if other["rows_kind"] != fingerprint["rows_kind"] or other["cols_kind"] != fingerprint["cols_kind"]:
+                continue
+            row_score, shift_y = _best_shift(np.asarray(fingerprint["rows"]), np.asarray(other["rows"]))
+            col_score, shift_x = _best_shift(np.asarray(fingerprint["cols"]), np.asarray(other["cols"]))
+            score = min(row_score, col_score)
+            if score >= self.threshold and (best is None or score > best.score):
+                best = TemplateMatch(template, page_shape, score, shift_x, shift_y)
+        return best
+
+    def lookup(self, img):
+        """
+        Matches a page against the known templates. Returns (match, fingerprint): a TemplateMatch or
+        None, and the page's fingerprint for add (None for a blank page). Sets last_status.
+        """
+        fingerprint = layout_fingerprint(img)
+        match = None
+        if fingerprint is None:
+            self.last_status = TEMPLATE_NO_FINGERPRINT
+        else:
+            match = self._best_match(fingerprint, img.shape)
+            if match is None:
+                self._load_new()
+                match = self._best_match(fingerprint, img.shape)
+            self.last_status = TEMPLATE_HIT if match is not None else TEMPLATE_MISS
+        tracer.count("template_hits" if match is not None else "template_fallbacks")
+        return match, fingerprint
+
+    def add(self, fingerprint, page_shape, regions):
+        """
+        Stores a fully analysed page as a template. regions is a list of {"label", "bbox", "structure"}
+        with structure = {"tokens", "cells"} (cells relative to the region) for tables, else None.
+        """
+        if fingerprint is None or len(self.templates) >= self.max_templates:
+            return
+        self._load_new()
+        if self._best_match(fingerprint, page_shape) is not None:
+            return # Stored meanwhile by another worker that saw the same form
+        template = {"size": list(page_shape[:2]), "fingerprint": fingerprint, "regions": regions}
+        self.db.execute("INSERT INTO templates (value, created) VALUES (?, ?)",
+                        (json.dumps(template, ensure_ascii=False), time.time()))
+        self.db.commit()
+        self._load_new() # Picks up this template and any stored by other workers meanwhile
+
+    def close(self):
+        self.db.close()
+
+
+def report_template_statuses(statuses):
+    """Prints the template hit rate and the fallbacks to full analysis from the per-page statuses."""
+    statuses = [s for s in statuses if s is not None] # Pages served from the result cache have none
+    if not statuses:
+        return
+    hits = statuses.count(TEMPLATE_HIT)
+    misses = statuses.count(TEMPLATE_MISS)
+    blank = statuses.count(TEMPLATE_NO_FINGERPRINT)
+    print(f"Layout templates: {hits} hits, {misses + blank} fallbacks to full analysis ({misses} unmatched "
+          f"layouts, {blank} pages without a fingerprint), hit rate {hits / len(statuses):.1%}")
@@ -0,0 +1,320 @@
+"""
+Concurrent, rate-limited batch client for the Mistral OCR API.
+
+mistral_ocrtest.py handles one file per process with blocking SDK calls. This module sends many
+images/PDFs concurrently over one pooled HTTP client (httpx), with:
+  * a concurrency cap (in-flight documents) and a token-bucket request rate limit,
+  * retries with exponential backoff and jitter on 429 / 5xx / connection errors (Retry-After honoured),
+  * results streamed to a JSONL file as they complete,
+  * latency percentiles and throughput reported at the end.
+
+Request bodies are streamed: image files are base64-encoded chunk by chunk straight into the HTTP
+body (supported formats are never decoded), PDFs are uploaded from the open file. Identical files in
+a run are sent once, and with --upload_cache PDFs uploaded in earlier runs are not uploaded again.
+
+--base_url can point at mistral_stub_server.py to exercise the client locally.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import httpx
+
+from mistral_uploads import UploadCache, base64_length, file_digest, iter_base64, prepare_image, sniff_mime
+from ocr_trace import percentile
+from ocr_workers import IMAGE_EXTENSIONS, collect_image_inputs
+
+DEFAULT_BASE_URL = "https://api.mistral.ai"
+OCR_MODEL = "mistral-ocr-latest"
+RETRY_STATUS = {429, 500, 502, 503, 504}
+SIGNED_URL_EXPIRY_HOURS = 24
+DOCUMENT_EXTENSIONS = IMAGE_EXTENSIONS + ('.gif', '.pdf')
+
+
+class TokenBucket:
+    """Async token bucket: allows `rate` requests per second on average, with bursts up to `burst`."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst if burst else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class OCRRequestError(Exception):
+    """Raised when a request still fails after all retries."""
+
+
+def _retry_delay(response, attempt, backoff):
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+    return backoff * (2 ** attempt) * (0.5 + random.random()) # Exponential backoff with jitter
+
+
+async def request_with_retry(client, bucket, method, url, max_retries=5, backoff=0.5, body_factory=None, **kwargs):
+    """
+    Sends one request through the rate limiter, retrying on 429/5xx, connection errors and timeouts.
+    Returns (response, retries). body_factory, if given, is called for every attempt and must return a
+    context manager yielding extra request kwargs (streamed bodies cannot be replayed).
+    """
+    for attempt in range(max_retries + 1):
+        await bucket.acquire()
+        response = None
+        try:
+            with body_factory() if body_factory else contextlib.nullcontext({}) as body:
+                response = await client.request(method, url, **kwargs, **body)
+        except (httpx.NetworkError, httpx.TimeoutException) as e:
+            error = f"{type(e).__name__}: {e}"
+        else:
+            if response.status_code not in RETRY_STATUS:
+                if response.status_code >= 400:
+                    raise OCRRequestError(f"{method} {url} failed with HTTP {response.status_code}: {response.text[:200]}")
+                return response, attempt
+            error = f"HTTP {response.status_code}"
+        if attempt == max_retries:
+            raise OCRRequestError(f"{method} {url} failed after {attempt + 1} attempts ({error})")
+        await asyncio.sleep(_retry_delay(response, attempt, backoff))
+
+
+def image_ocr_body(source, size, mime_type):
+    """
+    Returns a body factory for an OCR request with an inline image. The JSON body is streamed: the
+    base64 data URI is produced chunk by chunk (in a worker thread) while the request is being sent.
+    """
+    prefix = ('{"model": %s, "document": {"type": "image_url", "image_url": "data:%s;base64,'
+              % (json.dumps(OCR_MODEL), mime_type)).encode("ascii")
+    suffix = b'"}}'
+    headers = {"Content-Type": "application/json",
+               "Content-Length": str(len(prefix) + base64_length(size) + len(suffix))}
+
+    @contextlib.contextmanager
+    def factory():
+        chunks = iter_base64(source)
+
+        async def stream():
+            yield prefix
+            while True:
+                chunk = await asyncio.to_thread(next, chunks, None)
+                if chunk is None:
+                    break
+                yield chunk
+            yield suffix
+
+        try:
+            yield {"content": stream(), "headers": headers}
+        finally:
+            with contextlib.suppress(ValueError): # Still running in a thread if the request was cancelled
+                chunks.close()
+    return factory
+
+
+def pdf_upload_body(path):
+    """Returns a body factory for the multipart upload of a PDF, streamed from the open file."""
+    @contextlib.contextmanager
+    def factory():
+        with open(path, "rb") as f:
+            yield {"files": {"file": (os.path.basename(path), f, "application/pdf")}, "data": {"purpose": "ocr"}}
+    return factory
+
+
+async def pdf_document_url(client, bucket, path, digest, upload_cache=None, max_retries=5):
+    """
+    Returns (signed_url, retries, upload) for a PDF, where upload is "cached", "refreshed" (known file,
+    new signed URL) or "new". Only uploads the file when upload_cache has not seen its content before.
+    """
+    retries = 0
+    file_id = None
+    cached = upload_cache.lookup(digest) if upload_cache is not None else None
+    if cached is not None:
+        file_id, url = cached
+        if url:
+            return url, retries, "cached"
+    if file_id is not None:
+        try:
+            response, r = await request_with_retry(client, bucket, "GET", f"/v1/files/{file_id}/url", max_retries,
+                                                   params={"expiry": SIGNED_URL_EXPIRY_HOURS})
+            retries += r
+            url = response.json()["url"]
+            upload_cache.store(digest, file_id, url, SIGNED_URL_EXPIRY_HOURS)
+            return url, retries, "refreshed"
+        except OCRRequestError:
+            upload_cache.forget(digest) # The file is gone on the server side; upload it again
+
+    # Upload -> signed URL, the same sequence as mistral_ocrtest.py
+    response, r = await request_with_retry(client, bucket, "POST", "/v1/files", max_retries,
+                                           body_factory=pdf_upload_body(path))
+    retries += r
+    file_id = response.json()["id"]
+    response, r = await request_with_retry(client, bucket, "GET", f"/v1/files/{file_id}/url", max_retries,
+                                           params={"expiry": SIGNED_URL_EXPIRY_HOURS})
+    retries += r
+    url = response.json()["url"]
+    if upload_cache is not None:
+        upload_cache.store(digest, file_id, url, SIGNED_URL_EXPIRY_HOURS)
+    return url, retries, "new"
+
+
+async def ocr_document(client, bucket, path, digest, upload_cache=None, max_retries=5):
+    """OCRs one image or PDF. Returns a result dict (never raises), ready to be written as a JSONL line."""
+    start = time.perf_counter()
+    retries = 0
+    extra = {}
+    try:
+        if await asyncio.to_thread(sniff_mime, path) == "application/pdf":
+            url, retries, extra["upload"] = await pdf_document_url(client, bucket, path, digest, upload_cache,
+                                                                   max_retries)
+            body = {"json": {"model": OCR_MODEL, "document": {"type": "document_url", "document_url": url}}}
+        else:
+            # Only unsupported formats are decoded (to PNG); keep that CPU work off the event loop
+            source, size, mime_type = await asyncio.to_thread(prepare_image, path)
+            body = {"body_factory": image_ocr_body(source, size, mime_type)}
+            extra["payload_bytes"] = base64_length(size)
+
+        response, r = await request_with_retry(client, bucket, "POST", "/v1/ocr", max_retries, **body)
+        retries += r
+        return {"file": path, "ok": True, "latency": time.perf_counter() - start, "retries": retries, **extra,
+                "response": response.json()}
+    except Exception as e:
+        return {"file": path, "ok": False, "latency": time.perf_counter() - start, "retries": retries,
+                "error": str(e)}
+
+
+async def run_batch(paths, output_jsonl, base_url=DEFAULT_BASE_URL, api_key="", concurrency=8, rate=5.0,
+                    burst=None, max_retries=5, timeout=120.0, upload_cache=None):
+    """
+    OCRs all paths concurrently and streams one JSON line per document to output_jsonl as they finish.
+    Files with identical contents are sent once and share the result.
+    Returns a stats dict (documents, failures, elapsed seconds, throughput and latency percentiles).
+    """
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+    bucket = TokenBucket(rate, burst)
+    semaphore = asyncio.Semaphore(concurrency)
+    inflight = {}
+    latencies = []
+    failures = 0
+    retries = 0
+    duplicates = 0
+
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, limits=limits, timeout=timeout) as client:
+        async def process(path, digest):
+            async with semaphore: # Caps in-flight documents, and therefore buffered payloads in memory
+                return await ocr_document(client, bucket, path, digest, upload_cache, max_retries)
+
+        async def bounded(path):
+            start = time.perf_counter()
+            digest = await asyncio.to_thread(file_digest, path)
+            task = inflight.get(digest)
+            if task is None:
+                task = inflight[digest] = asyncio.ensure_future(process(path, digest))
+                return await task
+            result = await task
+            return dict(result, file=path, latency=time.perf_counter() - start, retries=0,
+                        duplicate_of=result["file"])
+
+        start = time.perf_counter()
+        with open(output_jsonl, "w", encoding="utf-8") as out:
+            for done, future in enumerate(asyncio.as_completed([bounded(path) for path in paths]), start=1):
+                result = await future
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+                retries += result["retries"]
+                duplicates += "duplicate_of" in result
+                if result["ok"]:
+                    latencies.append(result["latency"])
+                else:
+                    failures += 1
+                    print(f"Error: {result['file']}: {result['error']}")
+                if done % 10 == 0 or done == len(paths):
+                    print(f"Completed {done}/{len(paths)} documents...")
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "documents": len(paths),
+        "failures": failures,
+        "retries": retries,
+        "duplicates": duplicates,
+        "elapsed": elapsed,
+        "throughput": len(paths) / elapsed if elapsed > 0 else 0.0,
+        "p50": percentile(latencies, 50),
+        "p90": percentile(latencies, 90),
+        "p99": percentile(latencies, 99),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch OCR of images/PDFs with the Mistral OCR API.")
+    parser.add_argument("inputs", type=str, nargs="*", help="Image/PDF files, directories or glob patterns.")
+    parser.add_argument("--file_list", type=str, default=None, help="Text file with one document path per line.")
+    parser.add_argument("--output", type=str, default="./output/mistral_results.jsonl",
+                        help="JSONL file the results are streamed to (default: ./output/mistral_results.jsonl).")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum documents in flight (default: 8).")
+    parser.add_argument("--rate", type=float, default=5.0, help="Maximum requests per second, 0 for unlimited (default: 5).")
+    parser.add_argument("--burst", type=float, default=None, help="Token bucket size (default: same as --rate).")
+    parser.add_argument("--max_retries", type=int, default=5, help="Retries on 429/5xx/connection errors (default: 5).")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds (default: 120).")
+    parser.add_argument("--base_url", type=str, default=os.environ.get("MISTRAL_BASE_URL", DEFAULT_BASE_URL),
+                        help="API base URL, e.g. http://127.0.0.1:8765 for mistral_stub_server.py.")
+    parser.add_argument("--upload_cache", type=str, default=None,
+                        help="SQLite file remembering uploaded PDFs by content hash, so they are not uploaded again.")
+    parser.add_argument("--trace_memory", action="store_true",
+                        help="Track Python memory allocations and report the peak per in-flight request (slower).")
+    args = parser.parse_args()
+
+    if not args.inputs and not args.file_list:
+        parser.error("at least one file, directory, glob pattern or --file_list is required")
+    api_key = os.environ.get("MISTRAL_API_KEY")
+    if not api_key and args.base_url == DEFAULT_BASE_URL:
+        print("Error: MISTRAL_API_KEY is not set.")
+        sys.exit(1)
+
+    paths = [path for path, _ in collect_image_inputs(args.inputs, args.file_list, DOCUMENT_EXTENSIONS)]
+    if not paths:
+        print("Error: No documents found for the given inputs.")
+        sys.exit(1)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+
+    print(f"OCR of {len(paths)} documents via {args.base_url} (concurrency {args.concurrency}, rate {args.rate}/s)")
+    upload_cache = UploadCache(args.upload_cache) if args.upload_cache else None
+    if args.trace_memory:
+        tracemalloc.start()
+    stats = asyncio.run(run_batch(paths, args.output, args.base_url, api_key or "", args.concurrency, args.rate,
+                                  args.burst, args.max_retries, args.timeout, upload_cache))
+    print(f"\nProcessed {stats['documents']} documents ({stats['failures']} failed, {stats['retries']} retries, "
+          f"{stats['duplicates']} duplicates) in {stats['elapsed']:.1f}s: {stats['throughput']:.2f} documents/sec")
+    print(f"Latency p50 {stats['p50']:.3f}s, p90 {stats['p90']:.3f}s, p99 {stats['p99']:.3f}s")
+    if args.trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        in_flight = max(1, min(args.concurrency, len(paths)))
+        print(f"Peak traced memory {peak / 2**20:.1f} MiB, {peak / in_flight / 2**20:.2f} MiB per in-flight request")
+    if upload_cache is not None:
+        upload_cache.report()
+        upload_cache.close()
+    print(f"Results written to {args.output}")
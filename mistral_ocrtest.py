@@ -1,61 +1,19 @@
 import requests
 import os
 import sys
-from mistralai import Mistral
-import base64 
+import argparse
 from PIL import Image 
-import io 
+
+from mistral_uploads import UploadCache, encode_file_base64, file_digest, prepare_image
 
 def encode_image(image_path):
-    """Encode the image to base64. Converts WEBP to PNG in memory. Returns (base64_string, mime_type)."""
+    """
+    Encode the image to base64. Returns (base64_string, mime_type).
+    PNG/JPEG/WEBP/GIF files are encoded as-is without decoding; other formats are converted to PNG.
+    """
     try:
-        file_extension = os.path.splitext(image_path)[1].lower()
-        mime_type = ""
-
-        if file_extension == '.webp':
-            with Image.open(image_path) as img:
-                if img.mode == 'RGBA' or img.mode == 'LA' or (img.mode == 'P' and 'transparency' in img.info):
-                    img = img.convert('RGB') # Or 'RGBA' if alpha needed by API and supported
-                
-                byte_io = io.BytesIO()
-                img.save(byte_io, format='PNG')
-                image_bytes = byte_io.getvalue()
-                mime_type = 'image/png'
-                return base64.b64encode(image_bytes).decode('utf-8'), mime_type
-        elif file_extension == '.png':
-            with open(image_path, "rb") as image_file:
-                mime_type = 'image/png'
-                return base64.b64encode(image_file.read()).decode('utf-8'), mime_type
-        elif file_extension in ['.jpg', '.jpeg']:
-            with open(image_path, "rb") as image_file:
-                mime_type = 'image/jpeg'
-                return base64.b64encode(image_file.read()).decode('utf-8'), mime_type
-        else:
-            # Default for other types, attempt to read but MIME type might be generic or incorrect for specific APIs
-            # For robust solution, you might want to convert other types to a standard format (e.g., PNG) too
-            # or use a library to determine MIME type more accurately.
-            print(f"Warning: Unsupported file extension {file_extension}. Attempting to encode directly. Specify MIME type if known.")
-            with open(image_path, "rb") as image_file:
-                # Generic binary stream, API might reject or misinterpret.
-                # For Mistral vision, they typically expect image/jpeg, image/png, image/webp, image/gif.
-                # It's safer to convert to one of these or reject unsupported types.
-                # For now, let's default to 'application/octet-stream' or let it fail if API doesn't like it.
-                # Better: convert to PNG as a fallback for safety if possible.
-                try:
-                    with Image.open(image_path) as img: # Try to open with PIL to convert to PNG
-                        if img.mode == 'RGBA' or img.mode == 'LA' or (img.mode == 'P' and 'transparency' in img.info):
-                             img = img.convert('RGB')
-                        byte_io = io.BytesIO()
-                        img.save(byte_io, format='PNG')
-                        image_bytes = byte_io.getvalue()
-                        mime_type = 'image/png'
-                        print(f"Notice: Converted {file_extension} to PNG for encoding.")
-                        return base64.b64encode(image_bytes).decode('utf-8'), mime_type
-                except Exception as pil_e:
-                    print(f"Could not process {file_extension} with PIL ({pil_e}), sending as raw bytes. API might not support this.")
-                    # This path is risky for image APIs. Best to ensure conversion to a supported format.
-                    return base64.b64encode(image_file.read()).decode('utf-8'), 'application/octet-stream' 
-
+        source, size, mime_type = prepare_image(image_path)
+        return encode_file_base64(source, size), mime_type
     except FileNotFoundError:
         print(f"Error: The file {image_path} was not found.")
         return None, None
@@ -63,12 +21,6 @@ def encode_image(image_path):
         print(f"Error processing image {image_path}: {e}")
         return None, None
 
-# Path to your image
-file_path = sys.argv[1]
-api_key = os.environ["MISTRAL_API_KEY"]
-client = Mistral(api_key=api_key)
-
-
 def is_image(file_path):
     try:
         with Image.open(file_path) as img:
@@ -80,46 +32,88 @@ def is_image(file_path):
 def is_pdf(file_path):
     try:
         with open(file_path, "rb") as f:
-            return f.read().startswith(b"%PDF-")
+            return f.read(5) == b"%PDF-"
     except Exception as e:
         print(f"Error opening PDF {file_path}: {e}")
         return False
 
-if is_image(file_path):
-    image_path = file_path
+def get_pdf_url(client, pdf_path, upload_cache=None, expiry_hours=24):
+    """Uploads a PDF (unless the same content was uploaded before) and returns a signed URL for it."""
+    digest = file_digest(pdf_path) if upload_cache is not None else None
+    cached = upload_cache.lookup(digest) if upload_cache is not None else None
+    if cached is not None:
+        file_id, url = cached
+        if url:
+            return url
+        try:
+            url = client.files.get_signed_url(file_id=file_id, expiry=expiry_hours).url
+            upload_cache.store(digest, file_id, url, expiry_hours)
+            return url
+        except Exception as e:
+            print(f"Notice: Cached upload {file_id} is no longer available ({e}), uploading again.")
+            upload_cache.forget(digest)
+
+    with open(pdf_path, "rb") as pdf_file: # The SDK streams the file object
+        uploaded_pdf = client.files.upload(
+            file={
+                "file_name": os.path.basename(pdf_path),
+                "content": pdf_file,
+            },
+            purpose="ocr"
+        )
+    url = client.files.get_signed_url(file_id=uploaded_pdf.id, expiry=expiry_hours).url
+    if upload_cache is not None:
+        upload_cache.store(digest, uploaded_pdf.id, url, expiry_hours)
+    return url
+
+def main():
+    from mistralai import Mistral
+
+    parser = argparse.ArgumentParser(description="OCR one image or PDF with the Mistral OCR API.")
+    parser.add_argument("file_path", type=str, help="Path to the image or PDF file.")
+    parser.add_argument("--upload_cache", type=str, default=None,
+                        help="SQLite file remembering uploaded PDFs by content hash, so they are not uploaded again.")
+    args = parser.parse_args()
+
+    # Path to your image
+    file_path = args.file_path
+    api_key = os.environ["MISTRAL_API_KEY"]
+    client = Mistral(api_key=api_key)
+
+    if is_image(file_path):
+        image_path = file_path
+
+        # Getting the base64 string
+        base64_image_content, image_mime_type = encode_image(image_path)
 
-    # Getting the base64 string
-    base64_image_content, image_mime_type = encode_image(image_path)
+        ocr_response = client.ocr.process(
+            model="mistral-ocr-latest",
+            document={
+                "type": "image_url",
+                "image_url": f"data:{image_mime_type};base64,{base64_image_content}" 
+            }
+        )
 
-    ocr_response = client.ocr.process(
-        model="mistral-ocr-latest",
-        document={
-            "type": "image_url",
-            "image_url": f"data:{image_mime_type};base64,{base64_image_content}" 
-        }
-    )
+        #import pdb; pdb.set_trace()
 
-    #import pdb; pdb.set_trace()
+        print(ocr_response)
+    elif is_pdf(file_path):
+        upload_cache = UploadCache(args.upload_cache) if args.upload_cache else None
+        signed_url = get_pdf_url(client, file_path, upload_cache)
+        if upload_cache is not None:
+            upload_cache.report()
+            upload_cache.close()
+        ocr_response = client.ocr.process(
+            model="mistral-ocr-latest",
+            document={
+                "type": "document_url",
+                "document_url": signed_url,
+            }
+        )
+        print(ocr_response)
+    else:
+        print(f"Error: The file {file_path} is not an image.")
+        sys.exit(1)
 
-    print(ocr_response)
-elif is_pdf(file_path):
-    pdf_path = file_path
-    uploaded_pdf = client.files.upload(
-        file={
-            "file_name": "uploaded_file.pdf",
-            "content": open(pdf_path, "rb"),
-        },
-        purpose="ocr"
-    )
-    signed_url = client.files.get_signed_url(file_id=uploaded_pdf.id)
-    ocr_response = client.ocr.process(
-        model="mistral-ocr-latest",
-        document={
-            "type": "document_url",
-            "document_url": signed_url.url,
-        }
-    )
-    print(ocr_response)
-else:
-    print(f"Error: The file {file_path} is not an image.")
-    sys.exit(1)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Local stand-in for the Mistral OCR API, for exercising mistral_batch.py without an API key.
+
+Implements POST /v1/ocr, POST /v1/files and GET /v1/files/{id}/url with a configurable response
+latency and a random rate of 429 / 503 errors (with Retry-After) to test the retry path.
+"""
+import argparse
+import base64
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FILE_URL_PATTERN = re.compile(r"^/v1/files/([^/]+)/url$")
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive, so the client's connection pool is exercised
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length) if length else b""
+
+    def _simulate(self):
+        """Sleeps for the configured latency; returns True if this request should fail."""
+        server = self.server
+        time.sleep(max(0.0, random.gauss(server.latency, server.latency * 0.2)))
+        with server.lock:
+            server.requests += 1
+        if random.random() < server.error_rate:
+            status = random.choice((429, 503))
+            self._send_json(status, {"message": "stub error"}, {"Retry-After": "0.1"} if status == 429 else None)
+            return True
+        return False
+
+    def do_POST(self):
+        body = self._read_body()
+        if self._simulate():
+            return
+        if self.path == "/v1/files":
+            file_id = uuid.uuid4().hex
+            with self.server.lock:
+                self.server.files.add(file_id)
+            self._send_json(200, {"id": file_id, "object": "file", "bytes": len(body), "purpose": "ocr"})
+        elif self.path == "/v1/ocr":
+            try:
+                document = json.loads(body)["document"]
+            except (ValueError, KeyError):
+                self._send_json(422, {"message": "invalid request"})
+                return
+            source = document.get("image_url") or document.get("document_url") or ""
+            if source.startswith("data:"):
+                try:
+                    base64.b64decode(source.split(",", 1)[1], validate=True)
+                except (IndexError, ValueError):
+                    self._send_json(422, {"message": "invalid base64 image"})
+                    return
+            self._send_json(200, {
+                "model": "mistral-ocr-latest",
+                "pages": [{"index": 0, "markdown": f"# Stub page\n\n{len(source)} bytes of {document.get('type')}",
+                           "images": [], "dimensions": None}],
+                "usage_info": {"pages_processed": 1, "doc_size_bytes": len(source)},
+            })
+        else:
+            self._send_json(404, {"message": "not found"})
+
+    def do_GET(self):
+        match = FILE_URL_PATTERN.match(self.path.split("?", 1)[0])
+        if not match:
+            self._send_json(404, {"message": "not found"})
+            return
+        if self._simulate():
+            return
+        with self.server.lock:
+            known = match.group(1) in self.server.files
+        if not known:
+            self._send_json(404, {"message": "file not found"})
+            return
+        self._send_json(200, {"url": f"http://{self.headers.get('Host')}/signed/{match.group(1)}"})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stub of the Mistral OCR and files endpoints.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to bind (default: 127.0.0.1).")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on (default: 8765).")
+    parser.add_argument("--latency_ms", type=float, default=200.0, help="Mean response latency in ms (default: 200).")
+    parser.add_argument("--error_rate", type=float, default=0.05,
+                        help="Fraction of requests answered with 429/503 (default: 0.05).")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    server.latency = args.latency_ms / 1000.0
+    server.error_rate = args.error_rate
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.files = set()
+    print(f"Mistral OCR stub listening on http://{args.host}:{args.port} "
+          f"(latency {args.latency_ms:.0f} ms, error rate {args.error_rate:.0%})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\nServed {server.requests} requests, {len(server.files)} uploads")
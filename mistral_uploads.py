@@ -0,0 +1,158 @@
+"""
+Upload layer for the Mistral OCR scripts.
+
+Images in a format the API accepts (PNG, JPEG, WEBP, GIF) are sent as-is, never decoded; the format
+is taken from the file's magic bytes rather than its extension. Base64 is produced in fixed-size
+chunks, either into one preallocated buffer (encode_file_base64) or as a stream that an HTTP request
+body can be fed from (iter_base64), so no full raw/encoded copies pile up in memory.
+
+UploadCache maps a file's content hash to the id of the uploaded file and its signed URL (with
+expiry) in a small SQLite file, so a document that was uploaded before is not uploaded again.
+"""
+import io
+import os
+import time
+import base64
+import sqlite3
+import hashlib
+import threading
+
+# Multiple of 3, so every chunk but the last encodes to base64 without padding
+CHUNK_SIZE = 3 * 256 * 1024
+
+# Magic bytes -> MIME type of the formats the OCR endpoint accepts directly
+SUPPORTED_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"%PDF-", "application/pdf"),
+)
+
+# Signed URLs are treated as expired this many seconds before their real expiry
+EXPIRY_MARGIN = 300
+
+
+def sniff_mime(path):
+    """Returns the MIME type of a supported file from its magic bytes, or None for other formats."""
+    with open(path, "rb") as f:
+        head = f.read(12)
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, mime_type in SUPPORTED_SIGNATURES:
+        if head.startswith(signature):
+            return mime_type
+    return None
+
+
+def file_digest(path):
+    """Hashes a file's contents in chunks (BLAKE2, hex)."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def base64_length(size):
+    """Length of the base64 encoding of size bytes."""
+    return 4 * ((size + 2) // 3)
+
+
+def convert_to_png(path):
+    """Decodes an unsupported image format with PIL and returns it as PNG bytes."""
+    from PIL import Image
+    with Image.open(path) as img:
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        byte_io = io.BytesIO()
+        img.save(byte_io, format="PNG")
+    return byte_io.getvalue()
+
+
+def prepare_image(path):
+    """
+    Returns (source, size, mime_type) for an image to send: source is the path itself for supported
+    formats, or PNG bytes when the file had to be converted.
+    """
+    mime_type = sniff_mime(path)
+    if mime_type is not None and mime_type != "application/pdf":
+        return path, os.path.getsize(path), mime_type
+    png = convert_to_png(path)
+    print(f"Notice: Converted {os.path.basename(path)} to PNG for encoding.")
+    return png, len(png), "image/png"
+
+
+def iter_base64(source, chunk_size=CHUNK_SIZE):
+    """Yields the base64 encoding of a file path or a bytes object in chunks (ASCII bytes)."""
+    if isinstance(source, (bytes, bytearray)):
+        view = memoryview(source)
+        for start in range(0, len(view), chunk_size):
+            yield base64.b64encode(view[start : start + chunk_size])
+        return
+    with open(source, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            yield base64.b64encode(chunk)
+
+
+def encode_file_base64(source, size):
+    """Base64-encodes a file path or bytes object into one preallocated buffer and returns it as a str."""
+    encoded = bytearray(base64_length(size))
+    offset = 0
+    for chunk in iter_base64(source):
+        encoded[offset : offset + len(chunk)] = chunk
+        offset += len(chunk)
+    return encoded.decode("ascii")
+
+
+class UploadCache:
+    """Persistent content hash -> (uploaded file id, signed URL, URL expiry) map."""
+
+    def __init__(self, db_path):
+        parent = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(parent, exist_ok=True)
+        self.lock = threading.Lock()
+        self.counters = {"url_hits": 0, "file_hits": 0, "misses": 0}
+        self.db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS uploads (digest TEXT PRIMARY KEY, file_id TEXT, url TEXT, "
+                        "expires_at REAL)")
+        self.db.commit()
+
+    def lookup(self, digest):
+        """
+        Returns (file_id, url) for a previously uploaded file. url is None when the signed URL has
+        expired (the file id can still be used to request a new one); returns None if never uploaded.
+        """
+        with self.lock:
+            row = self.db.execute("SELECT file_id, url, expires_at FROM uploads WHERE digest = ?",
+                                  (digest,)).fetchone()
+            if row is None:
+                self.counters["misses"] += 1
+                return None
+            file_id, url, expires_at = row
+            if url and expires_at - EXPIRY_MARGIN > time.time():
+                self.counters["url_hits"] += 1
+                return file_id, url
+            self.counters["file_hits"] += 1
+            return file_id, None
+
+    def store(self, digest, file_id, url, expiry_hours):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO uploads (digest, file_id, url, expires_at) VALUES (?, ?, ?, ?)",
+                            (digest, file_id, url, time.time() + expiry_hours * 3600))
+            self.db.commit()
+
+    def forget(self, digest):
+        """Drops an entry, e.g. when the server no longer knows the file id."""
+        with self.lock:
+            self.db.execute("DELETE FROM uploads WHERE digest = ?", (digest,))
+            self.db.commit()
+
+    def report(self):
+        c = self.counters
+        print(f"Upload cache: {c['url_hits']} signed URL hits, {c['file_hits']} file id hits "
+              f"(URL refreshed), {c['misses']} new uploads")
+
+    def close(self):
+        self.db.close()
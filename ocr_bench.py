@@ -0,0 +1,595 @@
+"""
+Reproducible OCR benchmark suite.
+
+Generates deterministic synthetic inputs offline (Chinese text drawn from ppocr_keys_v1.txt rendered
+into fixed-grid tables, tall receipts and mixed text/table pages), runs the existing pipelines on
+them and reports images/sec, cells/sec, per-stage latency, peak RSS and accuracy against the known
+ground truth. Each case runs in a fresh process, so model loading and peak memory do not leak
+between cases. Results are saved as JSON; --compare flags throughput or accuracy regressions
+against an earlier run (exit code 1).
+
+    python ocr_bench.py --output ./bench/current.json
+    python ocr_bench.py --output ./bench/new.json --compare ./bench/current.json
+
+Cases:
+    grid          ocrtest_fixed.process_image_fixed_grid (per-cell det + rec)
+    grid_batched  ocrtest_fixed.process_image_fixed_grid_batched (--rec_only path)
+    document      ocrtest.process_image with the shared det/rec pipeline
+    receipt       tiled_ocr.ocr_tiled on tall receipts
+    split         split_image.iter_tiles on tall receipts (no models)
+    startup       time to first result of a fresh `python ocrtest.py` process for one page
+    mistral_batch mistral_batch.run_batch against an in-process stub server (needs httpx)
+"""
+import argparse
+import concurrent.futures
+import contextlib
+import glob
+import json
+import multiprocessing as mp
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from ocr_trace import instrument, percentile, tracer
+
+REC_CHAR_DICT_PATH = "./ppocr_keys_v1.txt"
+# Fonts tried in order when --font is not given; any font with Chinese glyphs works
+FONT_CANDIDATES = ("./fonts/simfang.ttf", "/usr/share/fonts/**/*CJK*", "/usr/share/fonts/**/wqy*",
+                   "/usr/share/fonts/**/*[Ss]im[Hh]ei*", "/usr/share/fonts/**/*[Ss]im[Ss]un*",
+                   "C:/Windows/Fonts/simfang.ttf", "/System/Library/Fonts/PingFang.ttc")
+
+ALL_CASES = ("grid", "grid_batched", "document", "receipt", "split", "startup", "mistral_batch")
+
+# ocrtest.py command-line variants timed by the startup case
+STARTUP_MODES = (("structure", []), ("text_only", ["--text_only"]), ("separate_engines", ["--separate_engines"]))
+
+# Dataset sizes: pages per generator
+SCALES = {
+    "small": {"grid": 3, "receipt": 2, "document": 3},
+    "medium": {"grid": 10, "receipt": 5, "document": 10},
+    "large": {"grid": 40, "receipt": 20, "document": 40},
+}
+
+GRID_ROWS = 30
+GRID_ROW_HEIGHT = 40
+GRID_COL_WIDTHS = (120, 200, 160, 200, 120, 160)
+
+
+# --- Synthetic data ---
+
+def load_charset(dict_path=REC_CHAR_DICT_PATH):
+    """Returns the CJK characters of the recognition dictionary plus digits."""
+    with open(dict_path, encoding="utf-8") as f:
+        chars = [line.rstrip("\n") for line in f]
+    cjk = [c for c in chars if len(c) == 1 and "\u4e00" <= c <= "\u9fff"]
+    return cjk + list("0123456789")
+
+
+def find_font(font_path=None):
+    """Returns a font file that can render Chinese, or raises FileNotFoundError."""
+    if font_path:
+        if not os.path.exists(font_path):
+            raise FileNotFoundError(f"font not found: {font_path}")
+        return font_path
+    for pattern in FONT_CANDIDATES:
+        matches = sorted(glob.glob(pattern, recursive=True))
+        if matches:
+            return matches[0]
+    raise FileNotFoundError("no font with Chinese glyphs found; pass --font (e.g. ./fonts/simfang.ttf)")
+
+
+def random_text(rng, chars, min_len, max_len):
+    return "".join(rng.choice(chars) for _ in range(rng.randint(min_len, max_len)))
+
+
+def fit_text(text, font, max_width):
+    """Shortens text until it fits into max_width pixels."""
+    while text and font.getlength(text) > max_width:
+        text = text[:-1]
+    return text
+
+
+def make_grid_page(rng, chars, font_path, rows=GRID_ROWS, row_height=GRID_ROW_HEIGHT, col_widths=GRID_COL_WIDTHS,
+                   blank_fraction=0.15):
+    """Renders a ruled fixed-grid table. Returns (image, cell_texts) with cell_texts[row][col]."""
+    font = ImageFont.truetype(font_path, int(row_height * 0.55))
+    width, height = sum(col_widths), rows * row_height
+    img = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(img)
+    truth = []
+    for r in range(rows):
+        y = r * row_height
+        draw.line([(0, y), (width, y)], fill=(150, 150, 150))
+        row, x = [], 0
+        for w in col_widths:
+            text = "" if rng.random() < blank_fraction else fit_text(random_text(rng, chars, 2, 8), font, w - 16)
+            if text:
+                draw.text((x + 8, y + row_height * 0.2), text, font=font, fill="black")
+            row.append(text)
+            x += w
+        truth.append(row)
+    x = 0
+    for w in col_widths:
+        draw.line([(x, 0), (x, height)], fill=(150, 150, 150))
+        x += w
+    return np.array(img), truth
+
+
+def make_receipt(rng, chars, font_path, lines=120, width=600, line_height=36):
+    """Renders a tall receipt of single text lines. Returns (image, line_texts)."""
+    font = ImageFont.truetype(font_path, 22)
+    img = Image.new("RGB", (width, lines * line_height + 40), "white")
+    draw = ImageDraw.Draw(img)
+    truth = []
+    for i in range(lines):
+        text = fit_text(random_text(rng, chars, 4, 16), font, width - 40)
+        draw.text((20, 20 + i * line_height), text, font=font, fill="black")
+        truth.append(text)
+    return np.array(img), truth
+
+
+def make_document_page(rng, chars, font_path, width=1240, height=1754):
+    """Renders a page with a title, paragraphs and a ruled table. Returns (image, line_texts)."""
+    title_font = ImageFont.truetype(font_path, 40)
+    font = ImageFont.truetype(font_path, 26)
+    img = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(img)
+    truth = []
+
+    title = random_text(rng, chars, 6, 12)
+    draw.text((100, 80), title, font=title_font, fill="black")
+    truth.append(title)
+
+    def paragraph(y, count):
+        for _ in range(count):
+            text = fit_text(random_text(rng, chars, 20, 36), font, width - 200)
+            draw.text((100, y), text, font=font, fill="black")
+            truth.append(text)
+            y += 44
+        return y
+
+    y = paragraph(180, rng.randint(5, 9)) + 40
+    rows, cols, row_height, col_width = rng.randint(5, 8), 4, 56, (width - 200) // 4
+    for r in range(rows + 1):
+        draw.line([(100, y + r * row_height), (100 + cols * col_width, y + r * row_height)], fill="black", width=2)
+    for c in range(cols + 1):
+        draw.line([(100 + c * col_width, y), (100 + c * col_width, y + rows * row_height)], fill="black", width=2)
+    for r in range(rows):
+        for c in range(cols):
+            text = fit_text(random_text(rng, chars, 2, 6), font, col_width - 24)
+            draw.text((112 + c * col_width, y + r * row_height + 14), text, font=font, fill="black")
+            truth.append(text)
+    paragraph(y + rows * row_height + 60, rng.randint(4, 8))
+    return np.array(img), truth
+
+
+def generate_dataset(data_dir, scale="small", seed=0, font_path=None):
+    """Writes the synthetic pages and manifest.json (ground truth) to data_dir. Returns the manifest."""
+    rng = random.Random(seed)
+    chars = load_charset()
+    font_path = find_font(font_path)
+    counts = SCALES[scale]
+    manifest = {"seed": seed, "scale": scale, "font": os.path.basename(font_path),
+                "grid": {"row_height": GRID_ROW_HEIGHT, "col_widths": list(GRID_COL_WIDTHS), "pages": []},
+                "receipt": [], "document": []}
+    generators = (("grid", lambda: make_grid_page(rng, chars, font_path)),
+                  ("receipt", lambda: make_receipt(rng, chars, font_path)),
+                  ("document", lambda: make_document_page(rng, chars, font_path)))
+    for kind, generate in generators:
+        os.makedirs(os.path.join(data_dir, kind), exist_ok=True)
+        for i in range(counts[kind]):
+            img, truth = generate()
+            path = os.path.join(data_dir, kind, f"{kind}_{i:03d}.png")
+            Image.fromarray(img).save(path)
+            entry = {"path": path, "truth": truth}
+            (manifest["grid"]["pages"] if kind == "grid" else manifest[kind]).append(entry)
+    with open(os.path.join(data_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+# --- Accuracy ---
+
+def edit_distance(a, b):
+    """Levenshtein distance between two strings."""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def grid_accuracy(pages):
+    """pages: [(truth_rows, predicted_rows)]. Returns cell exact-match rate and character accuracy."""
+    cells = exact = errors = total = 0
+    for truth, predicted in pages:
+        for r, truth_row in enumerate(truth):
+            for c, expected in enumerate(truth_row):
+                got = predicted[r][c].strip() if r < len(predicted) and c < len(predicted[r]) else ""
+                cells += 1
+                exact += got == expected
+                errors += edit_distance(expected, got)
+                total += len(expected)
+    return {"cell_exact": round(exact / cells, 4) if cells else 0.0,
+            "char_accuracy": round(max(0.0, 1 - errors / total), 4) if total else 0.0}
+
+
+def line_accuracy(pages):
+    """
+    pages: [(truth_lines, predicted_lines)]. Each expected line is matched greedily to the closest
+    unused predicted line. Returns the exact line recall and character accuracy.
+    """
+    lines = exact = errors = total = 0
+    for truth, predicted in pages:
+        unused = [p.strip() for p in predicted]
+        for expected in truth:
+            lines += 1
+            total += len(expected)
+            if not unused:
+                errors += len(expected)
+                continue
+            distances = [edit_distance(expected, p) for p in unused]
+            best = int(np.argmin(distances))
+            exact += distances[best] == 0
+            errors += min(distances[best], len(expected))
+            unused.pop(best)
+    return {"line_recall": round(exact / lines, 4) if lines else 0.0,
+            "char_accuracy": round(max(0.0, 1 - errors / total), 4) if total else 0.0}
+
+
+# --- Cases (each runs in its own process) ---
+# A case builder returns (pages, process(page) -> output, evaluate(outputs) -> accuracy dict or None,
+# cell count, extra() -> further result sections or None).
+
+def _case_grid(manifest, workdir, batched):
+    import ocrtest_fixed
+    ocrtest_fixed.initialize_ocr(ocrtest_fixed.DET_MODEL_DIR, ocrtest_fixed.CLS_MODEL_DIR, ocrtest_fixed.REC_MODEL_DIR)
+    grid = manifest["grid"]
+    run = ocrtest_fixed.process_image_fixed_grid_batched if batched else ocrtest_fixed.process_image_fixed_grid
+
+    def process(page):
+        csv_path = os.path.join(workdir, os.path.basename(page["path"]) + ".csv")
+        run(page["path"], csv_path, grid["row_height"], grid["col_widths"])
+        return csv_path
+
+    def evaluate(outputs):
+        import csv
+        pairs = []
+        for page, csv_path in zip(grid["pages"], outputs):
+            with open(csv_path, encoding="utf-8") as f:
+                pairs.append((page["truth"], list(csv.reader(f))))
+        return grid_accuracy(pairs)
+
+    cells = sum(len(row) for page in grid["pages"] for row in page["truth"])
+    return grid["pages"], process, evaluate, cells, None
+
+
+class _LineCollector:
+    """Stands in for ocrtest's VisualizationWriter and keeps each page's recognized texts instead of drawing them."""
+
+    def __init__(self):
+        self.texts = {}
+
+    def submit(self, img, lines, path):
+        self.texts[path] = list(lines.texts)
+
+
+def _case_document(manifest, workdir):
+    import ocrtest
+    engine = ocrtest.create_structure_engine(shared_ocr=True)
+    collector = _LineCollector()
+
+    def process(page):
+        name = os.path.splitext(os.path.basename(page["path"]))[0]
+        visualization_path = os.path.join(workdir, f"{name}_visualization.jpg")
+        ocrtest.process_image(page["path"], None, engine, workdir, name, visualization_path, visualizer=collector)
+        return collector.texts.pop(visualization_path, [])
+
+    def evaluate(outputs):
+        return line_accuracy([(page["truth"], lines) for page, lines in zip(manifest["document"], outputs)])
+
+    return manifest["document"], process, evaluate, 0, None
+
+
+def _case_receipt(manifest, workdir):
+    import ocrtest
+    import tiled_ocr
+    ocr = ocrtest.create_ocr_engine()
+    instrument(tiled_ocr, "merge_tile_lines", "merge")
+
+    def process(page):
+        img = np.array(Image.open(page["path"]).convert("RGB"))
+        return tiled_ocr.ocr_tiled(ocr, img).texts
+
+    def evaluate(outputs):
+        return line_accuracy([(page["truth"], lines) for page, lines in zip(manifest["receipt"], outputs)])
+
+    return manifest["receipt"], process, evaluate, 0, None
+
+
+def _case_startup(manifest, workdir):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ocrtest.py")
+    list_path = os.path.join(workdir, "first_page.txt")
+    with open(list_path, "w", encoding="utf-8") as f:
+        f.write(os.path.abspath(manifest["document"][0]["path"]) + "\n")
+    runs = [{"mode": mode, "flags": flags} for mode, flags in STARTUP_MODES]
+    seconds = {}
+
+    def process(run):
+        # Interpreter start, imports, model load and the first page, as a user running the script sees it
+        start = time.perf_counter()
+        subprocess.run([sys.executable, script, "--file_list", list_path, "--output_dir", workdir] + run["flags"],
+                       cwd=os.path.dirname(script), stdout=subprocess.DEVNULL, check=True)
+        seconds[run["mode"]] = time.perf_counter() - start
+        return seconds[run["mode"]]
+
+    def evaluate(outputs):
+        return {f"{mode}_first_result_s": round(value, 3) for mode, value in seconds.items()}
+
+    return runs, process, evaluate, 0, None
+
+
+def _case_split(manifest, workdir):
+    from split_image import iter_tiles
+    images = {page["path"]: np.array(Image.open(page["path"]).convert("RGB")) for page in manifest["receipt"]}
+
+    def process(page):
+        return sum(1 for _ in iter_tiles(images[page["path"]]))
+
+    return manifest["receipt"], process, None, 0, None
+
+
+def _case_mistral_batch(manifest, workdir):
+    import asyncio
+    import atexit
+    import socket
+    import tracemalloc
+    import mistral_batch
+
+    # The stub runs in its own process, so only the client's allocations are traced
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mistral_stub_server.py")
+    stub = subprocess.Popen([sys.executable, script, "--port", str(port), "--latency_ms", "0", "--error_rate", "0"],
+                            stdout=subprocess.DEVNULL)
+    atexit.register(stub.terminate)
+    for _ in range(100):
+        with socket.socket() as s:
+            if s.connect_ex(("127.0.0.1", port)) == 0:
+                break
+        time.sleep(0.05)
+    base_url = f"http://127.0.0.1:{port}"
+    pages = manifest["grid"]["pages"] + manifest["receipt"] + manifest["document"]
+    paths = [page["path"] for page in pages]
+    output_jsonl = os.path.join(workdir, "mistral.jsonl")
+
+    def traced_peak(batch_paths):
+        tracemalloc.start()
+        stats = asyncio.run(mistral_batch.run_batch(batch_paths, output_jsonl, base_url, concurrency=1, rate=0))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak, stats["failures"]
+
+    # Client and event loop setup is measured without any request and subtracted (the first run
+    # also pays for lazy imports, so it is not used)
+    traced_peak([])
+    overhead, _ = traced_peak([])
+    peaks = []
+
+    def process(page):
+        # One request at a time, so the traced peak is the peak of a single request
+        peak, failures = traced_peak([page["path"]])
+        peaks.append(max(0, peak - overhead))
+        return failures
+
+    def evaluate(outputs):
+        stub.terminate() # Pool workers skip atexit handlers, so stop the stub here
+        return {"failed_requests": int(sum(outputs))}
+
+    def memory():
+        return {"memory": {"peak_mb_per_request": round(max(peaks) / 2**20, 4) if peaks else 0.0,
+                           "largest_file_mb": round(max(os.path.getsize(path) for path in paths) / 2**20, 3)}}
+
+    return pages, process, evaluate, 0, memory
+
+
+CASE_BUILDERS = {
+    "grid": lambda m, w: _case_grid(m, w, batched=False),
+    "grid_batched": lambda m, w: _case_grid(m, w, batched=True),
+    "document": _case_document,
+    "receipt": _case_receipt,
+    "split": _case_split,
+    "startup": _case_startup,
+    "mistral_batch": _case_mistral_batch,
+}
+
+
+def run_case(name, manifest, warmup=1, quiet=True):
+    """Runs one case in the current process and returns its result dict."""
+    tracer.enable() # Stages are timed by the ocr_trace instrumentation built into the pipelines
+    with tempfile.TemporaryDirectory() as workdir:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull if quiet else sys.stdout):
+            start = time.perf_counter()
+            pages, process, evaluate, cells, extra = CASE_BUILDERS[name](manifest, workdir)
+            load_seconds = time.perf_counter() - start
+            for page in pages[:warmup]:
+                process(page)
+            tracer.drain() # Discard the warm-up pages
+
+            latencies, outputs = [], []
+            start = time.perf_counter()
+            for page in pages:
+                page_start = time.perf_counter()
+                outputs.append(process(page))
+                latencies.append(time.perf_counter() - page_start)
+            seconds = time.perf_counter() - start
+            accuracy = evaluate(outputs) if evaluate else {}
+            extra_metrics = extra() if extra else {}
+
+    ms = sorted(latency * 1000 for latency in latencies)
+    result = {
+        "images": len(pages),
+        "seconds": round(seconds, 3),
+        "load_seconds": round(load_seconds, 3),
+        "images_per_sec": round(len(pages) / seconds, 3) if seconds > 0 else 0.0,
+        "latency_ms": {"p50": round(percentile(ms, 50), 2), "p95": round(percentile(ms, 95), 2),
+                       "max": round(ms[-1], 2) if ms else 0.0},
+        "stages": {stage: stats for stage, stats in tracer.stage_summary().items() if stage != "page"},
+        "counters": dict(tracer.counters),
+        "observations": tracer.observation_summary(),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1), # KiB on Linux
+        "accuracy": accuracy,
+    }
+    if cells:
+        result["cells"] = cells
+        result["cells_per_sec"] = round(cells / seconds, 1) if seconds > 0 else 0.0
+    if name == "split":
+        result["tiles"] = int(sum(outputs))
+    result.update(extra_metrics)
+    return result
+
+
+def run_case_isolated(name, manifest, warmup=1):
+    """Runs a case in a fresh spawned process (own model load and peak RSS)."""
+    ctx = mp.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+        return pool.submit(run_case, name, manifest, warmup).result()
+
+
+# --- Comparison ---
+
+# (metric path, higher is better) pairs checked by --compare
+COMPARED_METRICS = (("images_per_sec", True), ("cells_per_sec", True), ("peak_rss_mb", False),
+                    ("memory.peak_mb_per_request", False))
+
+
+def _metric(result, path):
+    """Returns the value at a dotted metric path of a case result, or None."""
+    for key in path.split("."):
+        result = result.get(key) if isinstance(result, dict) else None
+    return result
+
+
+def compare_results(current, baseline, tolerance=0.10, accuracy_tolerance=0.005):
+    """
+    Prints per-case changes against a baseline run. Returns the list of regressions: throughput
+    down or peak memory up by more than tolerance (fraction), or any accuracy metric down by more
+    than accuracy_tolerance (absolute).
+    """
+    regressions = []
+    print(f"\n{'case':<14} {'metric':<28} {'baseline':>12} {'current':>12} {'change':>9}")
+    for case, result in current["cases"].items():
+        old = baseline.get("cases", {}).get(case)
+        if old is None or "error" in result or "error" in old:
+            continue
+        checks = [(metric, _metric(result, metric), _metric(old, metric), higher, tolerance)
+                  for metric, higher in COMPARED_METRICS]
+        checks += [(f"accuracy.{metric}", value, old.get("accuracy", {}).get(metric), True, None)
+                   for metric, value in result.get("accuracy", {}).items()
+                   if metric in ("cell_exact", "char_accuracy", "line_recall")]
+        for metric, new_value, old_value, higher, relative in checks:
+            if new_value is None or old_value is None:
+                continue
+            change = (new_value - old_value) / old_value if old_value else 0.0
+            if relative is not None:
+                worse = (change < -relative) if higher else (change > relative)
+            else:
+                worse = old_value - new_value > accuracy_tolerance
+            flag = "  REGRESSION" if worse else ""
+            print(f"{case:<14} {metric:<28} {old_value:>12} {new_value:>12} {change:>+8.1%}{flag}")
+            if worse:
+                regressions.append(f"{case} {metric}: {old_value} -> {new_value}")
+    return regressions
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reproducible OCR benchmark on synthetic tables, receipts and documents.")
+    parser.add_argument("--cases", type=str, default=",".join(ALL_CASES),
+                        help=f"Comma-separated cases to run (default: all of {', '.join(ALL_CASES)}).")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small", help="Dataset size (default: small).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data (default: 0).")
+    parser.add_argument("--font", type=str, default=None, help="Font with Chinese glyphs (default: search common locations).")
+    parser.add_argument("--data_dir", type=str, default="./bench_data", help="Folder for the generated inputs (default: ./bench_data).")
+    parser.add_argument("--output", type=str, default="./bench_results.json", help="JSON file for the results (default: ./bench_results.json).")
+    parser.add_argument("--compare", type=str, default=None, help="Earlier results JSON to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="Relative throughput / peak RSS change flagged as a regression (default: 0.10).")
+    parser.add_argument("--accuracy_tolerance", type=float, default=0.005,
+                        help="Absolute accuracy drop flagged as a regression (default: 0.005).")
+    parser.add_argument("--warmup", type=int, default=1, help="Pages run before timing starts in each case (default: 1).")
+    args = parser.parse_args()
+
+    cases = [case.strip() for case in args.cases.split(",") if case.strip()]
+    unknown = [case for case in cases if case not in CASE_BUILDERS]
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(unknown)}")
+
+    try:
+        manifest = generate_dataset(args.data_dir, args.scale, args.seed, args.font)
+    except FileNotFoundError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    print(f"Generated {args.scale} dataset (seed {args.seed}, font {manifest['font']}) in {args.data_dir}")
+
+    results = {"meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": _git_commit(),
+                        "python": platform.python_version(), "platform": platform.platform(),
+                        "cpu_count": os.cpu_count(), "scale": args.scale, "seed": args.seed,
+                        "font": manifest["font"]},
+               "cases": {}}
+    for case in cases:
+        print(f"Running {case}...")
+        try:
+            result = run_case_isolated(case, manifest, args.warmup)
+        except Exception as e:
+            print(f"  {case} failed: {e}")
+            results["cases"][case] = {"error": str(e)}
+            continue
+        results["cases"][case] = result
+        line = f"  {result['images_per_sec']:.2f} images/sec"
+        if "cells_per_sec" in result:
+            line += f", {result['cells_per_sec']:.1f} cells/sec"
+        line += f", p50 {result['latency_ms']['p50']:.1f} ms, peak RSS {result['peak_rss_mb']:.0f} MB"
+        if result["accuracy"]:
+            line += ", " + ", ".join(f"{k} {v}" for k, v in result["accuracy"].items())
+        if "memory" in result:
+            line += ", " + ", ".join(f"{k} {v}" for k, v in result["memory"].items())
+        print(line)
+        for stage, stats in result["stages"].items():
+            print(f"    {stage:<12} {stats['calls']:>6} calls, mean {stats['mean_ms']:.2f} ms, total {stats['total_s']:.2f} s")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_results(results, baseline, args.tolerance, args.accuracy_tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s):")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nNo regressions.")
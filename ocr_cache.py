@@ -0,0 +1,183 @@
+"""
+Content-addressed cache for OCR results.
+
+Results are keyed by a BLAKE2 hash of the image/crop pixels plus a fingerprint of the model files
+and the OCR parameters, so repeated header cells, stamps or whole re-run scans skip the model.
+There are two tiers: a bounded in-memory LRU and a persistent SQLite store with size-based eviction.
+When the model files change, the fingerprint changes and the stale entries of that namespace are purged.
+
+Values must be JSON-serializable (tuples come back as lists).
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from ocr_trace import tracer
+
+# Files of a Paddle inference model directory that determine its output
+MODEL_FILES = ("inference.pdmodel", "inference.pdiparams")
+
+# Pending disk writes are committed in groups of this many
+FLUSH_EVERY = 256
+
+
+def model_fingerprint(model_dirs):
+    """Hashes the contents of the inference model files in model_dirs. Missing files are skipped."""
+    h = hashlib.blake2b(digest_size=16)
+    for model_dir in model_dirs:
+        for name in MODEL_FILES:
+            path = os.path.join(model_dir, name)
+            if not os.path.exists(path):
+                continue
+            h.update(name.encode())
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    h.update(chunk)
+    return h.hexdigest()
+
+
+class OCRCache:
+    """Two-tier (memory LRU + SQLite) cache for OCR results."""
+
+    def __init__(self, db_path, model_dirs, namespace="ocr", max_memory_items=20000, max_disk_mb=512):
+        self.namespace = namespace
+        self.max_memory_items = max_memory_items
+        self.max_disk_bytes = int(max_disk_mb * 1024 * 1024)
+        self.fingerprint = model_fingerprint(model_dirs)
+        self.memory = OrderedDict()
+        self.pending = {}
+        self.touched = set()
+        self.lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "puts": 0, "evictions": 0}
+
+        parent = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(parent, exist_ok=True)
+        self.db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL") # Lets several worker processes share one cache file
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS entries (key BLOB PRIMARY KEY, namespace TEXT, value TEXT, "
+                        "size INTEGER, last_access REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_access ON entries (last_access)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (namespace TEXT PRIMARY KEY, fingerprint TEXT)")
+        self._invalidate_if_models_changed()
+        self.db.commit()
+
+    def _invalidate_if_models_changed(self):
+        row = self.db.execute("SELECT fingerprint FROM meta WHERE namespace = ?", (self.namespace,)).fetchone()
+        if row is not None and row[0] != self.fingerprint:
+            removed = self.db.execute("DELETE FROM entries WHERE namespace = ?", (self.namespace,)).rowcount
+            print(f"OCR cache: model files changed, dropped {removed} cached results for '{self.namespace}'")
+        self.db.execute("INSERT OR REPLACE INTO meta (namespace, fingerprint) VALUES (?, ?)",
+                        (self.namespace, self.fingerprint))
+
+    def make_key(self, image, *params):
+        """Builds the cache key for an image (numpy array) and the parameters that affect its result."""
+        h = hashlib.blake2b(digest_size=16)
+        h.update(self.fingerprint.encode())
+        h.update(repr((self.namespace, params, image.shape, image.dtype.str)).encode())
+        h.update(np.ascontiguousarray(image).data) # Crops are usually strided views
+        return h.digest()
+
+    def get(self, key):
+        """Returns the cached value for key, or None on a miss."""
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                tracer.count("cache_hits")
+                self._touch(key) # Keeps entries that are only ever hit in memory from being evicted on disk
+                return self.memory[key]
+            if key in self.pending:
+                self.counters["memory_hits"] += 1
+                tracer.count("cache_hits")
+                return self.pending[key]
+            row = self.db.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.counters["misses"] += 1
+                tracer.count("cache_misses")
+                return None
+            self.counters["disk_hits"] += 1
+            tracer.count("cache_hits")
+            value = json.loads(row[0])
+            self._touch(key)
+            self._remember(key, value)
+            return value
+
+    def put(self, key, value):
+        """Stores value in both tiers. Disk writes are committed in groups; call flush() or close() at the end."""
+        with self.lock:
+            self.counters["puts"] += 1
+            self._remember(key, value)
+            self.pending[key] = value
+            if len(self.pending) >= FLUSH_EVERY:
+                self._flush_locked()
+
+    def _touch(self, key):
+        """Queues a last_access update for key; the updates are written with the next flush."""
+        self.touched.add(key)
+        if len(self.touched) >= FLUSH_EVERY:
+            self._flush_locked()
+
+    def _remember(self, key, value):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_items:
+            self.memory.popitem(last=False)
+
+    def flush(self):
+        """Commits pending writes and access times, then evicts old entries if the store is over its size limit."""
+        with self.lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        now = time.time()
+        rows = []
+        for key, value in self.pending.items():
+            encoded = json.dumps(value, ensure_ascii=False)
+            rows.append((key, self.namespace, encoded, len(encoded.encode("utf-8")) + len(key), now))
+        self.db.executemany("INSERT OR REPLACE INTO entries (key, namespace, value, size, last_access) "
+                            "VALUES (?, ?, ?, ?, ?)", rows)
+        self.db.executemany("UPDATE entries SET last_access = ? WHERE key = ?", [(now, key) for key in self.touched])
+        self.pending.clear()
+        self.touched.clear()
+        self._evict_locked()
+        self.db.commit()
+
+    def _evict_locked(self):
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_disk_bytes:
+            return
+        # Drop least recently used entries until the store is 10% under its limit
+        target = total - int(self.max_disk_bytes * 0.9)
+        freed = 0
+        doomed = []
+        for key, size in self.db.execute("SELECT key, size FROM entries ORDER BY last_access"):
+            doomed.append((key,))
+            freed += size
+            if freed >= target:
+                break
+        self.db.executemany("DELETE FROM entries WHERE key = ?", doomed)
+        self.counters["evictions"] += len(doomed)
+
+    def stats(self):
+        """Returns the hit/miss counters and the hit rate."""
+        with self.lock:
+            stats = dict(self.counters)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def report(self):
+        stats = self.stats()
+        print(f"OCR cache: {stats['memory_hits']} memory hits, {stats['disk_hits']} disk hits, "
+              f"{stats['misses']} misses (hit rate {stats['hit_rate']:.1%}), {stats['evictions']} evictions")
+
+    def close(self):
+        self.flush()
+        self.db.close()
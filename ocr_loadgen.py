@@ -0,0 +1,152 @@
+"""
+Load generator for ocr_server.py.
+
+Sends images to a running server from --concurrency threads (one keep-alive connection each) and
+reports throughput, latency percentiles, rejections and the server's batch-size statistics.
+--baseline N also times running ocrtest.py once per image for N images, the way the project was
+used before the server existed, and prints the speed-up.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from ocr_trace import percentile
+from ocr_workers import collect_image_inputs
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection over a Unix domain socket."""
+
+    def __init__(self, socket_path, timeout=120):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def open_connection(args):
+    if args.unix_socket:
+        return UnixHTTPConnection(args.unix_socket)
+    return http.client.HTTPConnection(args.host, args.port, timeout=120)
+
+
+def request_json(conn, method, path, body=None):
+    conn.request(method, path, body=body, headers={"Content-Type": "application/octet-stream"} if body else {})
+    response = conn.getresponse()
+    return response.status, json.loads(response.read() or b"{}")
+
+
+def run_load(args, payloads):
+    """Sends args.requests images (cycling through payloads) and returns (latencies_ms, rejected, errors, seconds)."""
+    counter = itertools.count()
+    lock = threading.Lock()
+    latencies, failures = [], {"rejected": 0, "errors": 0}
+
+    def worker():
+        conn = open_connection(args)
+        while True:
+            i = next(counter)
+            if i >= args.requests:
+                break
+            body = payloads[i % len(payloads)]
+            start = time.perf_counter()
+            try:
+                status, _ = request_json(conn, "POST", f"/{args.mode}", body)
+            except (OSError, http.client.HTTPException, ValueError):
+                status = None
+                conn.close()
+                conn = open_connection(args)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            with lock:
+                if status == 200:
+                    latencies.append(elapsed_ms)
+                elif status == 503:
+                    failures["rejected"] += 1
+                else:
+                    failures["errors"] += 1
+        conn.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, failures["rejected"], failures["errors"], time.perf_counter() - start
+
+
+def run_baseline(image_paths):
+    """Runs ocrtest.py once per image (fresh process, models loaded each time). Returns seconds per image."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ocrtest.py")
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp:
+        for i, image_path in enumerate(image_paths):
+            # A one-line file list keeps the outputs in the temporary folder
+            list_path = os.path.join(tmp, f"list_{i}.txt")
+            with open(list_path, "w", encoding="utf-8") as f:
+                f.write(os.path.abspath(image_path) + "\n")
+            subprocess.run([sys.executable, script, "--file_list", list_path, "--output_dir", tmp],
+                           cwd=os.path.dirname(script), stdout=subprocess.DEVNULL, check=True)
+    return (time.perf_counter() - start) / len(image_paths)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load generator for ocr_server.py.")
+    parser.add_argument("inputs", type=str, nargs="+", help="Image files, directories or glob patterns to send.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Server address (default: 127.0.0.1).")
+    parser.add_argument("--port", type=int, default=8866, help="Server port (default: 8866).")
+    parser.add_argument("--unix_socket", type=str, default=None, help="Connect to this Unix socket instead of TCP.")
+    parser.add_argument("--mode", choices=("ocr", "structure"), default="structure",
+                        help="Endpoint to load; structure matches what ocrtest.py does per image (default: structure).")
+    parser.add_argument("--requests", type=int, default=200, help="Total requests to send (default: 200).")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent client connections (default: 16).")
+    parser.add_argument("--baseline", type=int, default=0,
+                        help="Also time N runs of ocrtest.py, one process per image, for comparison (default: 0, off).")
+    args = parser.parse_args()
+
+    image_paths = [path for path, _ in collect_image_inputs(args.inputs)]
+    if not image_paths:
+        print("Error: No images found for the given inputs.")
+        sys.exit(1)
+    payloads = []
+    for path in image_paths:
+        with open(path, "rb") as f:
+            payloads.append(f.read())
+
+    conn = open_connection(args)
+    _, before = request_json(conn, "GET", "/stats")
+    print(f"Sending {args.requests} requests to /{args.mode} ({len(payloads)} distinct images, concurrency {args.concurrency})")
+    latencies, rejected, errors, seconds = run_load(args, payloads)
+    _, after = request_json(conn, "GET", "/stats")
+    conn.close()
+
+    throughput = len(latencies) / seconds if seconds > 0 else 0.0
+    print(f"\n{len(latencies)} ok, {rejected} rejected (503), {errors} errors in {seconds:.1f}s: {throughput:.2f} images/sec")
+    if latencies:
+        latencies = sorted(latencies)
+        p50, p90, p99 = (percentile(latencies, q) for q in (50, 90, 99))
+        print(f"Client latency p50 {p50:.1f} ms, p90 {p90:.1f} ms, p99 {p99:.1f} ms")
+    batches = after["batches"] - before["batches"]
+    served = after["requests"] - before["requests"]
+    print(f"Server: {batches} batches, mean batch size {served / batches if batches else 0:.2f}, "
+          f"latency p50 {after['latency_ms']['p50']} ms, p99 {after['latency_ms']['p99']} ms, "
+          f"batch sizes {after['batch_sizes']}")
+
+    if args.baseline > 0:
+        sample = list(itertools.islice(itertools.cycle(image_paths), args.baseline))
+        print(f"\nBaseline: running ocrtest.py once per image for {len(sample)} images...")
+        per_image = run_baseline(sample)
+        print(f"Baseline: {per_image:.2f} s/image ({1 / per_image:.2f} images/sec)")
+        if throughput > 0:
+            print(f"Server speed-up: {throughput * per_image:.1f}x")
@@ -0,0 +1,143 @@
+"""
+Compact container for the text lines OCR finds on a page.
+
+PaddleOCR returns lines as nested lists [[box, (text, score)], ...] with each box a list of four
+[x, y] lists. OCRLines keeps the same data column-wise: all boxes in one contiguous float32 array of
+shape (N, 4, 2), the scores in a float64 array (so recognizer scores round-trip unchanged) and the
+texts in a list. Filtering, reading-order sorting and region queries are vectorized NumPy operations
+on these arrays, and pages serialize to compact JSON, NPZ or (with pyarrow installed) Arrow tables.
+"""
+import json
+
+import numpy as np
+
+
+class OCRLines:
+    """Text lines of one page: boxes (N, 4, 2) float32, scores (N,) float64 and texts (list of N str)."""
+
+    __slots__ = ("boxes", "scores", "texts")
+
+    def __init__(self, boxes=None, texts=(), scores=None):
+        self.texts = list(texts)
+        n = len(self.texts)
+        self.boxes = np.ascontiguousarray(np.asarray(boxes if boxes is not None else [], dtype=np.float32).reshape(n, 4, 2))
+        self.scores = np.asarray(scores if scores is not None else [], dtype=np.float64).reshape(n)
+
+    # --- Construction ---
+
+    @classmethod
+    def from_lines(cls, lines):
+        """Builds the container from one page of PaddleOCR lines [[box, (text, score)], ...] (or None)."""
+        lines = lines or []
+        return cls([line[0] for line in lines], [line[1][0] for line in lines], [line[1][1] for line in lines])
+
+    @classmethod
+    def from_paddle(cls, results):
+        """Builds the container from the output of PaddleOCR.ocr for one image ([page] with page a list or None)."""
+        return cls.from_lines(results[0] if results else None)
+
+    @classmethod
+    def from_text_system(cls, dt_boxes, rec_res):
+        """Builds the container from the detected boxes and (text, score) results of a PaddleOCR TextSystem."""
+        rec_res = rec_res or []
+        return cls(dt_boxes if len(rec_res) else None, [text for text, _ in rec_res], [score for _, score in rec_res])
+
+    @classmethod
+    def concatenate(cls, parts):
+        parts = list(parts)
+        if not parts:
+            return cls()
+        return cls(np.concatenate([p.boxes for p in parts]), [t for p in parts for t in p.texts],
+                   np.concatenate([p.scores for p in parts]))
+
+    # --- Access ---
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __iter__(self):
+        """Yields (box, (text, score)) like the PaddleOCR line lists."""
+        for box, text, score in zip(self.boxes, self.texts, self.scores):
+            yield box, (text, float(score))
+
+    def __repr__(self):
+        return f"OCRLines({len(self)} lines)"
+
+    def select(self, index):
+        """Returns the lines picked by an index array or boolean mask, in that order."""
+        index = np.asarray(index)
+        if index.dtype == bool:
+            index = np.nonzero(index)[0]
+        return OCRLines(self.boxes[index], [self.texts[i] for i in index], self.scores[index])
+
+    def bounds(self):
+        """Returns an (N, 4) array of [x_min, y_min, x_max, y_max]."""
+        return np.concatenate([self.boxes.min(axis=1), self.boxes.max(axis=1)], axis=1)
+
+    def centers(self):
+        return self.boxes.mean(axis=1)
+
+    # --- Vectorized operations ---
+
+    def filter_scores(self, min_score):
+        """Returns the lines scoring at least min_score."""
+        return self.select(self.scores >= min_score)
+
+    def in_region(self, x1, y1, x2, y2):
+        """Returns the indices of the lines whose center lies inside [x1, x2) x [y1, y2)."""
+        centers = self.centers()
+        return np.nonzero((centers[:, 0] >= x1) & (centers[:, 0] < x2) &
+                          (centers[:, 1] >= y1) & (centers[:, 1] < y2))[0]
+
+    def sorted_reading_order(self):
+        """Returns the lines sorted top to bottom, then left to right (by the top-left of their bounds)."""
+        bounds = self.bounds()
+        return self.select(np.lexsort((bounds[:, 0], bounds[:, 1])))
+
+    def shifted(self, dx=0.0, dy=0.0):
+        """Returns the lines with their boxes moved by (dx, dy), e.g. from tile to page coordinates."""
+        return OCRLines(self.boxes + np.float32([dx, dy]), self.texts, self.scores)
+
+    # --- Serialization ---
+
+    def to_paddle(self):
+        """Returns the lines in the PaddleOCR.ocr format for one image: [[[box, (text, score)], ...] or None]."""
+        return [[[box.tolist(), (text, score)] for box, (text, score) in self] or None]
+
+    def to_records(self):
+        """Returns the lines as [{"text", "confidence", "text_region"}, ...], the PP-Structure text format."""
+        return [{"text": text, "confidence": score, "text_region": box.tolist()} for box, (text, score) in self]
+
+    def to_dict(self):
+        """Column-wise JSON-serializable form (see from_dict)."""
+        return {"boxes": self.boxes.reshape(-1, 8).tolist(), "texts": self.texts, "scores": self.scores.tolist()}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["boxes"], data["texts"], data["scores"])
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, text):
+        return cls.from_dict(json.loads(text))
+
+    def save_npz(self, path):
+        np.savez_compressed(path, boxes=self.boxes, scores=self.scores, texts=np.asarray(self.texts, dtype=str))
+
+    @classmethod
+    def load_npz(cls, path):
+        with np.load(path) as data:
+            return cls(data["boxes"], data["texts"].tolist(), data["scores"])
+
+    def to_arrow(self):
+        """Returns a pyarrow Table with text, score and box (8 float32 values) columns."""
+        import pyarrow as pa # Optional dependency, only needed for Arrow output
+        boxes = pa.FixedSizeListArray.from_arrays(pa.array(self.boxes.reshape(-1), type=pa.float32()), 8)
+        return pa.table({"text": pa.array(self.texts, type=pa.string()), "score": pa.array(self.scores), "box": boxes})
+
+    @classmethod
+    def from_arrow(cls, table):
+        boxes = table.column("box").combine_chunks().flatten().to_numpy()
+        return cls(boxes, table.column("text").to_pylist(), table.column("score").to_numpy())
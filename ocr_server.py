@@ -0,0 +1,347 @@
+"""
+Long-lived local OCR server with dynamic micro-batching.
+
+Loads the PP-Structure engine of ocrtest.py once (shared det/cls/rec, see run_shared_pipeline) and
+serves it over HTTP on a TCP port or a Unix socket:
+
+    POST /ocr        image bytes in the body -> text lines
+    POST /structure  image bytes in the body -> text lines and PP-Structure regions
+    GET  /stats      request / latency / batch-size statistics
+    GET  /health
+
+Requests are decoded in the HTTP handler threads and put on a bounded queue. A single inference
+thread (Paddle predictors are not thread-safe) takes the first waiting request, keeps collecting
+for up to --batch_window_ms or until --max_batch requests, then runs text detection for the whole
+batch in one predictor call (images padded to a common size) and one angle-classifier / recognizer
+pass over the text crops of all images. Layout analysis and table structure still run per image.
+When the queue is full, requests are rejected right away with 503 and Retry-After (backpressure).
+"""
+import argparse
+import collections
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+from ocr_result import OCRLines
+from ocr_trace import percentile
+
+# Text detection algorithms whose output maps can be computed for a padded batch and cropped back
+BATCHED_DET_ALGORITHMS = ("DB", "DB++")
+# A detection batch is split when padding would waste more than this factor of pixels
+MAX_PADDING_FACTOR = 1.5
+# Number of recent requests the latency percentiles are computed over
+STATS_WINDOW = 10000
+
+
+def _detection_groups(shapes):
+    """Groups image indices (sorted by size) so that padding each group to its largest image stays cheap."""
+    order = sorted(range(len(shapes)), key=lambda i: shapes[i])
+    groups = []
+    for i in order:
+        if groups:
+            group = groups[-1] + [i]
+            max_h = max(shapes[j][0] for j in group)
+            max_w = max(shapes[j][1] for j in group)
+            if max_h * max_w * len(group) <= MAX_PADDING_FACTOR * sum(shapes[j][0] * shapes[j][1] for j in group):
+                groups[-1] = group
+                continue
+        groups.append([i])
+    return groups
+
+
+def detect_text_batch(text_detector, imgs):
+    """
+    Runs text detection on several images, one predictor call per group of similar-sized images.
+    Returns the dt_boxes of each image, as TextDetector.__call__ would. Falls back to one call per
+    image for detectors that cannot be batched (ONNX, non-DB algorithms).
+    """
+    if getattr(text_detector, "use_onnx", True) or getattr(text_detector, "det_algorithm", None) not in BATCHED_DET_ALGORITHMS:
+        return [text_detector(img)[0] for img in imgs]
+    from ppocr.data import transform # Importable once paddleocr is loaded
+
+    prepared = [transform({"image": img}, text_detector.preprocess_op) for img in imgs]
+    results = [None] * len(imgs)
+    for group in _detection_groups([data[0].shape[1:] for data in prepared]):
+        max_h = max(prepared[i][0].shape[1] for i in group)
+        max_w = max(prepared[i][0].shape[2] for i in group)
+        # Pad by repeating the edge pixels, so the padding does not create artificial text borders
+        batch = np.stack([np.pad(prepared[i][0], ((0, 0), (0, max_h - prepared[i][0].shape[1]),
+                                                  (0, max_w - prepared[i][0].shape[2])), mode="edge")
+                          for i in group]).astype(np.float32)
+        text_detector.input_tensor.copy_from_cpu(batch)
+        text_detector.predictor.run()
+        maps = text_detector.output_tensors[0].copy_to_cpu()
+        for k, i in enumerate(group):
+            img_data, shape_list = prepared[i]
+            height, width = img_data.shape[1:]
+            post_result = text_detector.postprocess_op({"maps": maps[k : k + 1, :, :height, :width]},
+                                                       np.expand_dims(shape_list, axis=0))
+            dt_boxes = post_result[0]["points"]
+            if text_detector.args.det_box_type == "poly":
+                results[i] = text_detector.filter_tag_det_res_only_clip(dt_boxes, imgs[i].shape)
+            else:
+                results[i] = text_detector.filter_tag_det_res(dt_boxes, imgs[i].shape)
+    return results
+
+
+def run_text_batch(text_system, imgs, cls=True):
+    """
+    Batched equivalent of TextSystem.__call__ for several images: batched detection, then a single
+    angle-classifier and recognizer pass over the crops of all images. Returns [(dt_boxes, rec_res), ...].
+    """
+    if getattr(text_system, "text_detector", None) is None:
+        return [text_system(img, cls=cls)[:2] for img in imgs]
+    from tools.infer.predict_system import sorted_boxes
+    from tools.infer.utility import get_minarea_rect_crop, get_rotate_crop_image
+
+    boxes_per_image = detect_text_batch(text_system.text_detector, imgs)
+    crops, owners, boxes_sorted = [], [], []
+    for i, (img, dt_boxes) in enumerate(zip(imgs, boxes_per_image)):
+        if dt_boxes is None or len(dt_boxes) == 0:
+            boxes_sorted.append([])
+            continue
+        dt_boxes = sorted_boxes(dt_boxes)
+        boxes_sorted.append(dt_boxes)
+        for box in dt_boxes:
+            if text_system.args.det_box_type == "quad":
+                crops.append(get_rotate_crop_image(img, box.copy()))
+            else:
+                crops.append(get_minarea_rect_crop(img, box.copy()))
+            owners.append(i)
+
+    rec_res = []
+    if crops:
+        if text_system.use_angle_cls and cls:
+            crops, _, _ = text_system.text_classifier(crops)
+        rec_res, _ = text_system.text_recognizer(crops)
+
+    results = [([], []) for _ in imgs]
+    box_index = [0] * len(imgs)
+    for owner, rec_result in zip(owners, rec_res):
+        box = boxes_sorted[owner][box_index[owner]]
+        box_index[owner] += 1
+        if rec_result[1] >= text_system.drop_score:
+            results[owner][0].append(box)
+            results[owner][1].append(rec_result)
+    return results
+
+
+def _percentiles(values, qs=(50, 90, 99)):
+    values = sorted(values)
+    return {f"p{q}": round(float(percentile(values, q)), 2) for q in qs}
+
+
+class ServerStats:
+    """Thread-safe request counters, recent latencies (ms) and the batch-size histogram."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters = {"requests": 0, "rejected": 0, "errors": 0, "batches": 0}
+        self.latencies = collections.deque(maxlen=STATS_WINDOW)
+        self.queue_waits = collections.deque(maxlen=STATS_WINDOW)
+        self.batch_sizes = collections.Counter()
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def record_batch(self, size):
+        with self.lock:
+            self.counters["batches"] += 1
+            self.batch_sizes[size] += 1
+
+    def record_request(self, latency_ms, queue_wait_ms):
+        with self.lock:
+            self.counters["requests"] += 1
+            self.latencies.append(latency_ms)
+            self.queue_waits.append(queue_wait_ms)
+
+    def snapshot(self, queue_depth=0):
+        with self.lock:
+            counters = dict(self.counters)
+            latencies = list(self.latencies)
+            waits = list(self.queue_waits)
+            sizes = dict(self.batch_sizes)
+        batched = sum(size * n for size, n in sizes.items())
+        elapsed = time.time() - self.started
+        return dict(counters,
+                    uptime=round(elapsed, 1),
+                    throughput=round(counters["requests"] / elapsed, 2) if elapsed > 0 else 0.0,
+                    queue_depth=queue_depth,
+                    latency_ms=_percentiles(latencies),
+                    queue_wait_ms=_percentiles(waits),
+                    mean_batch_size=round(batched / counters["batches"], 2) if counters["batches"] else 0.0,
+                    batch_sizes={str(size): sizes[size] for size in sorted(sizes)})
+
+
+class MicroBatcher:
+    """Bounded request queue plus the inference thread that drains it in micro-batches."""
+
+    def __init__(self, engine, max_batch=16, batch_window_ms=10.0, max_queue=64):
+        self.engine = engine
+        self.max_batch = max_batch
+        self.batch_window = batch_window_ms / 1000.0
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.stats = ServerStats()
+        self.thread = threading.Thread(target=self._run, name="ocr-batcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, mode, img):
+        """Queues an image ('ocr' or 'structure' mode) and returns a Future. Raises queue.Full when saturated."""
+        future = Future()
+        self.queue.put_nowait((mode, img, future, time.perf_counter()))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.perf_counter() + self.batch_window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._process(batch)
+
+    def _process(self, batch):
+        import ocrtest
+        started = time.perf_counter()
+        self.stats.record_batch(len(batch))
+        try:
+            text_results = run_text_batch(self.engine.text_system, [img for _, img, _, _ in batch])
+        except Exception as e:
+            for _, _, future, _ in batch:
+                future.set_exception(e)
+            return
+        for (mode, img, future, queued_at), (dt_boxes, rec_res) in zip(batch, text_results):
+            try:
+                if mode == "structure":
+                    lines, structure_results = ocrtest.run_shared_pipeline(self.engine, img, (dt_boxes, rec_res))
+                    regions = [{k: v for k, v in region.items() if k != "img"} for region in structure_results]
+                else:
+                    lines = OCRLines.from_text_system(dt_boxes, rec_res).filter_scores(ocrtest.OCR_DROP_SCORE)
+                    regions = None
+                future.set_result({"lines": lines.to_records(), "structure": regions, "batch_size": len(batch),
+                                   "queue_wait_ms": round((started - queued_at) * 1000, 2)})
+            except Exception as e:
+                future.set_exception(e)
+
+
+class OCRRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        batcher = self.server.batcher
+        if self.path == "/stats":
+            self._send_json(200, batcher.stats.snapshot(batcher.queue.qsize()))
+        elif self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        batcher = self.server.batcher
+        start = time.perf_counter()
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        mode = self.path.strip("/")
+        if mode not in ("ocr", "structure"):
+            self._send_json(404, {"error": "not found"})
+            return
+        img = cv2.imdecode(np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR) if body else None
+        if img is None:
+            batcher.stats.count("errors")
+            self._send_json(400, {"error": "body is not a readable image"})
+            return
+        try:
+            future = batcher.submit(mode, img)
+        except queue.Full:
+            batcher.stats.count("rejected")
+            self._send_json(503, {"error": "server busy"}, {"Retry-After": "1"})
+            return
+        try:
+            result = future.result(timeout=self.server.request_timeout)
+        except Exception as e:
+            batcher.stats.count("errors")
+            self._send_json(500, {"error": str(e)})
+            return
+        latency_ms = (time.perf_counter() - start) * 1000
+        batcher.stats.record_request(latency_ms, result["queue_wait_ms"])
+        self._send_json(200, dict(result, latency_ms=round(latency_ms, 2)))
+
+
+class OCRHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128 # Listen backlog; bursts of new client connections must not be refused
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local OCR / PP-Structure server with dynamic micro-batching.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to bind (default: 127.0.0.1).")
+    parser.add_argument("--port", type=int, default=8866, help="TCP port (default: 8866).")
+    parser.add_argument("--unix_socket", type=str, default=None, help="Serve on this Unix socket path instead of TCP.")
+    parser.add_argument("--max_batch", type=int, default=16, help="Maximum images per micro-batch (default: 16).")
+    parser.add_argument("--batch_window_ms", type=float, default=10.0,
+                        help="How long the first request of a batch waits for others to join (default: 10).")
+    parser.add_argument("--max_queue", type=int, default=64,
+                        help="Requests waiting for inference before new ones are rejected with 503 (default: 64).")
+    parser.add_argument("--request_timeout", type=float, default=120.0, help="Seconds a request may wait for its result (default: 120).")
+    parser.add_argument("--cpu_threads", type=int, default=10, help="CPU threads for inference (default: 10).")
+    args = parser.parse_args()
+
+    from ocrtest import create_structure_engine
+    print("Loading models...")
+    engine = create_structure_engine(cpu_threads=args.cpu_threads, shared_ocr=True)
+    batcher = MicroBatcher(engine, args.max_batch, args.batch_window_ms, args.max_queue)
+    batcher.submit("structure", np.full((48, 320, 3), 255, dtype=np.uint8)).result() # Warm-up
+    batcher.stats = ServerStats()
+
+    if args.unix_socket:
+        if os.path.exists(args.unix_socket):
+            os.remove(args.unix_socket)
+        server = ThreadingUnixHTTPServer(args.unix_socket, OCRRequestHandler)
+        address = f"unix:{args.unix_socket}"
+    else:
+        server = OCRHTTPServer((args.host, args.port), OCRRequestHandler)
+        address = f"http://{args.host}:{args.port}"
+    server.batcher = batcher
+    server.request_timeout = args.request_timeout
+    print(f"OCR server listening on {address} (max batch {args.max_batch}, window {args.batch_window_ms:g} ms, "
+          f"queue {args.max_queue})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n" + json.dumps(batcher.stats.snapshot(), indent=2))
+    finally:
+        server.server_close()
+        if args.unix_socket and os.path.exists(args.unix_socket):
+            os.remove(args.unix_socket)
@@ -0,0 +1,412 @@
+"""
+Low-overhead instrumentation for the OCR pipelines.
+
+A process-wide Tracer (ocr_trace.tracer) records timed spans for the pipeline stages (image decode,
+text detection, angle classification, recognition, layout, SLANet table structure, visualization,
+output writing), counters (cache hits, blank cells, ...) and observed values (boxes per image,
+recognizer batch sizes). It is disabled by default; every hook is then a single attribute check.
+
+Exports: a JSON summary with all events, a Chrome trace-event file (chrome://tracing, Perfetto) and a
+Prometheus textfile (node_exporter textfile collector). An opt-in sampling profiler samples the
+stack of the thread processing a page and keeps the collapsed stacks of the slowest N pages
+(flamegraph.pl / speedscope format).
+
+Worker processes record into their own tracer; drain() hands the data to the parent, which merge()s
+it, so the Chrome trace shows one row per worker process.
+"""
+import heapq
+import json
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Events beyond this many are dropped from the trace (stage statistics are still updated)
+MAX_EVENTS = 1000000
+# Interval of the sampling profiler in seconds
+PROFILE_INTERVAL = 0.005
+# Percentiles exported for every stage
+PERCENTILES = (50, 90, 99)
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer._record(self.name, self.start, time.perf_counter_ns() - self.start, self.args)
+        return False
+
+
+class _Page:
+    """Span for a whole page; also drives the sampling profiler."""
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        profiler = self.tracer.profiler
+        if profiler is not None:
+            profiler.begin()
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter_ns() - self.start
+        tracer = self.tracer
+        tracer._record("page", self.start, duration, {"image": self.name})
+        if tracer.profiler is not None:
+            tracer.profiler.end(self.name, duration / 1e9)
+        return False
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of one thread every PROFILE_INTERVAL seconds while a page is running and keeps
+    the collapsed stacks of the slowest `keep` pages.
+    """
+
+    def __init__(self, keep, interval=PROFILE_INTERVAL):
+        self.keep = keep
+        self.interval = interval
+        self.slowest = [] # min-heap of (seconds, page, stacks)
+        self.stacks = None
+        self.target = None
+        self.active = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="ocr-profiler", daemon=True)
+        self.thread.start()
+
+    def begin(self):
+        self.stacks = Counter()
+        self.target = threading.get_ident()
+        self.active.set()
+
+    def end(self, page, seconds):
+        self.active.clear()
+        stacks, self.stacks = self.stacks, None
+        if len(self.slowest) < self.keep:
+            heapq.heappush(self.slowest, (seconds, page, dict(stacks)))
+        elif self.slowest and seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (seconds, page, dict(stacks)))
+
+    def _run(self):
+        while True:
+            self.active.wait()
+            frame = sys._current_frames().get(self.target)
+            stacks = self.stacks
+            if frame is not None and stacks is not None:
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stacks[";".join(reversed(names))] += 1
+            time.sleep(self.interval)
+
+
+class Tracer:
+    """Collects spans, counters and observations. Disabled (no-op) until enable() is called."""
+
+    def __init__(self):
+        self.enabled = False
+        self.profiler = None
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.events = [] # (name, start_ns, duration_ns, pid, tid, args)
+        self.durations = {} # stage -> [seconds]
+        self.counters = Counter()
+        self.observations = {} # name -> [values]
+        self.dropped = 0
+
+    def enable(self, profile_slowest=0):
+        """Starts recording; with profile_slowest > 0 the slowest pages are also sampled."""
+        self.enabled = True
+        self.origin_ns = time.perf_counter_ns()
+        self.origin_wall = time.time()
+        if profile_slowest > 0 and self.profiler is None:
+            self.profiler = SamplingProfiler(profile_slowest)
+
+    def span(self, name, **args):
+        """Context manager timing one stage."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def page(self, name):
+        """Context manager around the processing of one page (image)."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Page(self, name)
+
+    def count(self, name, value=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] += value
+
+    def observe(self, name, value):
+        """Records one value of a distribution (e.g. boxes per image)."""
+        if self.enabled:
+            with self.lock:
+                self.observations.setdefault(name, []).append(value)
+
+    def _record(self, name, start_ns, duration_ns, args):
+        with self.lock:
+            self.durations.setdefault(name, []).append(duration_ns / 1e9)
+            if len(self.events) < MAX_EVENTS:
+                self.events.append((name, start_ns - self.origin_ns, duration_ns, os.getpid(),
+                                    threading.get_ident(), args))
+            else:
+                self.dropped += 1
+
+    # --- Multi-process support ---
+
+    def drain(self):
+        """Returns everything recorded since the last drain (picklable) and clears it."""
+        if not self.enabled:
+            return None
+        with self.lock:
+            data = {"origin_wall": self.origin_wall, "events": self.events, "durations": self.durations,
+                    "counters": dict(self.counters), "observations": self.observations, "dropped": self.dropped,
+                    "slowest": self.profiler.slowest if self.profiler is not None else []}
+            self._reset()
+            if self.profiler is not None:
+                self.profiler.slowest = []
+        return data
+
+    def merge(self, data):
+        """Adds data drained from another process's tracer (event times are aligned by wall clock)."""
+        if not data or not self.enabled:
+            return
+        shift_ns = int((data["origin_wall"] - self.origin_wall) * 1e9)
+        with self.lock:
+            room = MAX_EVENTS - len(self.events)
+            events = [(name, start + shift_ns, dur, pid, tid, args) for name, start, dur, pid, tid, args in data["events"]]
+            self.events.extend(events[:max(0, room)])
+            self.dropped += data["dropped"] + max(0, len(events) - max(0, room))
+            for name, values in data["durations"].items():
+                self.durations.setdefault(name, []).extend(values)
+            self.counters.update(data["counters"])
+            for name, values in data["observations"].items():
+                self.observations.setdefault(name, []).extend(values)
+        if data["slowest"]:
+            if self.profiler is None:
+                self.profiler = SamplingProfiler(len(data["slowest"]))
+            for entry in data["slowest"]:
+                heapq.heappush(self.profiler.slowest, entry)
+                if len(self.profiler.slowest) > self.profiler.keep:
+                    heapq.heappop(self.profiler.slowest)
+
+    # --- Reports ---
+
+    def stage_summary(self):
+        """Returns {stage: {calls, total_s, mean_ms, p50_ms, p90_ms, p99_ms, max_ms}}."""
+        with self.lock:
+            durations = {name: sorted(values) for name, values in self.durations.items()}
+        summary = {}
+        for name, values in durations.items():
+            total = sum(values)
+            summary[name] = {"calls": len(values), "total_s": round(total, 4),
+                             "mean_ms": round(total / len(values) * 1000, 3),
+                             **{f"p{q}_ms": round(percentile(values, q) * 1000, 3) for q in PERCENTILES},
+                             "max_ms": round(values[-1] * 1000, 3)}
+        return summary
+
+    def observation_summary(self):
+        with self.lock:
+            observations = {name: sorted(values) for name, values in self.observations.items()}
+        return {name: {"count": len(values), "mean": round(sum(values) / len(values), 3),
+                       "p50": percentile(values, 50), "max": values[-1]}
+                for name, values in observations.items() if values}
+
+    def report(self):
+        """Prints the per-stage timing table."""
+        summary = self.stage_summary()
+        if not summary:
+            return
+        print(f"\n{'stage':<14} {'calls':>8} {'total s':>9} {'mean ms':>9} {'p50 ms':>9} {'p99 ms':>9}")
+        for name, s in sorted(summary.items(), key=lambda item: -item[1]["total_s"]):
+            print(f"{name:<14} {s['calls']:>8} {s['total_s']:>9.3f} {s['mean_ms']:>9.2f} {s['p50_ms']:>9.2f} {s['p99_ms']:>9.2f}")
+        for name, value in sorted(self.counters.items()):
+            print(f"{name}: {value}")
+        for name, s in sorted(self.observation_summary().items()):
+            print(f"{name}: mean {s['mean']}, p50 {s['p50']}, max {s['max']} over {s['count']}")
+
+    def write_json(self, path):
+        with self.lock:
+            events = [{"name": name, "start_ms": start / 1e6, "duration_ms": dur / 1e6, "pid": pid, "tid": tid,
+                       **({"args": args} if args else {})} for name, start, dur, pid, tid, args in self.events]
+            counters = dict(self.counters)
+        data = {"stages": self.stage_summary(), "counters": counters, "observations": self.observation_summary(),
+                "dropped_events": self.dropped, "events": events}
+        _write_atomic(path, json.dumps(data, ensure_ascii=False, indent=1))
+
+    def write_chrome_trace(self, path):
+        """Writes the Chrome trace-event format (complete 'X' events, microseconds)."""
+        with self.lock:
+            trace = [{"name": name, "cat": "ocr", "ph": "X", "ts": start / 1000, "dur": dur / 1000, "pid": pid,
+                      "tid": tid, **({"args": args} if args else {})} for name, start, dur, pid, tid, args in self.events]
+        _write_atomic(path, json.dumps({"traceEvents": trace, "displayTimeUnit": "ms"}, ensure_ascii=False))
+
+    def write_prometheus(self, path, prefix="ocr"):
+        """Writes a Prometheus textfile: per-stage summaries, counters and observation summaries."""
+        lines = [f"# HELP {prefix}_stage_seconds Duration of OCR pipeline stages.",
+                 f"# TYPE {prefix}_stage_seconds summary"]
+        with self.lock:
+            durations = {name: sorted(values) for name, values in self.durations.items()}
+            counters = dict(self.counters)
+            observations = {name: sorted(values) for name, values in self.observations.items()}
+        for name, values in sorted(durations.items()):
+            for q in PERCENTILES:
+                lines.append(f'{prefix}_stage_seconds{{stage="{name}",quantile="{q / 100}"}} {percentile(values, q):.6f}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {sum(values):.6f}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {len(values)}')
+        lines += [f"# HELP {prefix}_events_total OCR pipeline counters (cache hits, blank cells, ...).",
+                  f"# TYPE {prefix}_events_total counter"]
+        lines += [f'{prefix}_events_total{{name="{name}"}} {value}' for name, value in sorted(counters.items())]
+        lines += [f"# HELP {prefix}_observed Distributions such as boxes per image and recognizer batch sizes.",
+                  f"# TYPE {prefix}_observed summary"]
+        for name, values in sorted(observations.items()):
+            for q in PERCENTILES:
+                lines.append(f'{prefix}_observed{{name="{name}",quantile="{q / 100}"}} {percentile(values, q)}')
+            lines.append(f'{prefix}_observed_sum{{name="{name}"}} {sum(values)}')
+            lines.append(f'{prefix}_observed_count{{name="{name}"}} {len(values)}')
+        _write_atomic(path, "\n".join(lines) + "\n")
+
+    def write_profiles(self, folder):
+        """Writes the collapsed stacks of the slowest pages, slowest first. Returns the files written."""
+        if self.profiler is None:
+            return []
+        os.makedirs(folder, exist_ok=True)
+        paths = []
+        for rank, (seconds, page, stacks) in enumerate(sorted(self.profiler.slowest, reverse=True), start=1):
+            name = os.path.splitext(os.path.basename(str(page)))[0]
+            path = os.path.join(folder, f"{rank:02d}_{name}.folded")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(f"# {page}: {seconds:.3f} s\n")
+                for stack, samples in sorted(stacks.items(), key=lambda item: -item[1]):
+                    f.write(f"{stack} {samples}\n")
+            paths.append(path)
+        return paths
+
+    def write_all(self, folder):
+        """Writes trace.json, trace_chrome.json, metrics.prom and profiles/ into folder."""
+        os.makedirs(folder, exist_ok=True)
+        self.write_json(os.path.join(folder, "trace.json"))
+        self.write_chrome_trace(os.path.join(folder, "trace_chrome.json"))
+        self.write_prometheus(os.path.join(folder, "metrics.prom"))
+        profiles = self.write_profiles(os.path.join(folder, "profiles"))
+        print(f"Trace written to {folder} ({len(self.events)} events"
+              + (f", {self.dropped} dropped" if self.dropped else "")
+              + (f", profiles of the {len(profiles)} slowest pages" if profiles else "") + ")")
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile (q in 0-100) of an already sorted sequence; 0.0 when it is empty."""
+    if not len(sorted_values):
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(q * len(sorted_values) / 100) - 1))]
+
+
+def _write_atomic(path, text):
+    """Writes via a temporary file and rename, so readers (e.g. the textfile collector) never see partial files."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+class _Instrumented:
+    """Callable proxy that times calls as a stage and forwards attribute access to the wrapped object."""
+
+    def __init__(self, fn, stage, tracer, on_call=None):
+        self._fn = fn
+        self._stage = stage
+        self._tracer = tracer
+        self._on_call = on_call
+
+    def __call__(self, *args, **kwargs):
+        tracer = self._tracer
+        if not tracer.enabled:
+            return self._fn(*args, **kwargs)
+        start = time.perf_counter_ns()
+        result = self._fn(*args, **kwargs)
+        tracer._record(self._stage, start, time.perf_counter_ns() - start, None)
+        if self._on_call is not None:
+            self._on_call(self._fn, args, result)
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self._fn, name)
+
+    def __setattr__(self, name, value):
+        if name.startswith("_"):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._fn, name, value) # e.g. recognizer.rec_batch_num = ...
+
+
+def instrument(owner, attr, stage, on_call=None, tracer=None):
+    """Replaces owner.attr with a timed proxy (once). Missing attributes are skipped."""
+    fn = getattr(owner, attr, None) if owner is not None else None
+    if fn is None or isinstance(fn, _Instrumented):
+        return
+    setattr(owner, attr, _Instrumented(fn, stage, tracer or globals()["tracer"], on_call))
+
+
+def _after_det(detector, args, result):
+    dt_boxes = result[0] if isinstance(result, tuple) else result
+    tracer.observe("boxes_per_image", 0 if dt_boxes is None else len(dt_boxes))
+
+
+def _after_batched_model(name):
+    def after(model, args, result):
+        crops = len(args[0]) if args else 0
+        batch_num = getattr(model, f"{name}_batch_num", None) or crops or 1
+        for start in range(0, crops, batch_num): # The model splits its input into batches of batch_num
+            tracer.observe(f"{name}_batch_size", min(batch_num, crops - start))
+    return after
+
+
+def instrument_text_system(text_system):
+    """Times det / cls / rec of a TextSystem (PaddleOCR, or PPStructure.text_system) and records their sizes."""
+    instrument(text_system, "text_detector", "det", _after_det)
+    instrument(text_system, "text_classifier", "cls", _after_batched_model("cls"))
+    instrument(text_system, "text_recognizer", "rec", _after_batched_model("rec"))
+
+
+def instrument_structure_engine(engine):
+    """Times the text system, layout analysis and SLANet table structure / matching of a PPStructure engine."""
+    instrument_text_system(getattr(engine, "text_system", None))
+    instrument(engine, "layout_predictor", "layout")
+    table_system = getattr(engine, "table_system", None)
+    instrument(table_system, "_structure", "table")
+    instrument(table_system, "match", "table_match")
+    instrument_text_system(table_system) # Only used by the separate-engine path (det/rec per table crop)
+
+
+# Process-wide tracer used by the pipeline modules
+tracer = Tracer()
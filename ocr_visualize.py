@@ -0,0 +1,186 @@
+"""
+Visualization of OCR results for ocrtest.py.
+
+Two renderers produce the usual side-by-side image (page with text boxes | recognized text):
+
+* fast: all boxes are drawn with one cv2.polylines call and the text is composed from glyph masks
+  that are rendered once per (character, size) and then reused, optionally on a downscaled preview.
+* paddle: PaddleOCR's draw_ocr (per-box PIL rendering, imports paddle).
+
+VisualizationWriter renders and saves on a background thread, so a batch does not wait for the
+visualization of one page before starting the next.
+"""
+import os
+import queue
+import threading
+
+import numpy as np
+
+from ocr_trace import tracer
+
+VISUALIZE_MODES = ("none", "fast", "paddle")
+
+# Font sizes are rounded to multiples of this, so glyphs are reused across boxes of similar height
+FONT_SIZE_STEP = 4
+# Pages waiting to be drawn before submit blocks (bounds the images held in memory)
+MAX_PENDING = 4
+
+BOX_COLOR = (0, 0, 255)
+TEXT_BOX_COLOR = (200, 200, 200)
+
+
+class GlyphCache:
+    """Renders characters once per (character, font size) with a TrueType font and reuses the masks."""
+
+    def __init__(self, font_path, size_step=FONT_SIZE_STEP):
+        self.font_path = font_path
+        self.size_step = size_step
+        self.fonts = {}
+        self.glyphs = {}
+
+    def _font(self, size):
+        font = self.fonts.get(size)
+        if font is None:
+            from PIL import ImageFont
+            font = self.fonts[size] = ImageFont.truetype(self.font_path, size)
+        return font
+
+    def glyph(self, char, size):
+        """Returns the uint8 coverage mask of one character; all glyphs of a size share one height."""
+        key = (char, size)
+        mask = self.glyphs.get(key)
+        if mask is None:
+            from PIL import Image, ImageDraw
+            font = self._font(size)
+            ascent, descent = font.getmetrics()
+            width = max(1, int(np.ceil(font.getlength(char))))
+            image = Image.new("L", (width, ascent + descent), 0)
+            ImageDraw.Draw(image).text((0, 0), char, fill=255, font=font)
+            mask = self.glyphs[key] = np.asarray(image)
+        return mask
+
+    def _size(self, size):
+        return max(self.size_step, int(size // self.size_step) * self.size_step)
+
+    def render(self, text, height, max_width=None):
+        """
+        Returns the mask of a text line whose glyph cells are about height pixels tall, with a smaller
+        font if needed to fit max_width.
+        """
+        if not text:
+            return np.zeros((0, 0), dtype=np.uint8)
+        size = self._size(height / 1.2)
+        mask = np.hstack([self.glyph(char, size) for char in text])
+        if max_width is not None and mask.shape[1] > max_width:
+            smaller = self._size(size * max_width / mask.shape[1])
+            if smaller < size:
+                mask = np.hstack([self.glyph(char, smaller) for char in text])
+        return mask
+
+
+def _paste_text(canvas, mask, x, y):
+    """Darkens canvas where mask is set (black text on the white text panel), clipped to the canvas."""
+    h = min(mask.shape[0], canvas.shape[0] - y)
+    w = min(mask.shape[1], canvas.shape[1] - x)
+    if h <= 0 or w <= 0:
+        return
+    region = canvas[y : y + h, x : x + w]
+    np.minimum(region, (255 - mask[:h, :w])[:, :, None], out=region)
+
+
+def render_fast(img, lines, scale=1.0, glyphs=None):
+    """
+    Draws an OCRLines on a copy of img (resized by scale) and, if glyphs (a GlyphCache) is given,
+    the recognized texts on a white panel to its right. Returns the BGR image.
+    """
+    import cv2
+    if scale != 1.0:
+        page = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    else:
+        page = img.copy()
+    if not len(lines):
+        return page
+    polys = list(np.round(lines.boxes * scale).astype(np.int32))
+    cv2.polylines(page, polys, True, BOX_COLOR, 1)
+    if glyphs is None:
+        return page
+
+    panel = np.full_like(page, 255)
+    cv2.polylines(panel, polys, True, TEXT_BOX_COLOR, 1)
+    bounds = np.round(lines.bounds() * scale).astype(np.int32)
+    for (x0, y0, x1, y1), text in zip(np.maximum(bounds, 0), lines.texts):
+        _paste_text(panel, glyphs.render(text, max(1, y1 - y0), max(1, x1 - x0)), x0, y0)
+    return np.hstack([page, panel])
+
+
+def render_paddle(img, lines, scale=1.0, font_path=None):
+    """Draws an OCRLines with PaddleOCR's draw_ocr (without texts when font_path is None)."""
+    import cv2
+    from paddleocr import draw_ocr
+    if not len(lines):
+        image = img.copy()
+    elif font_path is None:
+        image = draw_ocr(img, lines.boxes, txts=None, scores=None, font_path=None)
+    else:
+        image = draw_ocr(img, lines.boxes, txts=lines.texts, scores=lines.scores, font_path=font_path)
+    if scale != 1.0:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return image
+
+
+class Visualizer:
+    """Renders OCRLines with the fast or paddle renderer; texts are left out when the font file is missing."""
+
+    def __init__(self, mode="fast", scale=1.0, font_path=None):
+        self.mode = mode
+        self.scale = scale
+        if font_path is not None and not os.path.exists(font_path):
+            print(f"\nWarning: Font file not found at {font_path}. Visualizations will show the boxes without text.")
+            print("Please download a suitable font (like simfang.ttf) and place it at the specified path or update the font_path variable.")
+            font_path = None
+        self.font_path = font_path
+        self.glyphs = GlyphCache(font_path) if font_path is not None and mode == "fast" else None
+
+    def render(self, img, lines):
+        if self.mode == "paddle":
+            return render_paddle(img, lines, self.scale, self.font_path)
+        return render_fast(img, lines, self.scale, self.glyphs)
+
+
+class VisualizationWriter:
+    """
+    Renders visualizations with a Visualizer and writes them on a background thread. submit returns
+    immediately unless MAX_PENDING pages are already waiting; wait blocks until all are written.
+    """
+
+    def __init__(self, visualizer, max_pending=MAX_PENDING):
+        self.visualizer = visualizer
+        self.queue = queue.Queue(max_pending)
+        self.thread = threading.Thread(target=self._run, name="ocr-visualize", daemon=True)
+        self.thread.start()
+
+    def submit(self, img, lines, path):
+        self.queue.put((img, lines, path))
+
+    def _run(self):
+        import cv2
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                img, lines, path = item
+                with tracer.span("visualize"):
+                    cv2.imwrite(path, self.visualizer.render(img, lines))
+                print(f"Visualization saved to: {path}")
+            except Exception as e:
+                print(f"Error writing visualization {item[2]}: {e}")
+            finally:
+                self.queue.task_done()
+
+    def wait(self):
+        self.queue.join()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
@@ -0,0 +1,337 @@
+"""
+Multi-process execution for the OCR scripts.
+
+Each worker process loads its own PaddleOCR (and PP-Structure) engines once, warms them up with a
+tiny dummy inference and then handles pages (directory inputs) or row bands (a single tall
+fixed-grid image). Results are returned in input order. Input discovery (directories, globs and
+file lists) for the batch modes also lives here.
+
+Paddle is only imported inside the worker processes, after the per-worker thread count has been
+pinned, so N workers do not each start a full-size thread pool.
+
+When tracing is enabled in the parent (ocr_trace.tracer), each worker traces its tasks and sends the
+recorded spans back with every result, so the parent's trace covers all workers.
+"""
+import os
+import glob
+import functools
+import multiprocessing as mp
+import numpy as np
+
+from ocr_trace import tracer
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp')
+
+# Environment variables read by the OpenMP / BLAS runtimes used by Paddle and OpenCV
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+# Rows per band when a single grid image is split across workers (several bands per worker keeps them busy)
+BANDS_PER_WORKER = 4
+
+
+def list_image_files(input_path):
+    """Returns the sorted image files in a directory, or [input_path] for a single file."""
+    if not os.path.isdir(input_path):
+        return [input_path]
+    return sorted(os.path.join(input_path, name) for name in os.listdir(input_path)
+                  if name.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def _glob_root(pattern):
+    """Returns the leading part of a glob pattern that contains no wildcards."""
+    root_parts = []
+    for part in pattern.replace('\\', '/').split('/'):
+        if glob.has_magic(part):
+            break
+        root_parts.append(part)
+    return '/'.join(root_parts)
+
+
+def collect_image_inputs(inputs, file_list=None, extensions=IMAGE_EXTENSIONS):
+    """
+    Expands image files, directories (recursively) and glob patterns into (image_path, relative_path)
+    pairs. relative_path is relative to the directory or glob root the image was found under, so
+    callers can mirror the input tree in their output folder. Duplicates are dropped; different images
+    may still share a relative path (the same name under two roots), see output_names.
+    extensions selects which files directories and globs contribute (explicit file paths are always kept).
+    """
+    paths = list(inputs)
+    if file_list:
+        with open(file_list, encoding='utf-8') as f:
+            paths.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+
+    entries = []
+    seen = set()
+    for path in paths:
+        if os.path.isdir(path):
+            root = path
+            matches = [os.path.join(dirpath, name)
+                       for dirpath, _, filenames in os.walk(path)
+                       for name in filenames if name.lower().endswith(extensions)]
+        elif glob.has_magic(path):
+            root = _glob_root(path)
+            matches = [match for match in glob.glob(path, recursive=True)
+                       if os.path.isfile(match) and match.lower().endswith(extensions)]
+        else:
+            root = os.path.dirname(path)
+            matches = [path]
+
+        for match in sorted(matches):
+            key = os.path.abspath(match)
+            if key in seen:
+                continue
+            seen.add(key)
+            entries.append((match, os.path.relpath(match, root or '.')))
+    return entries
+
+
+def output_names(relative_paths):
+    """
+    Returns one output name (file stem) per relative image path, unique within its relative directory so
+    that no two images write the same outputs. A repeated stem (a/p.png and b/p.png given as separate
+    inputs, or p.png next to p.jpg) keeps its first image's name; later ones get the extension and, if
+    that is still taken, a counter appended, with a warning.
+    """
+    names = []
+    used = set()
+    for relative_path in relative_paths:
+        folder = os.path.dirname(relative_path)
+        stem, ext = os.path.splitext(os.path.basename(relative_path))
+        name = stem
+        # Compared case-insensitively, as the output folder may be on a case-insensitive file system
+        if (folder, name.lower()) in used:
+            name = f"{stem}_{ext.lstrip('.')}" if ext else stem
+            counter = 2
+            base = name
+            while (folder, name.lower()) in used:
+                name = f"{base}_{counter}"
+                counter += 1
+            print(f"Warning: {relative_path} has the same output name as an earlier input, writing it as {name}")
+        used.add((folder, name.lower()))
+        names.append(name)
+    return names
+
+
+def threads_per_worker(workers, threads=None):
+    """Returns the CPU thread count for each worker so that workers * threads fits the machine."""
+    if threads:
+        return threads
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+def pin_threads(num_threads):
+    """Limits OpenMP/BLAS/OpenCV thread pools of the current process (and processes it starts)."""
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(num_threads)
+    try:
+        import cv2
+        cv2.setNumThreads(num_threads)
+    except ImportError:
+        pass
+
+
+def warmup_ocr_engine(ocr):
+    """Runs a tiny dummy inference through the det/cls/rec models so the first real page is not slow."""
+    dummy = np.full((48, 320, 3), 255, dtype=np.uint8)
+    ocr.ocr(dummy, cls=getattr(ocr, 'use_angle_cls', False))
+    # A blank image yields no boxes, so run the classifier and recognizer directly as well
+    if getattr(ocr, 'text_classifier', None) is not None:
+        ocr.text_classifier([dummy])
+    ocr.text_recognizer([dummy])
+
+
+def _init_traced_worker(initializer, initargs, profile_slowest):
+    initializer(*initargs)
+    tracer.enable(profile_slowest) # After loading and warm-up, so they do not count as pipeline stages
+
+
+def _traced_task(task_fn, task):
+    result = task_fn(task)
+    return result, tracer.drain()
+
+
+def iter_pool(workers, num_threads, initializer, initargs, task_fn, tasks):
+    """Runs task_fn over tasks on a pool of warm workers and yields the results in input order as they finish."""
+    # Pin the parent environment before starting the workers so they inherit the limits at startup
+    pin_threads(num_threads)
+    ctx = mp.get_context("spawn") # Paddle is not fork-safe once initialized
+    if not tracer.enabled:
+        with ctx.Pool(workers, initializer=initializer, initargs=initargs) as pool:
+            yield from pool.imap(task_fn, tasks, chunksize=1)
+        return
+
+    profile_slowest = tracer.profiler.keep if tracer.profiler is not None else 0
+    with ctx.Pool(workers, initializer=_init_traced_worker, initargs=(initializer, initargs, profile_slowest)) as pool:
+        for result, trace in pool.imap(functools.partial(_traced_task, task_fn), tasks, chunksize=1):
+            tracer.merge(trace)
+            yield result
+
+
+def run_pool(workers, num_threads, initializer, initargs, task_fn, tasks):
+    """Runs task_fn over tasks on a pool of warm workers and returns the results in input order."""
+    return list(iter_pool(workers, num_threads, initializer, initargs, task_fn, tasks))
+
+
+# --- Fixed-grid workers (ocrtest_fixed.py) ---
+
+def _init_grid_worker(engine_args, num_threads, cache_args=None):
+    pin_threads(num_threads)
+    import ocrtest_fixed
+    ocrtest_fixed.initialize_ocr(*engine_args, cpu_threads=num_threads)
+    if cache_args:
+        ocrtest_fixed.initialize_cache(*cache_args) # Workers share the SQLite file, each with its own memory tier
+    warmup_ocr_engine(ocrtest_fixed.ocr_engine)
+
+
+def _grid_band_task(task):
+    import ocrtest_fixed
+    band_np, row_height, col_widths, rec_only, grid_options = task
+    if rec_only:
+        return ocrtest_fixed.ocr_grid_rows_batched(band_np, row_height, col_widths, **grid_options)
+    return ocrtest_fixed.ocr_grid_rows(band_np, row_height, col_widths, **grid_options)
+
+
+def _grid_page_task(task):
+    import ocrtest_fixed
+    image_path, output_csv_path, row_height, col_widths, rec_only, grid_options = task
+    if rec_only:
+        ocrtest_fixed.process_image_fixed_grid_batched(image_path, output_csv_path, row_height, col_widths,
+                                                       **grid_options)
+    else:
+        ocrtest_fixed.process_image_fixed_grid(image_path, output_csv_path, row_height, col_widths, **grid_options)
+    return output_csv_path
+
+
+def iter_grid_rows_parallel(img_np, row_height, col_widths, workers, engine_args, rec_only=False, grid_options=None,
+                            threads=None, cache_args=None, grid_edges=None, start_row=0):
+    """
+    Splits a single grid image into row bands, OCRs the bands on a worker pool and yields the table
+    rows in order as the bands complete. Rows before start_row (already written by an interrupted
+    run) are not processed.
+    engine_args and cache_args are the positional arguments of ocrtest_fixed.initialize_ocr and
+    initialize_cache; grid_options are the keyword arguments of ocrtest_fixed.ocr_grid_rows, or of
+    ocr_grid_rows_batched when rec_only is set. grid_edges = (row_edges, col_edges) replaces the
+    fixed grid with a detected one.
+    """
+    grid_options = grid_options or {}
+    if grid_options.get("orientation") == "page":
+        # A band cannot be rotated on its own, so upside-down bands fall back to per-cell classification
+        grid_options = dict(grid_options, allow_rotation=False)
+    if grid_edges is not None:
+        row_edges, col_edges = grid_edges
+    else:
+        row_edges = list(range(0, (img_np.shape[0] // row_height) * row_height + 1, row_height))
+    total_rows = len(row_edges) - 1
+    band_rows = max(1, -(-(total_rows - start_row) // (workers * BANDS_PER_WORKER)))
+    tasks = []
+    for band_start in range(start_row, total_rows, band_rows):
+        band_end = min(band_start + band_rows, total_rows)
+        y0, y1 = row_edges[band_start], row_edges[band_end]
+        band_options = grid_options
+        if grid_edges is not None:
+            band_row_edges = [y - y0 for y in row_edges[band_start : band_end + 1]]
+            band_options = dict(grid_options, grid_edges=(band_row_edges, col_edges))
+        tasks.append((np.ascontiguousarray(img_np[y0:y1]), row_height, col_widths, rec_only, band_options))
+    if not tasks:
+        return
+
+    num_threads = threads_per_worker(workers, threads)
+    print(f"Splitting {total_rows - start_row} rows into {len(tasks)} bands across {workers} workers "
+          f"({num_threads} threads each)")
+    for band in iter_pool(workers, num_threads, _init_grid_worker, (engine_args, num_threads, cache_args),
+                          _grid_band_task, tasks):
+        yield from band
+
+
+def ocr_grid_rows_parallel(img_np, row_height, col_widths, workers, engine_args, rec_only=False, grid_options=None,
+                           threads=None, cache_args=None, grid_edges=None):
+    """Runs iter_grid_rows_parallel over a whole grid and returns the reassembled table rows."""
+    return list(iter_grid_rows_parallel(img_np, row_height, col_widths, workers, engine_args, rec_only, grid_options,
+                                        threads, cache_args, grid_edges))
+
+
+def process_grid_pages_parallel(image_paths, output_csv_paths, row_height, col_widths, workers, engine_args,
+                                rec_only=False, grid_options=None, threads=None, cache_args=None):
+    """Processes one grid page per task on a worker pool, writing one CSV per page. Returns the CSV paths."""
+    grid_options = grid_options or {}
+    num_threads = threads_per_worker(workers, threads)
+    print(f"Processing {len(image_paths)} pages across {workers} workers ({num_threads} threads each)")
+    tasks = [(image_path, csv_path, row_height, col_widths, rec_only, grid_options)
+             for image_path, csv_path in zip(image_paths, output_csv_paths)]
+    return run_pool(workers, num_threads, _init_grid_worker, (engine_args, num_threads, cache_args),
+                    _grid_page_task, tasks)
+
+
+# --- Document workers (ocrtest.py) ---
+
+_document_engines = {}
+
+
+def _init_document_worker(num_threads, shared, cache_args=None, text_only=False, orientation="line", visualize=None,
+                          det_profile_path=None, templates_args=None):
+    pin_threads(num_threads)
+    import ocrtest
+    from det_autotune import load_det_profile
+    from layout_templates import LayoutTemplateStore
+    from ocr_cache import OCRCache
+    from ocr_visualize import VisualizationWriter, Visualizer
+    _document_engines['cache'] = OCRCache(*cache_args) if cache_args else None
+    _document_engines['orientation'] = orientation
+    _document_engines['det_profile'] = load_det_profile(det_profile_path) if det_profile_path else None
+    _document_engines['templates'] = LayoutTemplateStore(*templates_args) if templates_args else None
+    _document_engines['visualizer'] = (VisualizationWriter(Visualizer(*visualize, font_path=ocrtest.font_path))
+                                       if visualize else None)
+    if text_only:
+        ocr = ocrtest.create_ocr_engine(cpu_threads=num_threads)
+        engine = None
+    elif shared:
+        ocr = None
+        engine = ocrtest.create_structure_engine(cpu_threads=num_threads, shared_ocr=True)
+    else:
+        ocr = ocrtest.create_ocr_engine(cpu_threads=num_threads)
+        engine = ocrtest.create_structure_engine(cpu_threads=num_threads)
+    ocrtest.warmup_engines(ocr, engine)
+    _document_engines['ocr'] = ocr
+    _document_engines['structure'] = engine
+
+
+def _document_task(task):
+    import ocrtest
+    image_path, save_folder, name, visualization_path = task
+    cache = _document_engines['cache']
+    visualizer = _document_engines['visualizer']
+    summary = ocrtest.process_image(image_path, _document_engines['ocr'], _document_engines['structure'],
+                                    save_folder, name, visualization_path, cache, _document_engines['orientation'],
+                                    visualizer, _document_engines['det_profile'], _document_engines['templates'])
+    if cache is not None:
+        cache.flush() # Workers are never closed explicitly, so commit after every page
+    if visualizer is not None:
+        visualizer.wait() # Drawn while the structure results were written; done before the pool may exit
+    return summary
+
+
+def iter_documents_parallel(tasks, workers, threads=None, shared=True, cache_args=None, text_only=False,
+                            orientation="line", visualize=None, det_profile_path=None, templates_args=None):
+    """
+    Runs ocrtest.process_image for each (image_path, save_folder, name, visualization_path) task
+    on a worker pool. With shared=True each worker uses the shared det/rec pipeline, with text_only
+    only the basic OCR engine; cache_args, if given, are the OCRCache arguments for each worker.
+    orientation is the strategy passed to process_image ("line" or "page"); visualize = (mode, scale)
+    makes each worker write visualizations (see ocr_visualize); det_profile_path is a profile written
+    by det_autotune.py; templates_args, if given, are the LayoutTemplateStore arguments (the workers
+    share its file).
+    Yields the per-image results in input order as they finish.
+    """
+    num_threads = threads_per_worker(workers, threads)
+    print(f"Processing {len(tasks)} images across {workers} workers ({num_threads} threads each)")
+    yield from iter_pool(workers, num_threads, _init_document_worker,
+                         (num_threads, shared, cache_args, text_only, orientation, visualize, det_profile_path,
+                          templates_args),
+                         _document_task, tasks)
+
+
+def process_documents_parallel(tasks, workers, threads=None, shared=True, cache_args=None, text_only=False,
+                               orientation="line", visualize=None, det_profile_path=None, templates_args=None):
+    """Runs iter_documents_parallel and returns the per-image results in input order."""
+    return list(iter_documents_parallel(tasks, workers, threads, shared, cache_args, text_only, orientation,
+                                        visualize, det_profile_path, templates_args))
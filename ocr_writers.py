@@ -0,0 +1,193 @@
+"""
+Streaming, checkpointed output writers for the OCR scripts.
+
+Rows are written to the output file as they are produced instead of being collected for one write at
+the end, so memory stays flat on very large grids. Every few rows the file is flushed and a small
+checkpoint (<output>.ckpt: rows written, byte offset and a description of the job) is stored next to
+it; the checkpoint is removed once the output is complete. A resumed writer truncates the file to the
+last checkpoint and reports how many rows are already done, so an interrupted job continues where it
+stopped instead of redoing the OCR.
+
+CSV and JSONL (one JSON value per row) are appended directly. XLSX files cannot be appended to, so
+rows are spooled to a checkpointed JSONL file and streamed into an openpyxl write-only workbook when
+the writer is closed.
+"""
+import csv
+import io
+import json
+import os
+
+CHECKPOINT_SUFFIX = ".ckpt"
+OUTPUT_FORMATS = ("csv", "jsonl", "xlsx")
+
+# Rows between checkpoints (each one flushes and fsyncs the output)
+CHECKPOINT_EVERY = 10
+
+
+def checkpoint_path(output_path):
+    return output_path + CHECKPOINT_SUFFIX
+
+
+def read_checkpoint(output_path):
+    """Returns the checkpoint dict of an unfinished output, or None if there is none (or it is unreadable)."""
+    try:
+        with open(checkpoint_path(output_path), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_checkpoint(output_path, state):
+    path = checkpoint_path(output_path)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def _encode_csv(row):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(row)
+    return buffer.getvalue().encode("utf-8")
+
+
+def _encode_jsonl(row):
+    return (json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def read_rows(path):
+    """Yields the rows of a CSV or JSONL file written by a RowWriter."""
+    if path.lower().endswith(".jsonl"):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with open(path, newline="", encoding="utf-8") as f:
+            yield from csv.reader(f)
+
+
+class RowWriter:
+    """
+    Appends rows to a CSV file (or JSONL, for a .jsonl path) with periodic checkpoints.
+    With resume=True an unfinished output whose checkpoint was written for the same job (meta) is
+    continued: rows_done tells the caller how many rows to skip. A finished output (no checkpoint)
+    is left untouched and reported by complete. Use as a context manager: leaving the block normally
+    completes the output, an exception leaves the last checkpoint in place.
+    """
+
+    def __init__(self, path, resume=False, meta=None, checkpoint_every=CHECKPOINT_EVERY):
+        self.path = path
+        self.meta = meta
+        self.checkpoint_every = checkpoint_every
+        self.encode = _encode_jsonl if path.lower().endswith(".jsonl") else _encode_csv
+        self.rows_done = 0
+        self.complete = False
+        self.file = None
+        self._pending = 0
+
+        offset = 0
+        if resume:
+            state = read_checkpoint(path)
+            if state is None and self._finished():
+                self.complete = True
+                return
+            if state is not None and state.get("meta") == meta and os.path.exists(path):
+                self.rows_done, offset = state["rows"], state["offset"]
+            elif state is not None:
+                print(f"Checkpoint of {path} belongs to a different job, starting over.")
+
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        if offset:
+            self.file = open(path, "r+b")
+            self.file.truncate(offset) # Drop rows written after the last checkpoint
+            self.file.seek(offset)
+            print(f"Resuming {path} after {self.rows_done} rows.")
+        else:
+            self.file = open(path, "wb")
+        self.checkpoint()
+
+    def _finished(self):
+        return os.path.exists(self.path)
+
+    def write_row(self, row):
+        self.file.write(self.encode(row))
+        self.rows_done += 1
+        self._pending += 1
+        if self._pending >= self.checkpoint_every:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Makes the rows written so far durable and records them in the checkpoint file."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        _write_checkpoint(self.path, {"rows": self.rows_done, "offset": self.file.tell(), "meta": self.meta})
+        self._pending = 0
+
+    def close(self, complete=True):
+        """Closes the output; complete=False keeps the checkpoint so the job can be resumed."""
+        if self.file is None:
+            return
+        if complete:
+            self.file.close()
+            os.remove(checkpoint_path(self.path))
+            self.complete = True
+        else:
+            self.checkpoint()
+            self.file.close()
+        self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(complete=exc_type is None)
+        return False
+
+
+class XLSXRowWriter(RowWriter):
+    """
+    RowWriter for .xlsx outputs: rows are spooled to <path>.rows.jsonl (which carries the checkpoint)
+    and converted with an openpyxl write-only workbook on completion.
+    """
+
+    def __init__(self, path, resume=False, meta=None, checkpoint_every=CHECKPOINT_EVERY):
+        self.xlsx_path = path
+        super().__init__(path + ".rows.jsonl", resume, meta, checkpoint_every)
+
+    def _finished(self):
+        return os.path.exists(self.xlsx_path)
+
+    def close(self, complete=True):
+        if self.file is None or not complete:
+            super().close(complete)
+            return
+        self.file.close()
+        self.file = None
+        from openpyxl import Workbook # Optional dependency, only needed for .xlsx outputs
+
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        for row in read_rows(self.path):
+            sheet.append(row)
+        tmp_path = self.xlsx_path + ".tmp"
+        workbook.save(tmp_path)
+        os.replace(tmp_path, self.xlsx_path)
+        os.remove(checkpoint_path(self.path))
+        os.remove(self.path)
+        self.complete = True
+
+
+def open_row_writer(path, resume=False, meta=None, checkpoint_every=CHECKPOINT_EVERY):
+    """Returns the checkpointed writer for path's format (.csv, .jsonl or .xlsx)."""
+    if path.lower().endswith(".xlsx"):
+        return XLSXRowWriter(path, resume, meta, checkpoint_every)
+    return RowWriter(path, resume, meta, checkpoint_every)
+
+
+def is_complete(path):
+    """True if path is a finished output (it exists and has no pending checkpoint)."""
+    spool = path + ".rows.jsonl" if path.lower().endswith(".xlsx") else path
+    return os.path.exists(path) and not os.path.exists(checkpoint_path(spool))
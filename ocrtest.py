@@ -2,14 +2,30 @@ import warnings
 import logging
 import sys
 import os
-import cv2
 import json
+import copy
+import numpy as np
+import argparse
+import time
+
+# Reference point for the time-to-first-result report
+SCRIPT_START = time.perf_counter()
 
 # Suppress the specific UserWarning from PaddlePaddle about ccache
 warnings.filterwarnings("ignore", category=UserWarning, module='paddle.utils.cpp_extension.extension_utils')
 
-from paddleocr import PaddleOCR, draw_ocr
-from paddleocr import PPStructure, save_structure_res
+# paddleocr (which imports paddle) and cv2 are imported where they are first needed, so the script
+# starts quickly and runs that never need a model (all pages cached, --help) never load paddle.
+import ocr_workers
+from det_autotune import load_det_profile
+from layout_templates import LayoutTemplateStore, MATCH_THRESHOLD, report_template_statuses
+from ocr_cache import OCRCache
+from ocr_result import OCRLines
+from ocr_visualize import VISUALIZE_MODES, VisualizationWriter, Visualizer
+from ocr_trace import tracer, instrument_text_system, instrument_structure_engine
+from ocr_workers import collect_image_inputs
+from ocr_writers import RowWriter, read_rows
+from page_orientation import ORIENTATION_STRATEGIES, orient_page_text, rotate_180
 
 # Set ppocr logger level to INFO to suppress DEBUG messages
 logging.getLogger('ppocr').setLevel(logging.INFO)
@@ -24,163 +40,689 @@ TABLE_MODEL_DIR="./ch_ppstructure_mobile_v2.0_SLANet_infer"
 REC_CHAR_DICT_PATH="./ppocr_keys_v1.txt"
 TABLE_CHAR_DICT_PATH="./table_structure_dict.txt"
 
-# read image_path from sys argv
-image_path = sys.argv[1]
-IS_DISPLAY_DEBUG = False
+# Model directories whose files invalidate the result cache when they change
+CACHE_MODEL_DIRS = [DET_MODEL_DIR, CLS_MODEL_DIR, REC_MODEL_DIR, TABLE_MODEL_DIR]
 
-# 2. 初始化 OCR 引擎，强制使用中文
-ocr = PaddleOCR(
-    det_model_dir=DET_MODEL_DIR,
-    cls_model_dir=CLS_MODEL_DIR,
-    rec_model_dir=REC_MODEL_DIR,
-    use_angle_cls=True,   # 启用文字方向分类
-    lang="ch"             # 仅加载中文识别
-)
-
-# Define a helper function to recursively extract OCR line data
-def get_ocr_lines(data):
-    lines = []
-    if isinstance(data, list):
-        # Heuristic check: if the first element of 'data' looks like an OCR line item,
-        # assume 'data' is the list of OCR line items we are looking for.
-        # An OCR line item is typically [bbox, (text, score)]
-        # where bbox is List[List[float/int]] and (text, score) is Tuple[str, float]
-        is_direct_list_of_lines = False
-        if data: # Check if data is not empty
-            first_item = data[0]
-            if (isinstance(first_item, list) and len(first_item) == 2 and
-                    isinstance(first_item[0], list) and  # bbox
-                    (first_item[0] and isinstance(first_item[0][0], list)) and # first point in bbox
-                    (first_item[0][0] and (isinstance(first_item[0][0][0], float) or isinstance(first_item[0][0][0], int))) and # x-coordinate
-                    isinstance(first_item[1], tuple) and len(first_item[1]) == 2 and  # (text, score) tuple
-                    isinstance(first_item[1][0], str) and isinstance(first_item[1][1], float)):
-                is_direct_list_of_lines = True
-                # Further check if all items in data follow this pattern (optional for brevity here, but good for robustness)
-
-        if is_direct_list_of_lines:
-            return data # This list 'data' is the list of OCR lines
-        else:
-            # If not a direct list of lines, assume it's a list of sub-lists and recurse
-            for sub_list in data:
-                lines.extend(get_ocr_lines(sub_list))
-    return lines
+IS_DISPLAY_DEBUG = False
 
 # Define path for font file (needed for drawing Chinese characters)
 # You might need to change this path based on where you have simfang.ttf or another suitable font
 font_path = './fonts/simfang.ttf'
 
-# 3. 读取图片（也可以传入 numpy 数组）
-img = cv2.imread(image_path)
-
-# 4. 执行 OCR
-results = ocr.ocr(img, cls=True)
-print("Raw OCR results:")
-print(results)
-
-# Extract boxes, texts, and scores for draw_ocr
-boxes = None
-txts = None
-scores = None
-# Check if results is not None, not empty, and results[0] is not empty
-if results and results[0]:
-    processed_results = results[0]
+# Score cut-off PaddleOCR applies to the basic OCR results (PP-Structure itself keeps every line)
+OCR_DROP_SCORE = 0.5
+
+# Model directories whose files invalidate the layout templates when they change
+TEMPLATE_MODEL_DIRS = [TABLE_MODEL_DIR]
+# Table cells whose ink is this many times taller than the table's median may hold several lines and
+# are run through detection as well when a layout template is used
+MULTILINE_CELL_FACTOR = 1.8
+# Cell crops with a smaller gray-level standard deviation are blank and not recognized
+BLANK_CELL_STD = 8.0
+
+# Per-image summaries of finished images in --output_dir, one JSON object per line (read by --resume)
+PROGRESS_LOG = "progress.jsonl"
+
+# Paddle predictors created in this process, keyed by model and runtime settings (see _share_predictors)
+_predictors = {}
+
+def _share_predictors():
+    """
+    Makes PaddleOCR reuse a predictor that is already loaded when the same model directory is requested
+    again with the same runtime settings, e.g. the det/rec models of the PaddleOCR and PP-Structure
+    engines with --separate_engines, which are otherwise loaded and optimized twice.
+    """
     try:
-        boxes = [line[0] for line in processed_results]  # List of bounding boxes
-        txts = [line[1][0] for line in processed_results]   # List of text strings
-        scores = [line[1][1] for line in processed_results] # List of scores
-    except (IndexError, TypeError) as e:
-        print(f"Error extracting data from results: {e}. Results format might be unexpected.")
-        # Keep boxes, txts, scores as None
-
-# --- Visualization using draw_ocr ---
-# Ensure the font file exists before trying to draw
-if not os.path.exists(font_path):
-    print(f"\nWarning: Font file not found at {font_path}. Text rendering in the output image might be incorrect.")
-    print("Please download a suitable font (like simfang.ttf) and place it at the specified path or update the font_path variable.")
-    # Draw without text if font is missing (optional, draw_ocr might handle it)
-    # Or exit/skip drawing if font is critical
-    # Pass separated 'boxes' list to draw_ocr
-    if boxes: # Check if boxes were successfully extracted
-        image_with_boxes = draw_ocr(img, boxes, txts=None, scores=None, font_path=None)
+        from tools.infer import utility # Importable once paddleocr has been imported
+    except ImportError:
+        return
+    create_predictor = getattr(utility, "create_predictor", None)
+    if create_predictor is None or getattr(create_predictor, "shared", False):
+        return
+
+    def shared_create_predictor(args, mode, logger):
+        key = (mode, getattr(args, f"{mode}_model_dir", None), args.use_gpu, args.use_onnx, args.enable_mkldnn,
+               getattr(args, "cpu_threads", None), getattr(args, "precision", None), args.use_tensorrt)
+        if key not in _predictors:
+            _predictors[key] = create_predictor(args, mode, logger)
+        return _predictors[key]
+
+    shared_create_predictor.shared = True
+    utility.create_predictor = shared_create_predictor
+
+class LazyEngine:
+    """
+    Stands in for an engine and builds it on first use, so pages served from the cache (or an empty
+    run) never import paddle or load the models. Calls and attribute access go to the real engine.
+    """
+
+    def __init__(self, factory, *args, **kwargs):
+        self._factory = factory
+        self._args = args
+        self._kwargs = kwargs
+        self._engine = None
+
+    def load(self):
+        if self._engine is None:
+            with tracer.span("model_load"):
+                self._engine = self._factory(*self._args, **self._kwargs)
+        return self._engine
+
+    def __call__(self, *args, **kwargs):
+        return self.load()(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+def create_ocr_engine(cpu_threads=10):
+    """Creates the basic PaddleOCR engine."""
+    from paddleocr import PaddleOCR
+    _share_predictors()
+    # 2. 初始化 OCR 引擎，强制使用中文
+    ocr = PaddleOCR(
+        det_model_dir=DET_MODEL_DIR,
+        cls_model_dir=CLS_MODEL_DIR,
+        rec_model_dir=REC_MODEL_DIR,
+        use_angle_cls=True,   # 启用文字方向分类
+        lang="ch",            # 仅加载中文识别
+        cpu_threads=cpu_threads
+    )
+    instrument_text_system(ocr) # Per-stage timings when tracing is enabled (--trace_dir)
+    return ocr
+
+def create_structure_engine(cpu_threads=10, shared_ocr=False):
+    """
+    Creates the PP-Structure engine.
+    With shared_ocr=True the angle classifier is loaded as well, so the engine's text system can
+    stand in for the separate PaddleOCR engine (see run_shared_pipeline).
+    """
+    from paddleocr import PPStructure
+    _share_predictors()
+    # 6. 初始化 PP-Structure 引擎
+    engine = PPStructure(
+        det_model_dir=DET_MODEL_DIR,
+        rec_model_dir=REC_MODEL_DIR,
+        table_model_dir=TABLE_MODEL_DIR,
+        cls_model_dir=CLS_MODEL_DIR,
+        use_angle_cls=shared_ocr,
+        #rec_char_dict_path=REC_CHAR_DICT_PATH,
+        #table_char_dict_path=TABLE_CHAR_DICT_PATH,
+        lang="ch",  # 中文环境
+        cpu_threads=cpu_threads
+    )
+    instrument_structure_engine(engine)
+    return engine
+
+def warmup_engines(ocr, engine):
+    """Runs a tiny dummy inference through every loaded model so the first real page is not slow."""
+    dummy = np.full((48, 320, 3), 255, dtype=np.uint8)
+    if ocr is not None:
+        ocr_workers.warmup_ocr_engine(ocr)
+    if engine is None:
+        return
+    engine(dummy)
+    # A blank page yields no text boxes or table regions, so run those models directly as well
+    if ocr is None:
+        text_system = engine.text_system
+        if getattr(text_system, 'text_classifier', None) is not None:
+            text_system.text_classifier([dummy])
+        text_system.text_recognizer([dummy])
+    table_system = getattr(engine, 'table_system', None)
+    if table_system is not None:
+        table_system._structure(dummy)
+
+def report_ocr_results(lines, img, visualization_path='./result_visualization.jpg', visualizer=None):
+    """
+    Prints basic OCR results (an OCRLines) and returns the lines. With a VisualizationWriter the
+    visualization is queued for writing to visualization_path on its background thread.
+    """
+    if visualizer is not None:
+        visualizer.submit(img, lines, visualization_path)
+
+    # Display the image
+    if IS_DISPLAY_DEBUG:
+        import cv2
+        image_with_boxes = Visualizer("paddle", font_path=font_path).render(img, lines)
+        cv2.imshow('OCR Result Visualization', image_with_boxes)
+        print("Press any key in the image window to close it.")
+        cv2.waitKey(0)  # Wait indefinitely until a key is pressed
+        cv2.destroyAllWindows() # Close the image window
+
+    # 5. 打印识别结果
+    if not len(lines):
+        print("\nNo text detected.")
+    else:
+        print(f"\nProcessed {len(lines)} lines of text:")
+        for i, (text, score) in enumerate(zip(lines.texts, lines.scores)):
+            print(f"Line {i+1}: {text}    # Confidence: {score:.3f}")
+
+    return lines
+
+def save_structure_results(results, save_folder="./output", name="mytable"):
+    """Saves PP-Structure results as xlsx/txt/json under save_folder. Returns the JSON-serializable regions."""
+    from paddleocr import save_structure_res
+    # 8. 导出结果
+    # 调用 save_structure_res，仅用三个必选参数
+    os.makedirs(save_folder, exist_ok=True)
+    save_structure_res(results, save_folder, name)
+
+    # 这样会在 save_folder 下产出：
+    #   <name>.xlsx  —— 表格形式
+    #   <name>.txt   —— 每行 JSON 格式的识别结果
+
+    # 2) 如果你只想要一个纯 JSON 文件，可以这样做：
+    #    （同时过滤掉 'img' 字段，否则无法序列化）
+    cleaned = []
+    for region in results:
+        entry = {k:v for k,v in region.items() if k != "img"}
+        cleaned.append(entry)
+    with open(os.path.join(save_folder, f"{name}.json"), "w", encoding="utf-8") as f:
+        json.dump(cleaned, f, ensure_ascii=False, indent=2)
+
+    return cleaned
+
+def _table_match_boxes(quads, x0, y0, width, height):
+    """
+    Converts quad text boxes to the [x_min, y_min, x_max, y_max] boxes, relative to a table crop
+    at (x0, y0), that PP-Structure's table matcher expects.
+    """
+    if len(quads) == 0:
+        return np.zeros((0, 4), dtype=np.float32)
+    x_min = np.clip(quads[:, :, 0].min(axis=1) - x0 - 1, 0, width)
+    y_min = np.clip(quads[:, :, 1].min(axis=1) - y0 - 1, 0, height)
+    x_max = np.clip(quads[:, :, 0].max(axis=1) - x0 + 1, 0, width)
+    y_max = np.clip(quads[:, :, 1].max(axis=1) - y0 + 1, 0, height)
+    return np.stack([x_min, y_min, x_max, y_max], axis=1)
+
+def _run_text_system_on_crop(text_system, img, x1, y1, x2, y2, blank_boxes=()):
+    """
+    Runs det/cls/rec on a crop of img and returns (boxes, rec_res) in page coordinates. Parts of the
+    crop inside blank_boxes ([x1, y1, x2, y2] in page coordinates) are painted white first.
+    """
+    crop = img[y1:y2, x1:x2]
+    if len(blank_boxes):
+        crop = crop.copy()
+        for bx1, by1, bx2, by2 in blank_boxes:
+            crop[max(0, by1 - y1):max(0, by2 - y1), max(0, bx1 - x1):max(0, bx2 - x1)] = 255
+    dt_boxes, rec_res, _ = text_system(crop, cls=True)
+    return [np.asarray(box) + np.float32([x1, y1]) for box in dt_boxes], list(rec_res)
+
+def _cell_ink(crop):
+    """
+    Returns ([x1, y1, x2, y2] around the ink of a table cell crop, widest empty column gap inside it),
+    ignoring the ruling lines the cell box may include, or None when the cell has no ink.
+    """
+    from grid_detect import ink_mask
+    ink = ink_mask(crop) > 0
+    ink[ink.mean(axis=1) > 0.8] = False
+    ink[:, ink.mean(axis=0) > 0.8] = False
+    ys, xs = np.nonzero(ink)
+    if not len(ys):
+        return None
+    x1, x2 = int(xs.min()), int(xs.max()) + 1
+    padded = np.concatenate(([False], ~ink[:, x1:x2].any(axis=0), [False]))
+    gaps = np.flatnonzero(padded[1:] != padded[:-1]).reshape(-1, 2)
+    widest_gap = int((gaps[:, 1] - gaps[:, 0]).max()) if len(gaps) else 0
+    return [x1, int(ys.min()), x2, int(ys.max()) + 1], widest_gap
+
+def recognize_template_cells(text_system, img, regions):
+    """
+    Reads the text of a page matched to a layout template (regions as returned by
+    TemplateMatch.regions) without running detection on its tables: each non-blank table cell is
+    cropped and recognized as one line, in one batch, with the box of its ink as the line box. Cells
+    whose ink is much taller than the table's median (several lines) or has wide gaps (several pieces
+    of text) go through det/rec like the non-table regions. So does all text outside the regions and
+    cells (see layout_templates.uncovered_text_boxes), which the template knows nothing about.
+    Returns (dt_boxes, rec_res) in page coordinates and reading order, filtered like TextSystem results.
+    """
+    from layout_templates import uncovered_text_boxes
+    boxes, rec_res = [], []
+    crops, crop_boxes = [], []
+    covered = []
+
+    def detect(x1, y1, x2, y2, blank_boxes=()):
+        region_boxes, region_res = _run_text_system_on_crop(text_system, img, x1, y1, x2, y2, blank_boxes)
+        boxes.extend(region_boxes)
+        rec_res.extend(region_res)
+
+    for label, (x1, y1, x2, y2), structure_res in regions:
+        if structure_res is None or not len(structure_res[1]):
+            detect(x1, y1, x2, y2)
+            covered.append([x1, y1, x2, y2])
+            continue
+        cells = structure_res[1].reshape(len(structure_res[1]), -1)
+        cell_x = cells[:, 0::2] + x1
+        cell_y = cells[:, 1::2] + y1
+        cell_bounds = np.stack([cell_x.min(axis=1), cell_y.min(axis=1), cell_x.max(axis=1), cell_y.max(axis=1)], axis=1)
+        cell_bounds = np.clip(cell_bounds.round(), 0, [img.shape[1], img.shape[0]] * 2).astype(int)
+        covered.extend(cell_bounds.tolist())
+        inked = []
+        for cx1, cy1, cx2, cy2 in cell_bounds:
+            crop = img[cy1:cy2, cx1:cx2]
+            if crop.size == 0 or crop.std() < BLANK_CELL_STD:
+                continue
+            ink = _cell_ink(crop)
+            if ink is not None:
+                inked.append(((cx1, cy1, cx2, cy2), crop) + ink)
+        if not inked:
+            continue
+        tall = MULTILINE_CELL_FACTOR * np.median([bounds[3] - bounds[1] for _, _, bounds, _ in inked])
+        for (cx1, cy1, cx2, cy2), crop, bounds, widest_gap in inked:
+            # Several lines, or pieces of text further apart than twice the text height
+            if bounds[3] - bounds[1] > tall or widest_gap > 2 * (bounds[3] - bounds[1]):
+                detect(cx1, cy1, cx2, cy2)
+            else:
+                bx1, by1, bx2, by2 = bounds
+                crops.append(crop)
+                crop_boxes.append(np.float32([[cx1 + bx1, cy1 + by1], [cx1 + bx2, cy1 + by1],
+                                              [cx1 + bx2, cy1 + by2], [cx1 + bx1, cy1 + by2]]))
+
+    for x1, y1, x2, y2 in uncovered_text_boxes(img, covered):
+        detect(x1, y1, x2, y2, covered)
+
+    if crops:
+        if getattr(text_system, 'use_angle_cls', False) and getattr(text_system, 'text_classifier', None) is not None:
+            crops, _, _ = text_system.text_classifier(crops)
+        cell_res, _ = text_system.text_recognizer(crops)
+        for box, (text, score) in zip(crop_boxes, cell_res):
+            if score >= text_system.drop_score:
+                boxes.append(box)
+                rec_res.append((text, score))
+    # Top to bottom, then left to right, like the boxes of a full-page detection
+    order = sorted(range(len(boxes)), key=lambda i: (float(boxes[i][:, 1].min()), float(boxes[i][:, 0].min())))
+    return [boxes[i] for i in order], [rec_res[i] for i in order]
+
+def run_shared_pipeline(engine, img, text_results=None, templates=None):
+    """
+    Runs text detection/recognition once on the whole page and reuses it for both the basic OCR
+    output and the PP-Structure regions.
+
+    Layout analysis and SLANet table structure run as usual, but table cells are matched against the
+    text already recognized on the page instead of running det/rec again on every table crop, and no
+    separate PaddleOCR engine is needed. The engine must be created with create_structure_engine(shared_ocr=True).
+    text_results = (dt_boxes, rec_res) skips the det/rec pass, e.g. when it was run for several pages at once.
+    With a LayoutTemplateStore, a page matching a known layout reuses the template's regions and table
+    structure, skipping layout analysis and SLANet; its text comes from recognize_template_cells
+    (unless text_results is given). Other pages are analysed in full and added as templates.
+    Returns (lines, structure_results): the page's OCRLines scoring at least OCR_DROP_SCORE (what
+    PaddleOCR.ocr would keep) and the regions in the format of PPStructure.__call__.
+    """
+    text_system = engine.text_system
+    table_system = engine.table_system
+    image_height, image_width = img.shape[:2]
+
+    template_regions = fingerprint = None
+    if templates is not None:
+        with tracer.span("layout_template"):
+            match, fingerprint = templates.lookup(img)
+        if match is not None:
+            template_regions = match.regions()
+            if text_results is None:
+                with tracer.span("template_rec"):
+                    text_results = recognize_template_cells(text_system, img, template_regions)
+
+    # 4. 执行 OCR：整页只做一次检测 + 方向分类 + 识别
+    if text_results is None:
+        dt_boxes, rec_res, _ = text_system(img, cls=True)
     else:
-        print("Error: Could not draw boxes as they were not extracted successfully.")
-        image_with_boxes = img.copy() # Use original image if extraction failed
-
-else:
-    # Draw boxes and text onto the image
-    # Pass separated 'boxes', 'txts', 'scores' lists to draw_ocr
-    if boxes and txts and scores: # Check if all components were extracted
-         image_with_boxes = draw_ocr(img, boxes, txts=txts, scores=scores, font_path=font_path)
+        dt_boxes, rec_res = text_results
+    page_lines = OCRLines.from_text_system(dt_boxes, rec_res)
+    quads = page_lines.boxes
+
+    # 7. 版面分析；未启用版面分析时整页按表格处理（与 PPStructure 一致）；命中版面模板时直接复用模板
+    if template_regions is not None:
+        layout_res = [{'bbox': bbox, 'label': label, 'structure_res': structure_res}
+                      for label, bbox, structure_res in template_regions]
+    elif engine.layout_predictor is not None:
+        layout_res, _ = engine.layout_predictor(img)
     else:
-        print("Error: Could not draw visualization as boxes, texts, or scores were not extracted successfully.")
-        image_with_boxes = img.copy() # Use original image if extraction failed
-
-# Save the visualized image
-output_image_path = './result_visualization.jpg'
-cv2.imwrite(output_image_path, image_with_boxes)
-print(f"\nVisualization saved to: {output_image_path}")
-
-# Display the image
-if IS_DISPLAY_DEBUG:
-    cv2.imshow('OCR Result Visualization', image_with_boxes)
-    print("Press any key in the image window to close it.")
-    cv2.waitKey(0)  # Wait indefinitely until a key is pressed
-    cv2.destroyAllWindows() # Close the image window
-
-# -------------------------------------
-
-# 5. 打印识别结果
-all_detected_lines = get_ocr_lines(results)
-
-if not all_detected_lines:
-    print("\nNo text detected or results format not recognized after processing.")
-else:
-    print(f"\nProcessed {len(all_detected_lines)} lines of text:")
-    for i, line_data in enumerate(all_detected_lines):
-        # Defensive check for the expected structure of a line_data item
-        if isinstance(line_data, list) and len(line_data) == 2:
-            bbox, text_score_pair = line_data
-            if isinstance(text_score_pair, tuple) and len(text_score_pair) == 2:
-                text, score = text_score_pair
-                print(f"Line {i+1}: {text}    # Confidence: {score:.3f}")
-                # You might also want to print or use the bounding box (bbox) here if needed.
-                # print(f"  Bounding Box: {bbox}")
+        layout_res = [{'bbox': None, 'label': 'table'}]
+
+    structure_results = []
+    learned_regions = []
+    for region in layout_res:
+        if region['bbox'] is not None:
+            x1, y1, x2, y2 = [int(v) for v in region['bbox']]
+        else:
+            x1, y1, x2, y2 = 0, 0, image_width, image_height
+        roi_img = img[y1:y2, x1:x2, :]
+        learned = {'label': region['label'], 'bbox': [x1, y1, x2, y2], 'structure': None}
+        # Text lines belong to the region that contains their center
+        inside = page_lines.in_region(x1, y1, x2, y2)
+
+        if region['label'] == 'table':
+            if table_system is None:
+                res = ''
             else:
-                print(f"Warning: Malformed text_score_pair in line_data item {i+1}: {text_score_pair}")
+                structure_res = region.get('structure_res')
+                if structure_res is None:
+                    structure_res, _ = table_system._structure(copy.deepcopy(roi_img))
+                    learned['structure'] = {'tokens': list(structure_res[0]),
+                                            'cells': np.asarray(structure_res[1]).tolist()}
+                table_boxes = _table_match_boxes(quads[inside], x1, y1, x2 - x1, y2 - y1)
+                table_rec_res = [(page_lines.texts[i], float(page_lines.scores[i])) for i in inside]
+                res = {'cell_bbox': structure_res[1].tolist(),
+                       'html': table_system.match(structure_res, table_boxes, table_rec_res)}
+        else:
+            res = page_lines.select(inside).to_records()
+
+        structure_results.append({'type': region['label'].lower(), 'bbox': [x1, y1, x2, y2],
+                                  'img': roi_img, 'res': res, 'img_idx': 0})
+        learned_regions.append(learned)
+
+    if templates is not None and template_regions is None:
+        templates.add(fingerprint, img.shape, learned_regions)
+
+    return page_lines.filter_scores(OCR_DROP_SCORE), structure_results
+
+def _restore_cached_page(cached, img):
+    """Rebuilds (lines, structure_results) from a cache entry, re-attaching the region crops."""
+    if "lines" in cached:
+        lines = OCRLines.from_dict(cached["lines"])
+    else:
+        lines = OCRLines.from_paddle(cached["ocr"]) # Entry written before OCRLines
+    structure_results = []
+    for region in cached["structure"]:
+        x1, y1, x2, y2 = region["bbox"]
+        structure_results.append(dict(region, img=img[y1:y2, x1:x2, :]))
+    return lines, structure_results
+
+def apply_det_profile(det_profile, ocr, engine, img):
+    """Sets the detection profile's settings for img's size on every text system that runs on the page."""
+    if ocr is not None:
+        det_profile.apply(ocr, img)
+    if engine is not None:
+        det_profile.apply(engine.text_system, img)
+
+def _report_rotation(rotation):
+    if rotation == 180:
+        print("Page orientation: upside down, rotated by 180 degrees")
+        tracer.count("pages_rotated")
+    elif rotation is None:
+        print("Page orientation: sampled lines disagree, classifying every line")
+        tracer.count("orientation_fallbacks")
+
+def process_image(image_path, ocr, engine, save_folder="./output", name="mytable",
+                  visualization_path='./result_visualization.jpg', cache=None, orientation="line", visualizer=None,
+                  det_profile=None, templates=None):
+    """
+    Runs basic OCR and PP-Structure on one image. When ocr is None the shared pipeline is used
+    and engine must be created with create_structure_engine(shared_ocr=True); when engine is None
+    only the basic OCR runs and no structure results are written.
+    orientation="page" classifies the text orientation once per page from a sample of lines instead of
+    for every line (see page_orientation); upside-down pages are rotated before recognition.
+    With an OCRCache, pages whose pixels were already processed with the same models are not re-run.
+    visualizer, an optional VisualizationWriter, writes the page's text boxes to visualization_path.
+    det_profile, a det_autotune.DetProfile, sets the detection size and thresholds for the page's size.
+    templates, a layout_templates.LayoutTemplateStore, reuses the layout of known forms (shared pipeline only).
+    Returns a small summary dict (image path, number of text lines and structure regions).
+    Errors are reported in the summary instead of raised, so one bad scan does not stop a batch.
+    """
+    with tracer.page(image_path):
+        return _process_image(image_path, ocr, engine, save_folder, name, visualization_path, cache, orientation,
+                              visualizer, det_profile, templates)
+
+def _process_image(image_path, ocr, engine, save_folder, name, visualization_path, cache, orientation, visualizer,
+                   det_profile, templates):
+    import cv2
+    # 3. 读取图片（也可以传入 numpy 数组）
+    with tracer.span("decode"):
+        img = cv2.imread(image_path)
+    if img is None:
+        print(f"Error: Could not read image {image_path}")
+        return {"image": image_path, "lines": 0, "regions": 0, "error": "unreadable image"}
+
+    os.makedirs(save_folder, exist_ok=True)
+    try:
+        cache_key = None
+        cached = None
+        rotation = 0
+        if cache is not None:
+            key_params = ["page" if engine is not None else "text", ocr is None, OCR_DROP_SCORE]
+            if orientation != "line":
+                key_params.append(orientation)
+            if det_profile is not None:
+                key_params.append(sorted((det_profile.settings_for(img.shape) or {}).items()))
+            if templates is not None:
+                key_params.append("templates")
+            cache_key = cache.make_key(img, *key_params)
+            cached = cache.get(cache_key)
+
+        if cached is None and det_profile is not None:
+            apply_det_profile(det_profile, ocr, engine, img)
+        if cached is not None:
+            rotation = cached.get("rotation", 0)
+            if rotation == 180:
+                img = rotate_180(img)
+            lines, structure_results = _restore_cached_page(cached, img)
+        elif orientation == "page":
+            # 4. 整页只做一次方向判断（抽样文本行），倒置的页面整体旋转后再识别
+            img, dt_boxes, rec_res, rotation = orient_page_text(ocr if ocr is not None else engine.text_system, img)
+            _report_rotation(rotation)
+            if ocr is None:
+                lines, structure_results = run_shared_pipeline(engine, img, (dt_boxes, rec_res), templates)
+            else:
+                lines = OCRLines.from_text_system(dt_boxes, rec_res)
+                structure_results = engine(img) if engine is not None else []
+        elif ocr is None:
+            # One decode, one det/rec pass shared by the OCR and structure outputs
+            lines, structure_results = run_shared_pipeline(engine, img, templates=templates)
+        else:
+            # 4. 执行 OCR
+            lines = OCRLines.from_paddle(ocr.ocr(img, cls=True))
+            # 7. 预测
+            structure_results = engine(img) if engine is not None else [] # 返回一个 dict 列表，包含 Text/Table/Title 等多种 type
+
+        with tracer.span("report"):
+            report_ocr_results(lines, img, visualization_path, visualizer)
+        regions = []
+        if engine is not None:
+            with tracer.span("write"):
+                regions = save_structure_results(structure_results, save_folder, name)
+        if cache_key is not None and cached is None:
+            cache.put(cache_key, {"lines": lines.to_dict(), "structure": regions, "rotation": rotation})
+    except Exception as e:
+        print(f"Error processing {image_path}: {e}")
+        return {"image": image_path, "lines": 0, "regions": 0, "error": str(e)}
+    summary = {"image": image_path, "lines": len(lines), "regions": len(regions)}
+    if templates is not None and cached is None:
+        summary["layout"] = templates.last_status
+    return summary
+
+def build_tasks(entries, output_dir):
+    """
+    Turns (image_path, relative_path) pairs into process_image tasks whose outputs mirror the
+    input tree under output_dir: <output_dir>/<relative dir>/<stem>.{xlsx,txt,json}. Inputs whose
+    outputs would collide are renamed by ocr_workers.output_names.
+    """
+    tasks = []
+    names = ocr_workers.output_names([relative_path for _, relative_path in entries])
+    for (image_path, relative_path), name in zip(entries, names):
+        save_folder = os.path.join(output_dir, os.path.dirname(relative_path))
+        tasks.append((image_path, save_folder, name, os.path.join(save_folder, f"{name}_visualization.jpg")))
+    return tasks
+
+def load_progress(path):
+    """Returns {image_path: summary} for the images a previous run finished; failed images are not included."""
+    finished = {}
+    if not os.path.exists(path):
+        return finished
+    try:
+        for summary in read_rows(path):
+            if "error" not in summary:
+                finished[summary["image"]] = summary
+    except ValueError:
+        pass # Line cut off by an interrupted run
+    return finished
+
+def main():
+    parser = argparse.ArgumentParser(description="OCR and PP-Structure table recognition for images.")
+    parser.add_argument("inputs", type=str, nargs="*",
+                        help="Image files, directories (searched recursively) or glob patterns (quote them, e.g. 'scans/**/*.jpg').")
+    parser.add_argument("--file_list", type=str, default=None, help="Text file with one image path per line.")
+    parser.add_argument("--output_dir", type=str, default="./output", help="Folder for the structure results (default: ./output).")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes for batch inputs, one page per task (default: 1).")
+    parser.add_argument("--threads_per_worker", type=int, default=None,
+                        help="CPU threads per worker (default: CPU count divided by --workers).")
+    parser.add_argument("--separate_engines", action="store_true",
+                        help="Run PaddleOCR and PP-Structure as two independent engines (each with its own det/rec pass) "
+                             "instead of sharing one pass.")
+    parser.add_argument("--text_only", action="store_true",
+                        help="Only detect and recognize text (no layout or table analysis); PP-Structure is not loaded.")
+    parser.add_argument("--warmup", action="store_true",
+                        help="Load the models before the first page and run a tiny dummy inference through them "
+                             "(default: models load when the first page needs them).")
+    parser.add_argument("--orientation", choices=ORIENTATION_STRATEGIES, default="line",
+                        help="line: run the angle classifier on every text line; page: classify a sample of lines "
+                             "once per page, rotate upside-down pages and skip the per-line classifier, falling back "
+                             "to it when the sample disagrees (default: line).")
+    parser.add_argument("--visualize", choices=VISUALIZE_MODES, default="none",
+                        help="Write <name>_visualization.jpg (result_visualization.jpg for a single image) with the "
+                             "text boxes: fast draws all boxes at once and reuses rendered glyphs, paddle uses "
+                             "PaddleOCR's draw_ocr; written on a background thread (default: none).")
+    parser.add_argument("--preview_scale", type=float, default=1.0,
+                        help="Scale factor of the visualization images, e.g. 0.5 for a half-size preview (default: 1.0).")
+    parser.add_argument("--det_profile", type=str, default=None,
+                        help="Detection profile written by det_autotune.py; each page is detected with the settings "
+                             "tuned for its size (default: engine defaults).")
+    parser.add_argument("--layout_templates", type=str, default=None,
+                        help="SQLite file of known page layouts; pages matching a known form reuse its layout regions "
+                             "and table structure and only recognize the text of its cells (default: off).")
+    parser.add_argument("--template_threshold", type=float, default=MATCH_THRESHOLD,
+                        help=f"Smallest layout fingerprint correlation accepted as a known form (default: {MATCH_THRESHOLD}).")
+    parser.add_argument("--cache", type=str, default=None,
+                        help="SQLite file for the page result cache; re-runs of the same scans skip the models (default: off).")
+    parser.add_argument("--resume", action="store_true",
+                        help=f"Skip images an interrupted run already finished, as recorded in <output_dir>/{PROGRESS_LOG}.")
+    parser.add_argument("--cache_memory_items", type=int, default=1000, help="Pages kept in the in-memory cache tier (default: 1000).")
+    parser.add_argument("--cache_max_mb", type=int, default=512, help="Size limit of the on-disk cache in MB (default: 512).")
+    parser.add_argument("--trace_dir", type=str, default=None,
+                        help="Record per-stage timings and counters and write trace.json, trace_chrome.json and "
+                             "metrics.prom (Prometheus textfile) to this folder (default: off).")
+    parser.add_argument("--profile_slowest", type=int, default=0,
+                        help="With --trace_dir, sample the call stacks of every page and keep the N slowest "
+                             "as profiles/*.folded flame graph input (default: 0, off).")
+    args = parser.parse_args()
+
+    if not args.inputs and not args.file_list:
+        parser.error("at least one image, directory, glob pattern or --file_list is required")
+    if args.layout_templates and (args.text_only or args.separate_engines):
+        parser.error("--layout_templates needs the shared pipeline (no --text_only or --separate_engines)")
+
+    if len(args.inputs) == 1 and not args.file_list and os.path.isfile(args.inputs[0]):
+        # Single image: keep the original output names
+        tasks = [(args.inputs[0], args.output_dir, "mytable", './result_visualization.jpg')]
+    else:
+        entries = collect_image_inputs(args.inputs, args.file_list)
+        if not entries:
+            print("Error: No images found for the given inputs.")
+            sys.exit(1)
+        tasks = build_tasks(entries, args.output_dir)
+        print(f"Found {len(tasks)} images.")
+
+    # Every finished image is appended to the progress log as soon as its outputs are written
+    progress_path = os.path.join(args.output_dir, PROGRESS_LOG)
+    finished = load_progress(progress_path) if args.resume else {}
+    progress = RowWriter(progress_path, checkpoint_every=1)
+    for summary in finished.values():
+        progress.write_row(summary)
+    if finished:
+        tasks = [task for task in tasks if task[0] not in finished]
+        print(f"Resuming: {len(finished)} images already finished, {len(tasks)} left.")
+
+    cache_args = None
+    if args.cache:
+        cache_args = (args.cache, CACHE_MODEL_DIRS, "page", args.cache_memory_items, args.cache_max_mb)
+
+    templates_args = None
+    if args.layout_templates:
+        templates_args = (args.layout_templates, TEMPLATE_MODEL_DIRS, args.template_threshold)
+
+    if args.trace_dir:
+        tracer.enable(args.profile_slowest)
+
+    visualize = (args.visualize, args.preview_scale) if args.visualize != "none" else None
+
+    det_profile = None
+    if args.det_profile:
+        try:
+            det_profile = load_det_profile(args.det_profile)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error: Could not load the detection profile {args.det_profile}: {e}")
+            sys.exit(1)
+
+    start_time = time.perf_counter()
+    summaries = []
+    if args.workers > 1 and len(tasks) > 1:
+        for summary in ocr_workers.iter_documents_parallel(tasks, args.workers, args.threads_per_worker,
+                                                           shared=not args.separate_engines, cache_args=cache_args,
+                                                           text_only=args.text_only, orientation=args.orientation,
+                                                           visualize=visualize, det_profile_path=args.det_profile,
+                                                           templates_args=templates_args):
+            progress.write_row(summary)
+            summaries.append(summary)
+        load_seconds = None
+    else:
+        # Engines are built once, on first use, and reused for every image
+        if args.text_only:
+            ocr = LazyEngine(create_ocr_engine)
+            engine = None
+        elif args.separate_engines:
+            ocr = LazyEngine(create_ocr_engine)
+            engine = LazyEngine(create_structure_engine)
         else:
-            print(f"Warning: Malformed line_data item {i+1}: {line_data}")
-
-# 6. 初始化 PP-Structure 引擎
-engine = PPStructure(
-    det_model_dir=DET_MODEL_DIR,
-    rec_model_dir=REC_MODEL_DIR,
-    table_model_dir=TABLE_MODEL_DIR,
-    #rec_char_dict_path=REC_CHAR_DICT_PATH,
-    #table_char_dict_path=TABLE_CHAR_DICT_PATH,
-    lang="ch"   # 中文环境
-)
-
-# 7. 读取图片并预测
-img = cv2.imread(image_path)
-results = engine(img)  # 返回一个 dict 列表，包含 Text/Table/Title 等多种 type
-
-# 8. 导出结果
-# 调用 save_structure_res，仅用三个必选参数
-save_folder = "./output"
-os.makedirs(save_folder, exist_ok=True)
-save_structure_res(results, save_folder, "mytable")  
-
-# 这样会在 ./output 下产出：
-#   mytable.xlsx  —— 表格形式
-#   mytable.txt   —— 每行 JSON 格式的识别结果
-
-# 2) 如果你只想要一个纯 JSON 文件，可以这样做：
-#    （同时过滤掉 'img' 字段，否则无法序列化）
-cleaned = []
-for region in results:
-    entry = {k:v for k,v in region.items() if k != "img"}
-    cleaned.append(entry)
-with open(os.path.join(save_folder, "mytable.json"), "w", encoding="utf-8") as f:
-    json.dump(cleaned, f, ensure_ascii=False, indent=2)
-
-print("Done.")
\ No newline at end of file
+            ocr = None
+            engine = LazyEngine(create_structure_engine, shared_ocr=True)
+        load_seconds = None
+        if args.warmup:
+            ocr = ocr.load() if ocr is not None else None
+            engine = engine.load() if engine is not None else None
+            warmup_engines(ocr, engine)
+            load_seconds = time.perf_counter() - start_time
+        cache = OCRCache(*cache_args) if cache_args else None
+        templates = LayoutTemplateStore(*templates_args) if templates_args else None
+        visualizer = VisualizationWriter(Visualizer(*visualize, font_path=font_path)) if visualize else None
+        for image_path, save_folder, name, visualization_path in tasks:
+            summaries.append(process_image(image_path, ocr, engine, save_folder, name, visualization_path, cache,
+                                           args.orientation, visualizer, det_profile, templates))
+            progress.write_row(summaries[-1])
+            if len(summaries) == 1:
+                print(f"Time to first result: {time.perf_counter() - SCRIPT_START:.2f}s after start")
+        if visualizer is not None:
+            visualizer.close()
+        if cache is not None:
+            cache.report()
+            cache.close()
+        if templates is not None:
+            templates.close()
+    total_seconds = time.perf_counter() - start_time
+    progress.close()
+
+    if len(summaries) + len(finished) > 1:
+        print("\nSummary:")
+        for summary in list(finished.values()) + summaries:
+            if "error" in summary:
+                print(f"  {summary['image']}: FAILED ({summary['error']})")
+            else:
+                print(f"  {summary['image']}: {summary['lines']} text lines, {summary['regions']} regions")
+
+        failed = sum(1 for summary in summaries if "error" in summary)
+        inference_seconds = total_seconds - (load_seconds or 0.0)
+        print(f"\nProcessed {len(summaries)} images ({failed} failed) in {total_seconds:.1f}s: "
+              f"{len(summaries) / max(total_seconds, 1e-9):.2f} images/sec overall")
+        if load_seconds is not None:
+            print(f"Model load: {load_seconds:.1f}s, inference: {inference_seconds:.1f}s "
+                  f"({len(summaries) / max(inference_seconds, 1e-9):.2f} images/sec excluding load)")
+
+    if templates_args:
+        report_template_statuses([summary.get("layout") for summary in summaries])
+
+    if args.trace_dir:
+        tracer.report()
+        tracer.write_all(args.trace_dir)
+
+    print("Done.")
+
+if __name__ == "__main__":
+    main()
@@ -2,18 +2,25 @@ import warnings
 import logging
 import sys
 import os
-import cv2
 import json
 import argparse
-import csv
 from PIL import Image
 import numpy as np
 
+import ocr_workers
+from det_autotune import load_det_profile
+from ocr_cache import OCRCache
+from ocr_trace import tracer, instrument_text_system
+from grid_detect import detect_grid
+from page_orientation import ORIENTATION_STRATEGIES, estimate_rotation, rotate_180, rotate_edges_180, sample_evenly
+from ocr_workers import list_image_files
+from ocr_writers import OUTPUT_FORMATS, is_complete, open_row_writer
+
 # Suppress the specific UserWarning from PaddlePaddle about ccache
 warnings.filterwarnings("ignore", category=UserWarning, module='paddle.utils.cpp_extension.extension_utils')
 
-from paddleocr import PaddleOCR, draw_ocr
-
+# paddleocr (which imports paddle) is imported when the engine is created, so --help and argument
+# errors do not wait for paddle to load.
 # Set ppocr logger level to INFO to suppress DEBUG messages
 logging.getLogger('ppocr').setLevel(logging.INFO)
 
@@ -22,110 +29,537 @@ DET_MODEL_DIR = "./ch_PP-OCRv3_det_infer"   # 检测模型
 CLS_MODEL_DIR = "./ch_ppocr_mobile_v2.0_cls_infer"  # 方向分类模型
 REC_MODEL_DIR = "./ch_PP-OCRv3_rec_infer"  # 识别模型
 
+# Rows recognized per block by the batched (--rec_only) path; bounds the cell crops held in memory
+ROWS_PER_BLOCK = 128
+
 # Initialize PaddleOCR
 ocr_engine = None
+# Optional OCR result cache (see initialize_cache)
+ocr_cache = None
+# Optional detection profile from det_autotune.py (see initialize_ocr)
+ocr_det_profile = None
+# Language of the engine; part of the cache keys, as it selects the recognizer's character dictionary
+ocr_lang = 'ch'
 
-def initialize_ocr(det_model_dir, cls_model_dir, rec_model_dir, use_angle_cls=True, lang='ch'):
-    """Initializes and returns the PaddleOCR engine."""
-    global ocr_engine
+def initialize_ocr(det_model_dir, cls_model_dir, rec_model_dir, use_angle_cls=True, lang='ch', det_profile=None,
+                   cpu_threads=10):
+    """
+    Initializes and returns the PaddleOCR engine. det_profile is the path of a profile written by
+    det_autotune.py; its settings are applied per cell crop, by the crop's size.
+    """
+    global ocr_engine, ocr_det_profile, ocr_lang
+    from paddleocr import PaddleOCR
     ocr_engine = PaddleOCR(use_angle_cls=use_angle_cls,
                          lang=lang,
                          det_model_dir=det_model_dir,
                          cls_model_dir=cls_model_dir,
                          rec_model_dir=rec_model_dir,
+                         cpu_threads=cpu_threads,
                          show_log=False, # Suppress detailed OCR logs for cleaner output
                          use_gpu=False) # Set to True if GPU is available and desired
+    instrument_text_system(ocr_engine) # Per-stage timings when tracing is enabled (--trace_dir)
+    ocr_det_profile = load_det_profile(det_profile) if det_profile else None
+    ocr_lang = lang
     print("PaddleOCR engine initialized.")
 
-def process_image_fixed_grid(image_path, output_csv_path, row_height, col_widths):
-    """
-    Processes an image with a fixed grid, performs OCR on each cell, and saves to CSV.
-    """
-    global ocr_engine
-    if ocr_engine is None:
-        print("Error: OCR engine not initialized. Call initialize_ocr first.")
-        return
+def initialize_cache(db_path, model_dirs, max_memory_items=20000, max_disk_mb=512):
+    """Enables the cell result cache, stored in the SQLite file db_path and tied to the given model directories."""
+    global ocr_cache
+    ocr_cache = OCRCache(db_path, model_dirs, namespace="fixed_grid",
+                         max_memory_items=max_memory_items, max_disk_mb=max_disk_mb)
+    print(f"OCR cache enabled: {db_path}")
 
+def load_image_np(image_path):
+    """Loads an image as an RGB numpy array. Returns None if the image cannot be read."""
     try:
         img = Image.open(image_path).convert('RGB') # Ensure image is in RGB
-        img_np = np.array(img) # PaddleOCR prefers numpy array
-        image_height_pil, image_width_pil = img.height, img.width # PIL uses (width, height) from size, np uses (height, width)
-
+        return np.array(img) # PaddleOCR prefers numpy array
     except FileNotFoundError:
         print(f"Error: Input image not found at {image_path}")
-        return
     except Exception as e:
         print(f"Error loading image: {e}")
-        return
+    return None
+
+def fixed_grid_edges(image_width, image_height, row_height, col_widths):
+    """
+    Returns (row_edges, col_edges, truncated) for a fixed grid: the boundaries of the rows and columns
+    that fit in the image, and whether a further column runs past the right edge of the image.
+    """
+    row_edges = list(range(0, (image_height // row_height) * row_height + 1, row_height))
+    col_edges = [0]
+    for col_width in col_widths:
+        if col_edges[-1] + col_width > image_width:
+            return row_edges, col_edges, True
+        col_edges.append(col_edges[-1] + col_width)
+    return row_edges, col_edges, False
+
+def resolve_grid(img_np, row_height, col_widths, grid_edges=None):
+    """
+    Returns (row_edges, col_edges, truncated) for an image: the detected (row_edges, col_edges)
+    when grid_edges is given, otherwise the fixed grid described by row_height and col_widths.
+    """
+    if grid_edges is not None:
+        row_edges, col_edges = grid_edges
+        return list(row_edges), list(col_edges), False
+    image_height, image_width = img_np.shape[:2]
+    return fixed_grid_edges(image_width, image_height, row_height, col_widths)
+
+def grid_cells_from_edges(row_edges, col_edges, truncated=False):
+    """
+    Computes the cell rectangles between consecutive row and column edges.
+    Returns a list of rows, each a list of (x, y, w, h) tuples. With truncated=True each row ends with
+    None, marking a column that runs past the right edge of the image; the remaining columns of that
+    row are not processed.
+    """
+    rows = []
+    for y0, y1 in zip(row_edges[:-1], row_edges[1:]):
+        row_cells = [(x0, y0, x1 - x0, y1 - y0) for x0, x1 in zip(col_edges[:-1], col_edges[1:])]
+        if truncated:
+            row_cells.append(None)
+        rows.append(row_cells)
+    return rows
+
+def _interior_mask(edges, margin):
+    """
+    Boolean mask over [edges[0], edges[-1]) that is False within margin pixels of every edge. The
+    margin is clamped per segment, so a narrow segment keeps at least its middle pixel.
+    """
+    sizes = np.diff(edges)
+    margins = np.repeat(np.clip((sizes - 1) // 2, 0, max(0, margin)), sizes)
+    offsets = np.arange(edges[0], edges[-1]) - np.repeat(edges[:-1], sizes)
+    return (offsets >= margins) & (offsets < np.repeat(sizes, sizes) - margins)
 
-    table_data = []
-    current_y = 0
-    row_idx = 0
+def compute_cell_ink_stats(img_np, row_edges, col_edges, dark_level=160, margin=3):
+    """
+    Computes per-cell ink statistics for the whole grid in one vectorized pass.
+
+    Pixel values are summed per grid column with np.add.reduceat over the column edges and then per
+    grid row over the row edges, so no per-cell crops are made. A margin of pixels at each cell border
+    is ignored so ruling lines do not count as ink (less in cells too small for it, see _interior_mask).
+    Edges must be strictly increasing.
+    Returns (dark_fraction, std) arrays of shape (n_rows, n_cols).
+    """
+    row_edges = np.asarray(row_edges, dtype=np.int64)
+    col_edges = np.asarray(col_edges, dtype=np.int64)
+    n_rows, n_cols = len(row_edges) - 1, len(col_edges) - 1
+    if n_rows <= 0 or n_cols <= 0:
+        empty = np.zeros((max(n_rows, 0), max(n_cols, 0)), dtype=np.float32)
+        return empty, empty
+    region = img_np[row_edges[0]:row_edges[-1], col_edges[0]:col_edges[-1]]
+    gray = region.mean(axis=2, dtype=np.float32) if region.ndim == 3 else region.astype(np.float32)
+    row_mask = _interior_mask(row_edges, margin)
+    col_mask = _interior_mask(col_edges, margin)
+    row_starts = row_edges[:-1] - row_edges[0]
+    col_starts = col_edges[:-1] - col_edges[0]
+
+    def cell_sums(values):
+        per_col = np.add.reduceat(values * col_mask, col_starts, axis=1, dtype=np.float64)
+        return np.add.reduceat(per_col * row_mask[:, None], row_starts, axis=0)
+
+    dark_counts = cell_sums((gray < dark_level).astype(np.float32))
+    sums = cell_sums(gray)
+    square_sums = cell_sums(np.square(gray))
+    pixel_counts = np.maximum(np.outer(np.add.reduceat(row_mask.astype(np.int64), row_starts),
+                                       np.add.reduceat(col_mask.astype(np.int64), col_starts)), 1)
+
+    dark_fraction = (dark_counts / pixel_counts).astype(np.float32)
+    mean = sums / pixel_counts
+    std = np.sqrt(np.maximum(square_sums / pixel_counts - np.square(mean), 0)).astype(np.float32)
+    return dark_fraction, std
+
+def find_blank_cells(img_np, row_edges, col_edges, ink_fraction=0.005, min_std=8.0, dark_level=160, margin=3):
+    """
+    Returns a boolean (n_rows, n_cols) mask of cells that are too empty to hold text:
+    fewer than ink_fraction dark pixels, or almost uniform (standard deviation below min_std).
+    """
+    dark_fraction, std = compute_cell_ink_stats(img_np, row_edges, col_edges, dark_level, margin)
+    return (dark_fraction < ink_fraction) | (std < min_std)
+
+def _report_blank_cells(blank):
+    skipped = int(blank.sum())
+    tracer.count("blank_cells", skipped)
+    print(f"Prefilter: {skipped} of {blank.size} cells blank, skipped OCR for {skipped / max(blank.size, 1):.0%} of cells")
+
+def orient_grid_page(img_np, row_height, col_widths, grid_edges=None, per_cell_cls=True, allow_rotation=True,
+                     min_ink=0.02):
+    """
+    Page-level orientation for a grid: the angle classifier runs once on an evenly spaced sample of
+    the cells with ink (at least min_ink dark pixels) instead of on every cell. An upright page skips
+    the per-cell classifier; an upside-down page is rotated by 180 degrees together with its grid and
+    skips it as well. When the sample disagrees, or rotation is not allowed (a row band of a larger
+    image), per_cell_cls is kept.
+    Returns (img_np, row_edges, col_edges, truncated, per_cell_cls).
+    """
+    global ocr_engine
+    row_edges, col_edges, truncated = resolve_grid(img_np, row_height, col_widths, grid_edges)
+    if len(row_edges) < 2 or len(col_edges) < 2:
+        return img_np, row_edges, col_edges, truncated, per_cell_cls
+    dark_fraction, _ = compute_cell_ink_stats(img_np, row_edges, col_edges)
+    cells = sample_evenly(np.argwhere(dark_fraction >= min_ink))
+    crops = [img_np[row_edges[r] : row_edges[r + 1], col_edges[c] : col_edges[c + 1]] for r, c in cells]
+    with tracer.span("orientation"):
+        rotation, agreement = estimate_rotation(getattr(ocr_engine, 'text_classifier', None), crops)
 
-    print(f"Processing image: {image_path} (Dimensions: {image_width_pil}x{image_height_pil})")
-    print(f"Row height: {row_height}, Column widths: {col_widths}")
+    if rotation == 0:
+        return img_np, row_edges, col_edges, truncated, False
+    if rotation == 180 and allow_rotation:
+        print(f"Page orientation: upside down ({agreement:.0%} of {len(crops)} sampled cells), rotated by 180 degrees")
+        tracer.count("pages_rotated")
+        if grid_edges is not None:
+            image_height, image_width = img_np.shape[:2]
+            grid_edges = (rotate_edges_180(row_edges, image_height), rotate_edges_180(col_edges, image_width))
+        img_np = rotate_180(img_np)
+        row_edges, col_edges, truncated = resolve_grid(img_np, row_height, col_widths, grid_edges)
+        return img_np, row_edges, col_edges, truncated, False
+    if rotation == 180:
+        print("Page orientation: upside-down row band, classifying every cell")
+    else:
+        print("Page orientation: undecided from the sampled cells, classifying every cell")
+    tracer.count("orientation_fallbacks")
+    return img_np, row_edges, col_edges, truncated, per_cell_cls
 
-    while current_y + row_height <= image_height_pil:
+def grid_job_meta(image_path, row_height, col_widths, **grid_options):
+    """Describes a grid job for the output checkpoint, so --resume only continues the same job."""
+    stat = os.stat(image_path)
+    return {"image": os.path.abspath(image_path), "size": stat.st_size, "mtime": stat.st_mtime,
+            "row_height": row_height, "col_widths": list(col_widths),
+            "options": json.dumps(grid_options, sort_keys=True, default=str)}
+
+def write_table_rows(rows, output_path, resume=False, meta=None):
+    """
+    Streams table rows into a checkpointed CSV/JSONL/XLSX writer (see ocr_writers). rows is called
+    with the number of rows already written (non-zero when resuming) and returns an iterable of the
+    remaining rows. Returns the total number of rows, or None if the output was already complete.
+    """
+    with open_row_writer(output_path, resume, meta) as writer:
+        if writer.complete:
+            print(f"Skipping {output_path}: already complete.")
+            return None
+        for row in rows(writer.rows_done):
+            with tracer.span("write"):
+                writer.write_row(row)
+    print(f"Saved {writer.rows_done} rows to {output_path}")
+    return writer.rows_done
+
+def iter_grid_rows(img_np, row_height, col_widths, prefilter=None, grid_edges=None, orientation="line",
+                   allow_rotation=True, start_row=0):
+    """
+    Runs full OCR (detection + classification + recognition) on each cell of a grid.
+    The grid is fixed (row_height, col_widths) unless grid_edges = (row_edges, col_edges) is given.
+    prefilter, if given, holds keyword arguments for find_blank_cells; blank cells are left empty
+    without calling the model. orientation="page" replaces the per-cell angle classification with
+    one estimate for the page (see orient_grid_page).
+    Yields the rows of cell texts in order, as they are recognized; rows before start_row (already
+    written by an interrupted run) are skipped without OCR.
+    """
+    global ocr_engine, ocr_cache
+    if orientation == "page":
+        img_np, row_edges, col_edges, truncated, use_cls = orient_grid_page(img_np, row_height, col_widths, grid_edges,
+                                                                            True, allow_rotation)
+    else:
+        row_edges, col_edges, truncated = resolve_grid(img_np, row_height, col_widths, grid_edges)
+        use_cls = True
+    blank = None
+    if prefilter is not None:
+        with tracer.span("prefilter"):
+            blank = find_blank_cells(img_np, row_edges, col_edges, **prefilter)
+        _report_blank_cells(blank)
+
+    for row_idx, row_cells in enumerate(grid_cells_from_edges(row_edges, col_edges, truncated)):
+        if row_idx < start_row:
+            continue
         row_data = []
-        current_x = 0
-        col_idx = 0
-        for col_width in col_widths:
-            if current_x + col_width <= image_width_pil:
-                # Define the crop box for PIL [left, upper, right, lower]
-                # For numpy slicing it's [y1:y2, x1:x2]
-                cell_np = img_np[current_y : current_y + row_height, current_x : current_x + col_width]
-                
-                if cell_np.size == 0:
-                    print(f"Warning: Empty cell crop at R{row_idx}C{col_idx} (x:{current_x}, y:{current_y}, w:{col_width}, h:{row_height}). Skipping.")
-                    text_results = ""
-                else:
+        for col_idx, cell in enumerate(row_cells):
+            if cell is None:
+                row_data.append("<OUT_OF_BOUNDS>") # Or empty string, or skip
+                break
+            x, y, w, h = cell
+            # For numpy slicing it's [y1:y2, x1:x2]
+            cell_np = img_np[y : y + h, x : x + w]
+
+            if blank is not None and blank[row_idx, col_idx]:
+                text_results = ""
+            elif cell_np.size == 0:
+                print(f"Warning: Empty cell crop at R{row_idx}C{col_idx} (x:{x}, y:{y}, w:{w}, h:{h}). Skipping.")
+                text_results = ""
+            else:
+                cache_key = None
+                text_results = None
+                if ocr_cache is not None:
+                    key_params = ["ocr", ocr_lang, use_cls]
+                    if ocr_det_profile is not None:
+                        key_params.append(sorted((ocr_det_profile.settings_for(cell_np.shape) or {}).items()))
+                    cache_key = ocr_cache.make_key(cell_np, *key_params)
+                    text_results = ocr_cache.get(cache_key)
+                if text_results is None:
                     try:
-                        result = ocr_engine.ocr(cell_np, cls=True) # cls for orientation correction if needed
+                        if ocr_det_profile is not None:
+                            ocr_det_profile.apply(ocr_engine, cell_np)
+                        result = ocr_engine.ocr(cell_np, cls=use_cls) # cls for orientation correction if needed
                         cell_text_parts = []
                         if result and result[0]: # Check if result is not None and not empty
                             for line_info in result[0]: # Iterate over lines found in the cell
                                 cell_text_parts.append(line_info[1][0]) # Append the text part
                         text_results = " ".join(cell_text_parts) # Join multiple text parts if any
+                        if cache_key is not None:
+                            ocr_cache.put(cache_key, text_results)
                     except Exception as e:
                         print(f"Error during OCR for cell R{row_idx}C{col_idx}: {e}")
                         text_results = "<OCR_ERROR>"
-                
-                row_data.append(text_results)
-                # print(f"  Cell R{row_idx}C{col_idx} (x:{current_x}, y:{current_y}, w:{col_width}, h:{row_height}) -> '{text_results[:30]}...' ")
+
+            row_data.append(text_results)
+            # print(f"  Cell R{row_idx}C{col_idx} (x:{x}, y:{y}, w:{w}, h:{h}) -> '{text_results[:30]}...' ")
+
+        yield row_data
+        if (row_idx + 1) % 10 == 0:
+            print(f"Processed {row_idx + 1} rows...")
+
+    if ocr_cache is not None:
+        ocr_cache.flush()
+
+def ocr_grid_rows(img_np, row_height, col_widths, prefilter=None, grid_edges=None, orientation="line",
+                  allow_rotation=True):
+    """Runs iter_grid_rows over a whole grid and returns the table as a list of rows of cell texts."""
+    return list(iter_grid_rows(img_np, row_height, col_widths, prefilter, grid_edges, orientation, allow_rotation))
+
+def apply_auto_grid(img_np, auto_grid):
+    """
+    Detects the grid of an image with grid_detect.detect_grid (auto_grid holds its keyword arguments).
+    Returns (deskewed_img, grid_edges); grid_edges is None if no grid was found, in which case the
+    caller falls back to the fixed grid.
+    """
+    img_np, row_edges, col_edges, _ = detect_grid(img_np, **auto_grid)
+    if len(row_edges) < 2 or len(col_edges) < 2:
+        print("Warning: No grid found, falling back to the fixed row height and column widths.")
+        return img_np, None
+    return img_np, (row_edges, col_edges)
+
+def process_image_fixed_grid(image_path, output_csv_path, row_height, col_widths, prefilter=None, auto_grid=None,
+                             orientation="line", resume=False):
+    """
+    Processes an image with a fixed grid, performs OCR on each cell, and streams the rows to a CSV
+    (or .jsonl / .xlsx) file. With auto_grid (keyword arguments for grid_detect.detect_grid), the grid
+    is detected from the image. With resume, a complete output is skipped and an interrupted one is
+    continued from its checkpoint.
+    """
+    global ocr_engine
+    if ocr_engine is None:
+        print("Error: OCR engine not initialized. Call initialize_ocr first.")
+        return
+    if resume and is_complete(output_csv_path):
+        print(f"Skipping {image_path}: {output_csv_path} is already complete.")
+        return
+
+    with tracer.page(image_path):
+        _process_fixed_grid_page(image_path, output_csv_path, row_height, col_widths, prefilter, auto_grid, orientation,
+                                 resume)
+
+def _process_fixed_grid_page(image_path, output_csv_path, row_height, col_widths, prefilter, auto_grid, orientation,
+                             resume):
+    with tracer.span("decode"):
+        img_np = load_image_np(image_path)
+    if img_np is None:
+        return
+    image_height, image_width = img_np.shape[:2]
+
+    print(f"Processing image: {image_path} (Dimensions: {image_width}x{image_height})")
+    grid_edges = None
+    if auto_grid is not None:
+        with tracer.span("grid"):
+            img_np, grid_edges = apply_auto_grid(img_np, auto_grid)
+    if grid_edges is None:
+        print(f"Row height: {row_height}, Column widths: {col_widths}")
+
+    meta = grid_job_meta(image_path, row_height, col_widths, prefilter=prefilter, auto_grid=auto_grid,
+                         orientation=orientation)
+    total_rows = write_table_rows(
+        lambda start_row: iter_grid_rows(img_np, row_height, col_widths, prefilter, grid_edges, orientation,
+                                         start_row=start_row),
+        output_csv_path, resume, meta)
+    if total_rows is not None:
+        print(f"\nFinished processing. Total rows extracted: {total_rows}")
+
+def recognize_cells_batched(cell_images, batch_size=64, width_bucket=32, use_cls=False, drop_score=0.5):
+    """
+    Runs only the recognition model (and optionally the angle classifier) over a list of cell crops.
+
+    Detection is skipped because the grid already gives the text location. Crops are grouped by
+    their width after resizing to the recognizer's input height, so each batch pads to a similar
+    width, and each group is fed to the recognizer in chunks of batch_size.
+    Cells found in the result cache (if enabled) are not sent to the models.
+    Returns the recognized texts in the same order as cell_images.
+    """
+    global ocr_engine, ocr_cache
+    texts = [""] * len(cell_images)
+    cache_keys = None
+    if ocr_cache is not None:
+        cache_keys = [ocr_cache.make_key(cell_np, "rec", ocr_lang, use_cls, drop_score) for cell_np in cell_images]
+        pending = []
+        for idx, key in enumerate(cache_keys):
+            cached = ocr_cache.get(key)
+            if cached is None:
+                pending.append(idx)
             else:
-                # print(f"Warning: Column width {col_width} exceeds image width at x={current_x} for row {row_idx}. Stopping row.")
-                row_data.append("<OUT_OF_BOUNDS>") # Or empty string, or skip
-                break # Stop processing this row if a column goes out of bounds
-            current_x += col_width
-            col_idx += 1
-        
-        if row_data:
-            table_data.append(row_data)
-        else:
-            # This case should ideally not be hit if loop conditions are right
-            print(f"Warning: No data processed for row at y={current_y}.")
-            break
+                texts[idx] = cached
+    else:
+        pending = range(len(cell_images))
 
-        current_y += row_height
-        row_idx += 1
-        if row_idx % 10 == 0:
-            print(f"Processed {row_idx} rows...")
+    recognizer = ocr_engine.text_recognizer
+    rec_height = recognizer.rec_image_shape[1]
+    classifier = getattr(ocr_engine, 'text_classifier', None) if use_cls else None
 
-    print(f"\nFinished processing. Total rows extracted: {len(table_data)}")
+    # Bucket cells by their normalized width so padding inside a batch stays small
+    buckets = {}
+    for idx in pending:
+        h, w = cell_images[idx].shape[:2]
+        resized_w = int(np.ceil(w * rec_height / float(h)))
+        buckets.setdefault(resized_w // width_bucket, []).append(idx)
 
-    # Save to CSV
+    # Let the recognizer run each whole chunk as one batch; the engine is shared (e.g. with detection
+    # profiles and other callers), so its own batch size is restored afterwards
+    saved_batch_num = recognizer.rec_batch_num
+    recognizer.rec_batch_num = batch_size
     try:
-        with open(output_csv_path, 'w', newline='', encoding='utf-8') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerows(table_data)
-        print(f"Successfully saved CSV to {output_csv_path}")
-    except Exception as e:
-        print(f"Error saving CSV: {e}")
+        for bucket_key in sorted(buckets):
+            indices = buckets[bucket_key]
+            for start in range(0, len(indices), batch_size):
+                chunk = indices[start : start + batch_size]
+                batch = [cell_images[i] for i in chunk]
+                try:
+                    if classifier is not None:
+                        batch, _, _ = classifier(batch)
+                    rec_res, _ = recognizer(batch)
+                except Exception as e:
+                    print(f"Error during batched recognition of {len(chunk)} cells: {e}")
+                    for i in chunk:
+                        texts[i] = "<OCR_ERROR>"
+                    continue
+                for i, (text, score) in zip(chunk, rec_res):
+                    if score >= drop_score: # Same cut-off PaddleOCR applies to detected lines
+                        texts[i] = text
+                    if cache_keys is not None:
+                        ocr_cache.put(cache_keys[i], texts[i])
+    finally:
+        recognizer.rec_batch_num = saved_batch_num
+
+    if ocr_cache is not None:
+        ocr_cache.flush()
+    return texts
+
+def iter_grid_rows_batched(img_np, row_height, col_widths, batch_size=64, width_bucket=32, use_cls=False,
+                           prefilter=None, grid_edges=None, orientation="line", allow_rotation=True, start_row=0,
+                           block_rows=ROWS_PER_BLOCK):
+    """
+    Recognizes the cells of a grid without text detection.
+    The grid is fixed (row_height, col_widths) unless grid_edges = (row_edges, col_edges) is given.
+    prefilter, if given, holds keyword arguments for find_blank_cells; blank cells are left empty.
+    orientation="page" replaces the per-cell angle classification (use_cls) with one estimate for the
+    page (see orient_grid_page).
+    Cells are cut and recognized block_rows rows at a time, so only one block of crops is held in
+    memory; the rows of each block are yielded in order. Rows before start_row are skipped.
+    """
+    if orientation == "page" and use_cls:
+        img_np, row_edges, col_edges, truncated, use_cls = orient_grid_page(img_np, row_height, col_widths, grid_edges,
+                                                                            use_cls, allow_rotation)
+    else:
+        row_edges, col_edges, truncated = resolve_grid(img_np, row_height, col_widths, grid_edges)
+    grid_rows = grid_cells_from_edges(row_edges, col_edges, truncated)
+    blank = None
+    if prefilter is not None:
+        with tracer.span("prefilter"):
+            blank = find_blank_cells(img_np, row_edges, col_edges, **prefilter)
+        _report_blank_cells(blank)
+
+    print(f"Recognizing {max(0, len(grid_rows) - start_row)} rows in blocks of {block_rows}...")
+    for block_start in range(start_row, len(grid_rows), block_rows):
+        block_data = []
+        cell_images = []
+        cell_slots = [] # (row in block, col_idx) in block_data for each crop in cell_images
+        for row_idx in range(block_start, min(block_start + block_rows, len(grid_rows))):
+            row_data = []
+            for col_idx, cell in enumerate(grid_rows[row_idx]):
+                if cell is None:
+                    row_data.append("<OUT_OF_BOUNDS>")
+                    continue
+                row_data.append("")
+                if blank is not None and blank[row_idx, col_idx]:
+                    continue
+                x, y, w, h = cell
+                cell_images.append(img_np[y : y + h, x : x + w])
+                cell_slots.append((len(block_data), col_idx))
+            block_data.append(row_data)
+
+        texts = recognize_cells_batched(cell_images, batch_size, width_bucket, use_cls)
+        for (block_row, col_idx), text in zip(cell_slots, texts):
+            block_data[block_row][col_idx] = text
+        yield from block_data
+
+def ocr_grid_rows_batched(img_np, row_height, col_widths, batch_size=64, width_bucket=32, use_cls=False,
+                          prefilter=None, grid_edges=None, orientation="line", allow_rotation=True):
+    """Runs iter_grid_rows_batched over a whole grid and returns the table as a list of rows of cell texts."""
+    return list(iter_grid_rows_batched(img_np, row_height, col_widths, batch_size, width_bucket, use_cls,
+                                       prefilter, grid_edges, orientation, allow_rotation))
+
+def process_image_fixed_grid_batched(image_path, output_csv_path, row_height, col_widths,
+                                     batch_size=64, width_bucket=32, use_cls=False, prefilter=None, auto_grid=None,
+                                     orientation="line", resume=False):
+    """
+    Processes an image with a fixed grid without text detection: cells are cut a block of rows at a
+    time and recognized in large width-bucketed batches, and the rows are streamed to a CSV (or
+    .jsonl / .xlsx) file. With auto_grid (keyword arguments for grid_detect.detect_grid), the grid is
+    detected from the image. resume works as in process_image_fixed_grid.
+    """
+    global ocr_engine
+    if ocr_engine is None:
+        print("Error: OCR engine not initialized. Call initialize_ocr first.")
+        return
+    if resume and is_complete(output_csv_path):
+        print(f"Skipping {image_path}: {output_csv_path} is already complete.")
+        return
+
+    with tracer.page(image_path):
+        _process_fixed_grid_page_batched(image_path, output_csv_path, row_height, col_widths,
+                                         batch_size, width_bucket, use_cls, prefilter, auto_grid, orientation, resume)
+
+def _process_fixed_grid_page_batched(image_path, output_csv_path, row_height, col_widths,
+                                     batch_size, width_bucket, use_cls, prefilter, auto_grid, orientation, resume):
+    with tracer.span("decode"):
+        img_np = load_image_np(image_path)
+    if img_np is None:
+        return
+    image_height, image_width = img_np.shape[:2]
+
+    print(f"Processing image (recognition only): {image_path} (Dimensions: {image_width}x{image_height})")
+    grid_edges = None
+    if auto_grid is not None:
+        with tracer.span("grid"):
+            img_np, grid_edges = apply_auto_grid(img_np, auto_grid)
+    if grid_edges is None:
+        print(f"Row height: {row_height}, Column widths: {col_widths}, Batch size: {batch_size}")
+
+    meta = grid_job_meta(image_path, row_height, col_widths, batch_size=batch_size, use_cls=use_cls,
+                         prefilter=prefilter, auto_grid=auto_grid, orientation=orientation)
+    total_rows = write_table_rows(
+        lambda start_row: iter_grid_rows_batched(img_np, row_height, col_widths, batch_size, width_bucket, use_cls,
+                                                 prefilter, grid_edges, orientation, start_row=start_row),
+        output_csv_path, resume, meta)
+    if total_rows is not None:
+        print(f"\nFinished processing. Total rows extracted: {total_rows}")
+
+def parse_bool(value):
+    """argparse type for true/false flags (type=bool would turn any non-empty string, even "False", into True)."""
+    lowered = value.strip().lower()
+    if lowered in ("true", "1", "yes", "y", "on"):
+        return True
+    if lowered in ("false", "0", "no", "n", "off"):
+        return False
+    raise argparse.ArgumentTypeError(f"expected true or false, got {value!r}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="OCR fixed-grid table images and output to CSV.")
-    parser.add_argument("image_path", type=str, help="Path to the input image file.")
-    parser.add_argument("output_csv", type=str, help="Path to save the output CSV file.")
+    parser.add_argument("image_path", type=str, help="Path to the input image file, or a directory of page images.")
+    parser.add_argument("output_csv", type=str,
+                        help="Path to save the output CSV file, or .jsonl / .xlsx (an output directory when image_path is a directory).")
     parser.add_argument("--row_height", type=int, default=24, help="Fixed height of each row (default: 24).")
     parser.add_argument("--col_widths", type=str, default="81,80,82,80,82,81,81,81,82",
                         help='Comma-separated list of fixed column widths (default: "95,67,97,74,92,65,82,106,51").')
@@ -135,7 +569,54 @@ if __name__ == "__main__":
     parser.add_argument("--cls_model", type=str, default=CLS_MODEL_DIR, help="Path to classification model directory.")
     parser.add_argument("--rec_model", type=str, default=REC_MODEL_DIR, help="Path to recognition model directory.")
     parser.add_argument("--lang", type=str, default='ch', help="OCR language (default: 'ch').")
-    parser.add_argument("--use_angle_cls", type=bool, default=True, help="Use angle classification (default: True).")
+    parser.add_argument("--use_angle_cls", type=parse_bool, default=True,
+                        help="Use angle classification: true or false (default: true).")
+    parser.add_argument("--orientation", choices=ORIENTATION_STRATEGIES, default="line",
+                        help="line: run the angle classifier on every cell; page: classify a sample of cells once per page, "
+                             "rotate upside-down pages and skip the per-cell classifier, falling back to it when the "
+                             "sample disagrees (default: line).")
+    parser.add_argument("--det_profile", type=str, default=None,
+                        help="Detection profile written by det_autotune.py, applied by cell size (default: engine "
+                             "defaults; not used with --rec_only, which runs no detection).")
+    parser.add_argument("--rec_only", action="store_true",
+                        help="Skip text detection and recognize all cells in batches (faster on fixed grids).")
+    parser.add_argument("--rec_batch_size", type=int, default=64, help="Recognition batch size for --rec_only (default: 64).")
+    parser.add_argument("--width_bucket", type=int, default=32,
+                        help="Width bucket in pixels (at recognizer input height) used to group cells for --rec_only (default: 32).")
+    parser.add_argument("--auto_grid", action="store_true",
+                        help="Detect row and column boundaries (and page skew) from ruling lines or projection profiles "
+                             "instead of using --row_height / --col_widths.")
+    parser.add_argument("--max_skew", type=float, default=3.0, help="Largest page skew in degrees corrected by --auto_grid (default: 3.0).")
+    parser.add_argument("--skip_blank", action="store_true",
+                        help="Detect blank cells from ink statistics and leave them empty without calling the OCR model.")
+    parser.add_argument("--blank_ink_fraction", type=float, default=0.005,
+                        help="Cells with a smaller fraction of dark pixels are treated as blank (default: 0.005).")
+    parser.add_argument("--blank_min_std", type=float, default=8.0,
+                        help="Cells whose gray-level standard deviation is below this are treated as blank (default: 8.0).")
+    parser.add_argument("--dark_level", type=int, default=160,
+                        help="Gray level (0-255) below which a pixel counts as ink for --skip_blank (default: 160).")
+    parser.add_argument("--blank_margin", type=int, default=3,
+                        help="Pixels ignored at each cell border by --skip_blank so ruling lines do not count as ink (default: 3).")
+    parser.add_argument("--cache", type=str, default=None,
+                        help="SQLite file for the cell result cache; repeated cells and re-runs skip the model (default: off).")
+    parser.add_argument("--cache_memory_items", type=int, default=20000, help="Cells kept in the in-memory cache tier (default: 20000).")
+    parser.add_argument("--cache_max_mb", type=int, default=512, help="Size limit of the on-disk cache in MB (default: 512).")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes; pages (directory input) or row bands (single image) are spread across them (default: 1).")
+    parser.add_argument("--threads_per_worker", type=int, default=None,
+                        help="CPU threads per worker (default: CPU count divided by --workers).")
+    parser.add_argument("--output_format", choices=OUTPUT_FORMATS, default="csv",
+                        help="Format of the per-page tables when image_path is a directory (default: csv); "
+                             "a single output file takes its format from the extension (.csv, .jsonl or .xlsx).")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip pages whose output is complete and continue interrupted ones from their "
+                             "checkpoint (<output>.ckpt) instead of starting over.")
+    parser.add_argument("--trace_dir", type=str, default=None,
+                        help="Record per-stage timings and counters and write trace.json, trace_chrome.json and "
+                             "metrics.prom (Prometheus textfile) to this folder (default: off).")
+    parser.add_argument("--profile_slowest", type=int, default=0,
+                        help="With --trace_dir, sample the call stacks of every page and keep the N slowest "
+                             "as profiles/*.folded flame graph input (default: 0, off).")
 
 
     args = parser.parse_args()
@@ -148,7 +629,94 @@ if __name__ == "__main__":
         print(f"Error: Invalid format for column widths. Please use comma-separated integers. Details: {e}")
         sys.exit(1)
 
-    # Initialize OCR engine (using paths from args or defaults)
-    initialize_ocr(args.det_model, args.cls_model, args.rec_model, args.use_angle_cls, args.lang)
+    if args.det_profile:
+        try:
+            load_det_profile(args.det_profile) # Checked here, before any worker loads it
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error: Could not load the detection profile {args.det_profile}: {e}")
+            sys.exit(1)
+
+    engine_args = (args.det_model, args.cls_model, args.rec_model, args.use_angle_cls, args.lang, args.det_profile)
+    cache_args = None
+    if args.cache:
+        cache_args = (args.cache, [args.det_model, args.cls_model, args.rec_model],
+                      args.cache_memory_items, args.cache_max_mb)
+    # Keyword arguments for ocr_grid_rows / ocr_grid_rows_batched (and their process_image_* wrappers)
+    grid_options = {}
+    if args.orientation != "line":
+        grid_options["orientation"] = args.orientation
+    if args.rec_only:
+        grid_options.update(batch_size=args.rec_batch_size, width_bucket=args.width_bucket, use_cls=args.use_angle_cls)
+    if args.auto_grid:
+        grid_options["auto_grid"] = {"max_skew": args.max_skew}
+    if args.skip_blank:
+        grid_options["prefilter"] = {"ink_fraction": args.blank_ink_fraction, "min_std": args.blank_min_std,
+                                     "dark_level": args.dark_level, "margin": args.blank_margin}
+
+    if args.trace_dir:
+        tracer.enable(args.profile_slowest)
+
+    if os.path.isdir(args.image_path):
+        image_paths = list_image_files(args.image_path)
+        os.makedirs(args.output_csv, exist_ok=True)
+        csv_paths = [os.path.join(args.output_csv, name + "." + args.output_format)
+                     for name in ocr_workers.output_names(os.path.basename(p) for p in image_paths)]
+        if args.resume:
+            pending = [(p, c) for p, c in zip(image_paths, csv_paths) if not is_complete(c)]
+            print(f"Resuming: {len(image_paths) - len(pending)} of {len(image_paths)} pages already complete.")
+            image_paths, csv_paths = [p for p, _ in pending], [c for _, c in pending]
+        page_options = dict(grid_options, resume=args.resume)
+        if args.workers > 1:
+            ocr_workers.process_grid_pages_parallel(image_paths, csv_paths, args.row_height, parsed_col_widths,
+                                                    args.workers, engine_args, args.rec_only, page_options,
+                                                    args.threads_per_worker, cache_args)
+        else:
+            initialize_ocr(*engine_args)
+            if cache_args:
+                initialize_cache(*cache_args)
+            for image_path, csv_path in zip(image_paths, csv_paths):
+                if args.rec_only:
+                    process_image_fixed_grid_batched(image_path, csv_path, args.row_height, parsed_col_widths, **page_options)
+                else:
+                    process_image_fixed_grid(image_path, csv_path, args.row_height, parsed_col_widths, **page_options)
+    elif args.workers > 1:
+        if args.resume and is_complete(args.output_csv):
+            print(f"Skipping {args.image_path}: {args.output_csv} is already complete.")
+            sys.exit(0)
+        img_np = load_image_np(args.image_path)
+        if img_np is None:
+            sys.exit(1)
+        print(f"Processing image: {args.image_path} (Dimensions: {img_np.shape[1]}x{img_np.shape[0]})")
+        # The grid is detected once here; workers get row bands with their part of the edges
+        band_options = dict(grid_options)
+        auto_grid = band_options.pop("auto_grid", None)
+        grid_edges = None
+        if auto_grid is not None:
+            img_np, grid_edges = apply_auto_grid(img_np, auto_grid)
+        meta = grid_job_meta(args.image_path, args.row_height, parsed_col_widths, **grid_options)
+        total_rows = write_table_rows(
+            lambda start_row: ocr_workers.iter_grid_rows_parallel(img_np, args.row_height, parsed_col_widths,
+                                                                  args.workers, engine_args, args.rec_only,
+                                                                  band_options, args.threads_per_worker, cache_args,
+                                                                  grid_edges, start_row),
+            args.output_csv, args.resume, meta)
+        print(f"\nFinished processing. Total rows extracted: {total_rows}")
+    else:
+        # Initialize OCR engine (using paths from args or defaults)
+        initialize_ocr(*engine_args)
+        if cache_args:
+            initialize_cache(*cache_args)
+
+        if args.rec_only:
+            process_image_fixed_grid_batched(args.image_path, args.output_csv, args.row_height, parsed_col_widths,
+                                             resume=args.resume, **grid_options)
+        else:
+            process_image_fixed_grid(args.image_path, args.output_csv, args.row_height, parsed_col_widths,
+                                     resume=args.resume, **grid_options)
 
-    process_image_fixed_grid(args.image_path, args.output_csv, args.row_height, parsed_col_widths)
\ No newline at end of file
+    if ocr_cache is not None:
+        ocr_cache.report()
+        ocr_cache.close()
+    if args.trace_dir:
+        tracer.report()
+        tracer.write_all(args.trace_dir)
@@ -0,0 +1,109 @@
+"""
+Page-level text orientation for the OCR scripts.
+
+PaddleOCR's angle classifier (0 / 180 degrees) normally runs on every detected line or grid cell,
+although a scanned page is almost always oriented uniformly. Here it runs once per page on an evenly
+spaced sample of line (or cell) crops: when the sample agrees, the page array is rotated once if it
+is upside down and the per-line classifier is skipped; when it does not, the caller falls back to
+per-line classification.
+"""
+import numpy as np
+
+ORIENTATION_STRATEGIES = ("line", "page")
+
+# Crops classified per page
+SAMPLE_SIZE = 16
+# Fewer confident crops than this cannot decide the page orientation
+MIN_SAMPLES = 3
+# Fraction of the confident crops that must agree
+MIN_AGREEMENT = 0.9
+
+
+def sample_evenly(items, n=SAMPLE_SIZE):
+    """Returns up to n items spread evenly over the sequence (all of them if there are fewer)."""
+    if len(items) <= n:
+        return list(items)
+    return [items[i] for i in np.linspace(0, len(items) - 1, n).round().astype(int)]
+
+
+def estimate_rotation(classifier, crops, min_agreement=MIN_AGREEMENT, min_samples=MIN_SAMPLES):
+    """
+    Classifies a sample of text crops with a PaddleOCR TextClassifier.
+    Returns (rotation, agreement): rotation is 0 or 180 when at least min_agreement of the crops the
+    classifier is confident about agree, None when they do not (or too few are confident).
+    """
+    if classifier is None or not crops:
+        return None, 0.0
+    _, cls_res, _ = classifier(crops)
+    threshold = getattr(classifier, "cls_thresh", 0.9)
+    votes = [180 if "180" in label else 0 for label, score in cls_res if score > threshold]
+    if len(votes) < min_samples:
+        return None, 0.0
+    flipped = votes.count(180) / len(votes)
+    agreement = max(flipped, 1 - flipped)
+    if agreement < min_agreement:
+        return None, agreement
+    return (180 if flipped > 0.5 else 0), agreement
+
+
+def rotate_180(img):
+    """Returns a rotated (contiguous) copy of an image array."""
+    return np.ascontiguousarray(img[::-1, ::-1])
+
+
+def rotate_boxes_180(dt_boxes, image_shape):
+    """
+    Maps quad text boxes onto the image rotated by 180 degrees. The corner order is shifted by two,
+    so the first point is the top-left corner of the text again.
+    """
+    height, width = image_shape[:2]
+    boxes = np.asarray(dt_boxes, dtype=np.float32).reshape(-1, 4, 2)
+    rotated = np.empty_like(boxes)
+    rotated[:, :, 0] = width - 1 - boxes[:, :, 0]
+    rotated[:, :, 1] = height - 1 - boxes[:, :, 1]
+    return rotated[:, [2, 3, 0, 1], :]
+
+
+def rotate_edges_180(edges, size):
+    """Maps increasing grid edges (row or column boundaries) onto the image rotated by 180 degrees."""
+    return [size - edge for edge in reversed(edges)]
+
+
+def orient_page_text(text_system, img, sample_size=SAMPLE_SIZE, min_agreement=MIN_AGREEMENT):
+    """
+    Equivalent of text_system(img, cls=True) with page-level orientation: detection, one classifier
+    call on a sample of line crops, then recognition of all lines (rotated with the page when it is
+    upside down) without the per-line classifier, unless the sample disagrees.
+    Returns (img, dt_boxes, rec_res, rotation), where img is the upright page the boxes refer to and
+    rotation is 0, 180 or None (per-line fallback). Lines below text_system.drop_score are dropped.
+    """
+    from tools.infer.predict_system import sorted_boxes # Importable once paddleocr is loaded
+    from tools.infer.utility import get_minarea_rect_crop, get_rotate_crop_image
+
+    def crop(image, box):
+        if text_system.args.det_box_type == "quad":
+            return get_rotate_crop_image(image, box.copy())
+        return get_minarea_rect_crop(image, box.copy())
+
+    dt_boxes, _ = text_system.text_detector(img)
+    if dt_boxes is None or len(dt_boxes) == 0:
+        return img, [], [], 0
+    dt_boxes = sorted_boxes(dt_boxes)
+    classifier = getattr(text_system, "text_classifier", None) if text_system.use_angle_cls else None
+
+    rotation, _ = estimate_rotation(classifier, [crop(img, box) for box in sample_evenly(dt_boxes, sample_size)],
+                                    min_agreement)
+    if rotation == 180:
+        dt_boxes = sorted_boxes(rotate_boxes_180(dt_boxes, img.shape))
+        img = rotate_180(img)
+    crops = [crop(img, box) for box in dt_boxes]
+    if rotation is None and classifier is not None:
+        crops, _, _ = classifier(crops)
+    rec_res, _ = text_system.text_recognizer(crops)
+
+    filter_boxes, filter_rec_res = [], []
+    for box, rec_result in zip(dt_boxes, rec_res):
+        if rec_result[1] >= text_system.drop_score:
+            filter_boxes.append(box)
+            filter_rec_res.append(rec_result)
+    return img, filter_boxes, filter_rec_res, rotation
@@ -1,6 +1,7 @@
 import os
 from PIL import Image
 import argparse
+import numpy as np
 
 def split_image(image_path, output_dir, target_sub_height=800):
     """
@@ -58,6 +59,68 @@ def split_image(image_path, output_dir, target_sub_height=800):
     except Exception as e:
         print(f"An error occurred: {e}")
 
+def window_row_ink(img_np, lo, hi, dark_level=160):
+    """
+    Returns the number of dark pixels in each image row lo..hi-1. A pixel is dark when the mean of its
+    channels is below dark_level; only the uint8 rows of the window are read, so memory stays bounded
+    by the window size however tall the page is.
+    """
+    window = img_np[lo:hi]
+    if window.ndim == 3:
+        dark = window.sum(axis=2, dtype=np.int32) < dark_level * window.shape[2]
+    else:
+        dark = window < dark_level
+    return dark.sum(axis=1)
+
+def find_cut_row(img_np, start, target_sub_height, search=100, dark_level=160):
+    """
+    Picks the row to cut at near start + target_sub_height, preferring rows with the least ink
+    (whitespace between text lines) and, among those, the one closest to the target.
+    Only the rows within search of the target are examined.
+    """
+    img_height = img_np.shape[0]
+    target = start + target_sub_height
+    lo = max(start + 1, target - search)
+    hi = min(img_height, target + search + 1)
+    if lo >= hi:
+        return min(img_height, target)
+    rows = np.arange(lo, hi)
+    row_ink = window_row_ink(img_np, lo, hi, dark_level)
+    # Ink dominates the score; distance to the target only breaks ties
+    scores = row_ink.astype(np.int64) * (2 * search + 1) + np.abs(rows - target)
+    return int(rows[np.argmin(scores)])
+
+def iter_tiles(img_np, target_sub_height=800, overlap=64, search=100, dark_level=160):
+    """
+    Lazily yields (y_offset, tile) for overlapping horizontal tiles of an image array.
+
+    Tiles are cut at whitespace rows near target_sub_height instead of at fixed positions, and each
+    tile after the first starts overlap pixels above the previous cut, so a text line that could not
+    be avoided by the cut is seen whole in the next tile. Tiles are views of img_np (no copies, no files).
+    Raises ValueError (when called, not on the first tile) unless target_sub_height > 0, search >= 0
+    and 0 <= overlap < target_sub_height - search; otherwise a cut could land overlap pixels or less
+    below the tile start and the tiles would advance by a single row.
+    """
+    if target_sub_height <= 0:
+        raise ValueError(f"target_sub_height must be positive, got {target_sub_height}")
+    if search < 0 or overlap < 0:
+        raise ValueError(f"search and overlap must not be negative, got search={search}, overlap={overlap}")
+    if overlap >= target_sub_height - search:
+        raise ValueError(f"overlap ({overlap}) must be smaller than target_sub_height - search "
+                         f"({target_sub_height} - {search})")
+    return _iter_tiles(img_np, target_sub_height, overlap, search, dark_level)
+
+def _iter_tiles(img_np, target_sub_height, overlap, search, dark_level):
+    img_height = img_np.shape[0]
+    start = 0
+    while start < img_height:
+        if img_height - start <= target_sub_height + search:
+            yield start, img_np[start:]
+            return
+        cut = find_cut_row(img_np, start, target_sub_height, search, dark_level)
+        yield start, img_np[start:cut]
+        start = max(start + 1, cut - overlap)
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Split a large image into multiple sub-images.")
     parser.add_argument("image_path", type=str, help="Path to the input image file.")
@@ -0,0 +1,34 @@
+import numpy as np
+
+from ocrtest_fixed import _interior_mask, compute_cell_ink_stats, find_blank_cells
+
+
+def test_interior_mask_clamps_margin_per_segment():
+    mask = _interior_mask(np.array([0, 3, 13]), 3)
+    assert mask.astype(int).tolist() == [0, 1, 0, 0, 0, 0, 1, 1, 1, 1, 0, 0, 0]
+
+
+def test_small_cell_does_not_shrink_margin_of_the_others():
+    img = np.full((40, 60), 255, dtype=np.uint8)
+    img[1, :] = 0 # Ruling line inside the margin of the first row
+    img[15, 5:25] = 0 # Text in the first cell
+    dark_fraction, _ = compute_cell_ink_stats(img, [0, 30, 32, 40], [0, 30, 60])
+    assert dark_fraction[0, 0] > 0
+    assert dark_fraction[0, 1] == 0 # Only the ruling line, which the margin hides
+    blank = find_blank_cells(img, [0, 30, 32, 40], [0, 30, 60])
+    assert blank.tolist() == [[False, True], [True, True], [True, True]]
+
+
+def test_matches_per_cell_crops():
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, size=(50, 70, 3), dtype=np.uint8)
+    row_edges, col_edges, margin = [0, 12, 15, 50], [0, 20, 22, 70], 3
+    dark_fraction, std = compute_cell_ink_stats(img, row_edges, col_edges, margin=margin)
+    for r in range(3):
+        for c in range(3):
+            my = min(margin, (row_edges[r + 1] - row_edges[r] - 1) // 2)
+            mx = min(margin, (col_edges[c + 1] - col_edges[c] - 1) // 2)
+            cell = img[row_edges[r] + my:row_edges[r + 1] - my, col_edges[c] + mx:col_edges[c + 1] - mx]
+            gray = cell.mean(axis=2, dtype=np.float32)
+            assert np.isclose(dark_fraction[r, c], (gray < 160).mean(), atol=1e-6)
+            assert np.isclose(std[r, c], gray.std(), atol=1e-2)
@@ -0,0 +1,61 @@
+import cv2
+import numpy as np
+
+from grid_detect import deskew, detect_grid, estimate_skew, ink_mask
+
+ROWS = [40, 80, 130, 170, 220, 260]
+COLS = [30, 150, 240, 400]
+
+
+def ruled_table(thickness=2):
+    img = np.full((300, 440, 3), 255, dtype=np.uint8)
+    for y in ROWS:
+        img[y:y + thickness, COLS[0]:COLS[-1] + thickness] = 0
+    for x in COLS:
+        img[ROWS[0]:ROWS[-1] + thickness, x:x + thickness] = 0
+    for top, bottom in zip(ROWS, ROWS[1:]):
+        for left, right in zip(COLS, COLS[1:]):
+            cv2.putText(img, "12", (left + 10, bottom - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 1)
+    return img
+
+
+def assert_edges_near(edges, expected, tolerance=3):
+    assert len(edges) == len(expected), (edges, expected)
+    assert np.all(np.abs(np.asarray(edges) - np.asarray(expected)) <= tolerance), (edges, expected)
+
+
+def test_ruled_table():
+    _, row_edges, col_edges, angle = detect_grid(ruled_table())
+    assert angle == 0
+    assert_edges_near(row_edges, ROWS)
+    assert_edges_near(col_edges, COLS)
+
+
+def test_unruled_table_uses_projection_gaps():
+    img = np.full((300, 440, 3), 255, dtype=np.uint8)
+    for top, bottom in zip(ROWS, ROWS[1:]):
+        for left, right in zip(COLS, COLS[1:]):
+            cv2.putText(img, "88", (left + 20, bottom - 12), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 2)
+    _, row_edges, col_edges, _ = detect_grid(img, use_lines=False)
+    assert len(row_edges) == len(ROWS)
+    assert len(col_edges) == len(COLS)
+
+
+def test_skew_is_estimated_and_removed():
+    img = ruled_table()
+    height, width = img.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width / 2.0, height / 2.0), -1.5, 1.0)
+    skewed = cv2.warpAffine(img, matrix, (width, height), borderValue=(255, 255, 255))
+    angle = estimate_skew(ink_mask(skewed))
+    assert abs(abs(angle) - 1.5) <= 0.2
+    straight, row_edges, col_edges, detected = detect_grid(skewed)
+    assert abs(detected - angle) < 0.01
+    assert straight.shape == skewed.shape
+    assert_edges_near(row_edges, ROWS, tolerance=4)
+    assert_edges_near(col_edges, COLS, tolerance=4)
+
+
+def test_blank_page_and_no_skew():
+    img = np.full((100, 100, 3), 255, dtype=np.uint8)
+    assert estimate_skew(ink_mask(img, dark_level=128)) == 0.0
+    assert deskew(img, 0.0) is img
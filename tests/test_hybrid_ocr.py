@@ -0,0 +1,45 @@
+import asyncio
+
+import numpy as np
+
+from hybrid_ocr import finish_page, markdown_to_text
+from ocr_result import OCRLines
+
+
+class FakeBackend:
+    def __init__(self, answers):
+        self.answers = answers
+
+    async def recognize(self, crops):
+        return self.answers[:len(crops)]
+
+
+def page_lines():
+    boxes = [[[10, 10], [90, 10], [90, 30], [10, 30]], [[10, 40], [90, 40], [90, 60], [10, 60]],
+             [[10, 70], [90, 70], [90, 90], [10, 90]]]
+    return OCRLines(boxes, ["local a", "local b", "local c"], [0.6, 0.7, 0.4])
+
+
+def run_page(answers, drop_score=0.5):
+    img = np.full((100, 100, 3), 255, dtype=np.uint8)
+    page = finish_page(FakeBackend(answers), "page.png", img, page_lines(), [0, 1, 2], 0.0, 0.0, drop_score)
+    return asyncio.run(page)["lines"]
+
+
+def test_markdown_to_text():
+    assert markdown_to_text("# Title\n\n| a | b |\n|---|---|\n**bold** `code`") == "Title a b bold code"
+    assert markdown_to_text("![img-0.jpeg](img-0.jpeg)\n") == ""
+
+
+def test_remote_answers_replace_local_text():
+    records = run_page(["remote a", "remote b", "remote c"])
+    assert [(r["text"], r["source"], r["local_text"]) for r in records] == [
+        ("remote a", "remote", "local a"), ("remote b", "remote", "local b"), ("remote c", "remote", "local c")]
+
+
+def test_failed_or_empty_answers_keep_local_text():
+    records = run_page([None, "", "remote c"])
+    assert [(r["text"], r["source"]) for r in records] == [
+        ("local a", "local"), ("local b", "local"), ("remote c", "remote")]
+    # A low-score local line is still dropped when the remote answer is empty
+    assert [r["text"] for r in run_page(["remote a", "remote b", ""])] == ["remote a", "remote b"]
@@ -0,0 +1,54 @@
+import os
+
+from ocr_workers import collect_image_inputs, output_names
+from ocrtest import build_tasks
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb"):
+        pass
+
+
+def test_directory_keeps_relative_tree(tmp_path):
+    touch(tmp_path / "scans" / "p1.png")
+    touch(tmp_path / "scans" / "sub" / "p2.jpg")
+    touch(tmp_path / "scans" / "notes.txt")
+    entries = collect_image_inputs([str(tmp_path / "scans")])
+    assert [relative for _, relative in entries] == ["p1.png", os.path.join("sub", "p2.jpg")]
+
+
+def test_glob_and_file_list(tmp_path):
+    touch(tmp_path / "scans" / "a" / "p1.png")
+    touch(tmp_path / "scans" / "b" / "p2.png")
+    touch(tmp_path / "extra.png")
+    file_list = tmp_path / "list.txt"
+    file_list.write_text(f"# comment\n{tmp_path / 'extra.png'}\n\n{tmp_path / 'scans' / 'a' / 'p1.png'}\n")
+    entries = collect_image_inputs([str(tmp_path / "scans" / "**" / "*.png")], file_list=str(file_list))
+    relative = [relative for _, relative in entries]
+    # p1.png is listed twice (glob and file list) and kept once
+    assert relative == [os.path.join("a", "p1.png"), os.path.join("b", "p2.png"), "extra.png"]
+
+
+def test_same_name_from_two_roots_does_not_collide(tmp_path):
+    touch(tmp_path / "a" / "p.png")
+    touch(tmp_path / "b" / "p.png")
+    entries = collect_image_inputs([str(tmp_path / "a" / "p.png"), str(tmp_path / "b" / "p.png")])
+    assert len(entries) == 2
+    tasks = build_tasks(entries, str(tmp_path / "out"))
+    outputs = {os.path.join(save_folder, name) for _, save_folder, name, _ in tasks}
+    assert len(outputs) == 2
+    assert len({visualization for *_, visualization in tasks}) == 2
+
+
+def test_same_stem_different_extension_does_not_collide(tmp_path):
+    touch(tmp_path / "scans" / "x.png")
+    touch(tmp_path / "scans" / "x.jpg")
+    tasks = build_tasks(collect_image_inputs([str(tmp_path / "scans")]), str(tmp_path / "out"))
+    names = sorted(name for _, _, name, _ in tasks)
+    assert names == ["x", "x_png"]
+
+
+def test_output_names():
+    assert output_names(["p.png", "q.png", os.path.join("sub", "p.png")]) == ["p", "q", "p"]
+    assert output_names(["p.png", "p.jpg", "p.jpg", "P.PNG"]) == ["p", "p_jpg", "p_jpg_2", "P_PNG"]
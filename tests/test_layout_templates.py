@@ -0,0 +1,110 @@
+import cv2
+import numpy as np
+import pytest
+
+import layout_templates
+from layout_templates import LayoutTemplateStore, TEMPLATE_HIT, TEMPLATE_MISS, TEMPLATE_NO_FINGERPRINT
+
+
+def ruled_form(height=3508, width=2480, dx=0, dy=0, rows=12, cols=5, thickness=5, seed=0):
+    """A white page with a ruled table and some filled-in numbers, moved by (dx, dy)."""
+    rng = np.random.default_rng(seed)
+    img = np.full((height, width, 3), 255, np.uint8)
+    ys = np.linspace(0.15 * height, 0.9 * height, rows).astype(int)
+    xs = np.linspace(0.05 * width, 0.95 * width, cols).astype(int)
+    for y in ys:
+        cv2.line(img, (int(xs[0]) + dx, int(y) + dy), (int(xs[-1]) + dx, int(y) + dy), (0, 0, 0), thickness)
+    for x in xs:
+        cv2.line(img, (int(x) + dx, int(ys[0]) + dy), (int(x) + dx, int(ys[-1]) + dy), (0, 0, 0), thickness)
+    for _ in range(30):
+        x = int(rng.integers(xs[0] + 20, xs[-1] - width // 8))
+        y = int(rng.choice(ys[:-1])) + int(0.03 * height)
+        cv2.putText(img, str(rng.integers(1000, 99999)), (x + dx, y + dy), cv2.FONT_HERSHEY_SIMPLEX,
+                    height / 1100, (0, 0, 0), 3)
+    return img
+
+
+def table_regions(height, width):
+    cells = [[0, 0, 100, 0, 100, 40, 0, 40], [100, 0, 200, 0, 200, 40, 100, 40]]
+    return [{"label": "text", "bbox": [0, 0, width, height // 10], "structure": None},
+            {"label": "table", "bbox": [100, 500, 1100, 1300], "structure": {"tokens": ["<tr>", "<td></td>", "<td></td>", "</tr>"],
+                                                                           "cells": cells}}]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = LayoutTemplateStore(str(tmp_path / "templates.db"), [])
+    yield store
+    store.close()
+
+
+def learn(store, img):
+    match, fingerprint = store.lookup(img)
+    assert match is None and store.last_status == TEMPLATE_MISS
+    store.add(fingerprint, img.shape, table_regions(*img.shape[:2]))
+
+
+@pytest.mark.parametrize("dx, dy", [(0, 3), (7, 0), (3, 3), (20, 15), (-30, 40)])
+def test_shifted_copy_matches_with_its_offset(store, dx, dy):
+    learn(store, ruled_form(seed=0))
+    match, _ = store.lookup(ruled_form(dx=dx, dy=dy, seed=1))
+    assert store.last_status == TEMPLATE_HIT
+    assert match.dx == pytest.approx(dx, abs=3)
+    assert match.dy == pytest.approx(dy, abs=3)
+
+
+def test_small_form_shift_matches(store):
+    learn(store, ruled_form(1400, 1000, seed=0))
+    match, _ = store.lookup(ruled_form(1400, 1000, dx=20, dy=15, seed=1))
+    assert store.last_status == TEMPLATE_HIT
+    assert (match.dx, match.dy) == (pytest.approx(20, abs=3), pytest.approx(15, abs=3))
+
+
+def test_rescaled_copy_matches_and_scales_cells(store):
+    template = ruled_form(seed=0)
+    learn(store, template)
+    scaled = cv2.resize(ruled_form(seed=2), None, fx=0.6, fy=0.6, interpolation=cv2.INTER_AREA)
+    match, _ = store.lookup(scaled)
+    assert store.last_status == TEMPLATE_HIT
+    assert match.scale_x == pytest.approx(0.6, abs=0.01)
+    label, bbox, (tokens, cells) = match.regions()[1]
+    assert label == "table" and tokens[1] == "<td></td>"
+    assert bbox == pytest.approx([60, 300, 660, 780], abs=4)
+    # Cells stay relative to their region and are scaled with it
+    assert cells[1].tolist() == pytest.approx([60, 0, 120, 0, 120, 24, 60, 24], abs=3)
+
+
+def test_different_form_does_not_match(store):
+    learn(store, ruled_form(seed=0))
+    match, _ = store.lookup(ruled_form(rows=20, cols=3, seed=1))
+    assert match is None and store.last_status == TEMPLATE_MISS
+
+
+def test_blank_page_has_no_fingerprint(store):
+    match, fingerprint = store.lookup(np.full((1400, 1000, 3), 255, np.uint8))
+    assert match is None and fingerprint is None and store.last_status == TEMPLATE_NO_FINGERPRINT
+
+
+def test_templates_are_shared_through_the_file_and_not_duplicated(tmp_path):
+    path = str(tmp_path / "templates.db")
+    first = LayoutTemplateStore(path, [])
+    second = LayoutTemplateStore(path, [])
+    img = ruled_form(1400, 1000)
+    _, fingerprint = second.lookup(img) # Seen by both workers before either stores it
+    learn(first, img)
+    second.add(fingerprint, img.shape, table_regions(1400, 1000))
+    assert len(second.templates) == 1
+    second.lookup(ruled_form(1400, 1000, dy=5, seed=3))
+    assert second.last_status == TEMPLATE_HIT
+    first.close()
+    second.close()
+
+
+def test_profile_bins_keep_thin_line_mass():
+    profile = np.zeros(3508)
+    profile[1000:1004] = 1.0
+    shifted = np.zeros(3508)
+    shifted[1003:1007] = 1.0
+    score, shift = layout_templates._best_shift(layout_templates._profile(shifted), layout_templates._profile(profile))
+    assert score > 0.98
+    assert shift * 3508 / layout_templates.PROFILE_BINS == pytest.approx(3, abs=1)
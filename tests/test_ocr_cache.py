@@ -0,0 +1,76 @@
+import sqlite3
+import time
+
+import numpy as np
+
+import ocr_cache
+from ocr_cache import OCRCache
+
+
+def last_access(db_path, key):
+    with sqlite3.connect(db_path) as db:
+        return db.execute("SELECT last_access FROM entries WHERE key = ?", (key,)).fetchone()[0]
+
+
+def test_round_trip_and_key_params(tmp_path):
+    cache = OCRCache(str(tmp_path / "cache.db"), [str(tmp_path)])
+    img = np.zeros((8, 8, 3), dtype=np.uint8)
+    key = cache.make_key(img, "rec", "ch", True)
+    assert cache.make_key(img, "rec", "en", True) != key
+    assert cache.make_key(img[:4], "rec", "ch", True) != key
+    assert cache.get(key) is None
+    cache.put(key, ["text", 0.9])
+    cache.close()
+
+    reopened = OCRCache(str(tmp_path / "cache.db"), [str(tmp_path)])
+    assert reopened.get(key) == ["text", 0.9]
+    assert reopened.stats()["disk_hits"] == 1
+    reopened.close()
+
+
+def test_memory_hits_update_last_access(tmp_path):
+    db_path = str(tmp_path / "cache.db")
+    cache = OCRCache(db_path, [str(tmp_path)])
+    key = cache.make_key(np.zeros((4, 4), dtype=np.uint8), "ocr")
+    cache.put(key, "a")
+    cache.flush()
+    stored = last_access(db_path, key)
+    time.sleep(0.01)
+    assert cache.get(key) == "a"
+    assert cache.stats()["memory_hits"] == 1
+    cache.flush()
+    assert last_access(db_path, key) > stored
+    cache.close()
+
+
+def test_touches_are_written_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(ocr_cache, "FLUSH_EVERY", 4)
+    db_path = str(tmp_path / "cache.db")
+    cache = OCRCache(db_path, [str(tmp_path)])
+    keys = [cache.make_key(np.full((2, 2), i, dtype=np.uint8)) for i in range(4)]
+    for key in keys:
+        cache.put(key, "x") # The fourth put flushes
+    stored = last_access(db_path, keys[0])
+    time.sleep(0.01)
+    for key in keys:
+        cache.get(key) # The fourth hit flushes the access times without an explicit flush
+    assert last_access(db_path, keys[0]) > stored
+    cache.close()
+
+
+def test_eviction_keeps_recently_hit_entries(tmp_path):
+    db_path = str(tmp_path / "cache.db")
+    cache = OCRCache(db_path, [str(tmp_path)], max_disk_mb=1e-3) # About 1 KB
+    old = cache.make_key(np.zeros((2, 2), dtype=np.uint8))
+    hot = cache.make_key(np.ones((2, 2), dtype=np.uint8))
+    cache.put(hot, "h" * 200)
+    cache.put(old, "o" * 200)
+    cache.flush()
+    time.sleep(0.01)
+    cache.get(hot) # Memory hit: hot is now the most recently used on disk too
+    cache.put(cache.make_key(np.full((2, 2), 2, dtype=np.uint8)), "n" * 700)
+    cache.flush()
+    with sqlite3.connect(db_path) as db:
+        remaining = {row[0] for row in db.execute("SELECT key FROM entries")}
+    assert hot in remaining and old not in remaining
+    cache.close()
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from ocr_result import OCRLines
+
+PADDLE_PAGE = [
+    [[[50.0, 40.0], [150.0, 40.0], [150.0, 60.0], [50.0, 60.0]], ("右上", 0.91)],
+    [[[10.0, 40.0], [40.0, 40.0], [40.0, 60.0], [10.0, 60.0]], ("左上", 0.6)],
+    [[[10.0, 5.0], [90.0, 5.0], [90.0, 25.0], [10.0, 25.0]], ("标题", 0.987654321)],
+]
+
+
+def page():
+    return OCRLines.from_paddle([PADDLE_PAGE])
+
+
+def test_from_paddle_round_trip():
+    lines = page()
+    assert len(lines) == 3
+    assert lines.boxes.dtype == np.float32 and lines.boxes.shape == (3, 4, 2)
+    assert lines.to_paddle() == [PADDLE_PAGE]
+    assert lines.scores[2] == 0.987654321 # float64 keeps recognizer scores exact
+
+
+def test_empty_pages():
+    for lines in (OCRLines.from_paddle([None]), OCRLines.from_paddle([]), OCRLines.from_text_system(None, None),
+                  OCRLines.concatenate([])):
+        assert len(lines) == 0 and lines.boxes.shape == (0, 4, 2)
+    assert OCRLines().to_paddle() == [None]
+    assert len(OCRLines().sorted_reading_order()) == 0
+
+
+def test_from_text_system_matches_from_paddle():
+    dt_boxes = np.array([line[0] for line in PADDLE_PAGE], dtype=np.float32)
+    rec_res = [line[1] for line in PADDLE_PAGE]
+    lines = OCRLines.from_text_system(dt_boxes, rec_res)
+    assert lines.texts == page().texts
+    np.testing.assert_array_equal(lines.boxes, page().boxes)
+
+
+def test_select_filter_and_regions():
+    lines = page()
+    assert lines.select([2, 0]).texts == ["标题", "右上"]
+    assert lines.select(np.array([True, False, True])).texts == ["右上", "标题"]
+    assert lines.filter_scores(0.9).texts == ["右上", "标题"]
+    assert lines.in_region(0, 30, 45, 70).tolist() == [1]
+    assert lines.in_region(0, 0, 200, 200).tolist() == [0, 1, 2]
+
+
+def test_reading_order_bounds_and_shift():
+    lines = page()
+    assert lines.sorted_reading_order().texts == ["标题", "左上", "右上"]
+    np.testing.assert_array_equal(lines.bounds()[0], [50, 40, 150, 60])
+    shifted = lines.shifted(dy=800)
+    np.testing.assert_array_equal(shifted.bounds()[:, 1], lines.bounds()[:, 1] + 800)
+    np.testing.assert_array_equal(lines.bounds()[0], [50, 40, 150, 60]) # The original is unchanged
+
+
+def test_concatenate():
+    lines = OCRLines.concatenate([page(), page().shifted(dy=100)])
+    assert len(lines) == 6
+    assert lines.texts[3:] == page().texts
+    assert lines.bounds()[3, 1] == 140
+
+
+def test_records_and_serialization(tmp_path):
+    lines = page()
+    assert lines.to_records()[1] == {"text": "左上", "confidence": 0.6,
+                                     "text_region": [[10.0, 40.0], [40.0, 40.0], [40.0, 60.0], [10.0, 60.0]]}
+    for restored in (OCRLines.from_json(lines.to_json()), OCRLines.from_dict(lines.to_dict())):
+        assert restored.to_paddle() == lines.to_paddle()
+    path = str(tmp_path / "page.npz")
+    lines.save_npz(path)
+    assert OCRLines.load_npz(path).to_paddle() == lines.to_paddle()
+
+
+def test_arrow_round_trip():
+    pytest.importorskip("pyarrow")
+    lines = page()
+    table = lines.to_arrow()
+    assert table.num_rows == 3
+    assert OCRLines.from_arrow(table).to_paddle() == lines.to_paddle()
@@ -0,0 +1,105 @@
+import os
+
+import pytest
+
+from ocr_writers import RowWriter, checkpoint_path, is_complete, open_row_writer, read_checkpoint, read_rows
+
+ROWS = [["a", "1,5"], ["b", 'quote "x"'], ["c", "多行\n文本"], ["d", ""], ["e", "5"]]
+
+
+@pytest.mark.parametrize("name", ["out.csv", "out.jsonl"])
+def test_rows_round_trip(tmp_path, name):
+    path = str(tmp_path / "sub" / name)
+    with open_row_writer(path, checkpoint_every=2) as writer:
+        for row in ROWS:
+            writer.write_row(row)
+    assert list(read_rows(path)) == ROWS
+    assert is_complete(path)
+    assert not os.path.exists(checkpoint_path(path))
+
+
+def interrupted_run(path, rows_before_failure, checkpoint_every=2, meta=None):
+    with pytest.raises(RuntimeError):
+        with RowWriter(path, meta=meta, checkpoint_every=checkpoint_every) as writer:
+            for row in ROWS[:rows_before_failure]:
+                writer.write_row(row)
+            raise RuntimeError("killed")
+
+
+@pytest.mark.parametrize("name", ["out.csv", "out.jsonl"])
+def test_resume_continues_after_last_checkpoint(tmp_path, name):
+    path = str(tmp_path / name)
+    interrupted_run(path, 3, checkpoint_every=2, meta={"grid": 1})
+    assert not is_complete(path)
+    assert read_checkpoint(path)["rows"] == 3 # Leaving the block with an exception checkpoints
+
+    with RowWriter(path, resume=True, meta={"grid": 1}) as writer:
+        assert writer.rows_done == 3
+        for row in ROWS[writer.rows_done:]:
+            writer.write_row(row)
+    assert list(read_rows(path)) == ROWS
+    assert is_complete(path)
+
+
+def test_resume_drops_rows_after_the_checkpoint(tmp_path):
+    path = str(tmp_path / "out.jsonl")
+    writer = RowWriter(path, checkpoint_every=2)
+    for row in ROWS[:3]:
+        writer.write_row(row)
+    writer.file.flush() # The third row reached the file but no checkpoint (a crash, not an exception)
+    writer.file.close()
+
+    resumed = RowWriter(path, resume=True)
+    assert resumed.rows_done == 2
+    resumed.close(complete=False)
+    assert list(read_rows(path)) == ROWS[:2]
+
+
+def test_resume_of_another_job_starts_over(tmp_path, capsys):
+    path = str(tmp_path / "out.csv")
+    interrupted_run(path, 4, meta={"grid": 1})
+    with RowWriter(path, resume=True, meta={"grid": 2}) as writer:
+        assert writer.rows_done == 0
+        writer.write_row(["z"])
+    assert "different job" in capsys.readouterr().out
+    assert list(read_rows(path)) == [["z"]]
+
+
+def test_resume_leaves_finished_output_alone(tmp_path):
+    path = str(tmp_path / "out.csv")
+    with RowWriter(path) as writer:
+        writer.write_row(["done"])
+    writer = RowWriter(path, resume=True)
+    assert writer.complete and writer.file is None
+    writer.close()
+    assert list(read_rows(path)) == [["done"]]
+
+
+def test_xlsx_is_written_on_completion_and_resumable(tmp_path):
+    openpyxl = pytest.importorskip("openpyxl")
+    path = str(tmp_path / "out.xlsx")
+    with pytest.raises(RuntimeError):
+        with open_row_writer(path, checkpoint_every=1) as writer:
+            writer.write_row(ROWS[0])
+            raise RuntimeError("killed")
+    assert not os.path.exists(path) and not is_complete(path)
+
+    with open_row_writer(path, resume=True) as writer:
+        assert writer.rows_done == 1
+        for row in ROWS[1:]:
+            writer.write_row(row)
+    assert is_complete(path)
+    assert not os.path.exists(path + ".rows.jsonl")
+    sheet = openpyxl.load_workbook(path).active
+    assert [[cell or "" for cell in row] for row in sheet.iter_rows(values_only=True)] == ROWS
+    assert open_row_writer(path, resume=True).complete
+
+
+def test_checkpoint_records_offset_and_meta(tmp_path):
+    path = str(tmp_path / "out.jsonl")
+    writer = RowWriter(path, meta={"image": "p.png"}, checkpoint_every=1)
+    writer.write_row({"k": 1})
+    state = read_checkpoint(path)
+    assert state == {"rows": 1, "offset": os.path.getsize(path), "meta": {"image": "p.png"}}
+    writer.close()
+    assert list(read_rows(path)) == [{"k": 1}]
@@ -0,0 +1,15 @@
+import pytest
+
+from ocr_trace import percentile
+
+
+@pytest.mark.parametrize("q, expected", [(0, 1), (10, 1), (50, 5), (90, 9), (91, 10), (99, 10), (100, 10)])
+def test_nearest_rank(q, expected):
+    assert percentile(list(range(1, 11)), q) == expected
+
+
+def test_small_and_empty():
+    assert percentile([], 50) == 0.0
+    assert percentile([7.5], 99) == 7.5
+    assert percentile([1, 2], 50) == 1
+    assert percentile([1, 2, 3, 4], 75) == 3
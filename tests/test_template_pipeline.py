@@ -0,0 +1,134 @@
+import cv2
+import numpy as np
+import pytest
+
+from grid_detect import detect_grid
+from layout_templates import TEMPLATE_HIT, TEMPLATE_MISS, LayoutTemplateStore
+from ocrtest import run_shared_pipeline
+
+ROWS = [300, 360, 420, 500, 560]
+COLS = [80, 260, 440, 620]
+HEADER = [80, 60, 620, 140]
+TABLE = [70, 290, 630, 570]
+
+
+def put(img, text, x, y, scale=0.8):
+    cv2.putText(img, text, (x, y), cv2.FONT_HERSHEY_SIMPLEX, scale, (0, 0, 0), 2)
+
+
+def form(header="FORM 7", note=False, page_number=True):
+    img = np.full((1000, 700, 3), 255, dtype=np.uint8)
+    put(img, header, 100, 110, 1.2)
+    for y in ROWS:
+        img[y:y + 3, COLS[0]:COLS[-1] + 3] = 0
+    for x in COLS:
+        img[ROWS[0]:ROWS[-1] + 3, x:x + 3] = 0
+    for r, (top, bottom) in enumerate(zip(ROWS, ROWS[1:])):
+        for c, left in enumerate(COLS[:-1]):
+            if (r, c) == (1, 2):
+                continue # Blank cell
+            if (r, c) == (2, 1):
+                put(img, "12", left + 20, top + 30, 0.6) # Two lines in one cell
+                put(img, "345", left + 20, top + 65, 0.6)
+            elif (r, c) == (3, 0):
+                put(img, "7", left + 10, bottom - 20) # Two pieces of text far apart
+                put(img, "88", left + 130, bottom - 20)
+            else:
+                put(img, str(10 * r + c + 1) * (c + 1), left + 15, bottom - 20)
+    if page_number:
+        put(img, "- 3 -", 320, 900) # Outside the layout regions
+    if note:
+        put(img, "OK 42", 500, 700, 1.0) # Handwritten note between the table and the page number
+    return img
+
+
+class FakeTextSystem:
+    """Detection: one box per run of text ink; recognition: a signature of the ink in the crop."""
+
+    drop_score = 0.5
+    use_angle_cls = False
+
+    def __call__(self, img, cls=True):
+        ink = (img.min(axis=2) < 128).astype(np.uint8)
+        lines = sum(cv2.morphologyEx(ink, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, kernel))
+                    for kernel in ((60, 1), (1, 60)))
+        ink[cv2.dilate(lines, np.ones((3, 3), np.uint8)) > 0] = 0 # Ruling lines are not text
+        merged = cv2.dilate(ink, np.ones((1, 25), np.uint8))
+        count, _, stats, _ = cv2.connectedComponentsWithStats(merged)
+        boxes, crops = [], []
+        for x, y, w, h, _ in stats[1:]:
+            sub = ink[y:y + h, x:x + w]
+            ys, xs = np.nonzero(sub)
+            x1, y1, x2, y2 = x + xs.min(), y + ys.min(), x + xs.max() + 1, y + ys.max() + 1
+            boxes.append(np.float32([[x1, y1], [x2, y1], [x2, y2], [x1, y2]]))
+            crops.append(img[y1:y2, x1:x2])
+        rec_res, _ = self.text_recognizer(crops)
+        return np.array(boxes).reshape(-1, 4, 2), rec_res, {}
+
+    def text_recognizer(self, crops):
+        results = []
+        for crop in crops:
+            ink = crop.min(axis=2) < 128
+            count, _ = cv2.connectedComponents(ink.astype(np.uint8))
+            results.append((f"{count - 1}:{int(ink.any(axis=0).sum())}", 0.95))
+        return results, 0.0
+
+
+class FakeTableSystem:
+    def _structure(self, roi):
+        _, rows, cols, _ = detect_grid(roi, max_skew=0)
+        cells = [[c0 + 3, r0 + 3, c1 - 1, r1 - 1] for r0, r1 in zip(rows, rows[1:]) for c0, c1 in zip(cols, cols[1:])]
+        return (["<td></td>"] * len(cells), np.float32(cells)), 0.0
+
+    def match(self, structure_res, table_boxes, table_rec_res):
+        return "<table></table>"
+
+
+class FakeEngine:
+    def __init__(self, layout=True):
+        self.text_system = FakeTextSystem()
+        self.table_system = FakeTableSystem()
+        self.layout_predictor = self._layout if layout else None
+
+    def _layout(self, img):
+        return [{"bbox": HEADER, "label": "text"}, {"bbox": TABLE, "label": "table"}], 0.0
+
+
+def signature(lines):
+    """Texts with box centers, rounded, in a fixed order."""
+    centers = lines.centers().round().astype(int)
+    return sorted((text, int(x), int(y)) for text, (x, y) in zip(lines.texts, centers))
+
+
+def assert_same_lines(hit, miss):
+    assert len(hit) == len(miss)
+    for (text, x, y), (ref_text, ref_x, ref_y) in zip(signature(hit), signature(miss)):
+        assert text == ref_text
+        assert abs(x - ref_x) <= 2 and abs(y - ref_y) <= 2
+
+
+@pytest.mark.parametrize("layout", [True, False])
+def test_hit_and_miss_give_the_same_lines(tmp_path, layout):
+    engine = FakeEngine(layout)
+    store = LayoutTemplateStore(str(tmp_path / "templates.db"), [str(tmp_path)])
+    run_shared_pipeline(engine, form(), templates=store)
+    assert store.last_status == TEMPLATE_MISS
+
+    page = form(header="FORM 9", note=True) # Changed header and a note the template never saw
+    hit_lines, hit_regions = run_shared_pipeline(engine, page, templates=store)
+    assert store.last_status == TEMPLATE_HIT
+    miss_lines, miss_regions = run_shared_pipeline(engine, page)
+    assert_same_lines(hit_lines, miss_lines)
+    assert [r["type"] for r in hit_regions] == [r["type"] for r in miss_regions]
+    store.close()
+
+
+def test_uncovered_text_is_read_on_hit_pages(tmp_path):
+    engine = FakeEngine()
+    store = LayoutTemplateStore(str(tmp_path / "templates.db"), [str(tmp_path)])
+    run_shared_pipeline(engine, form(page_number=False), templates=store)
+    without_note, _ = run_shared_pipeline(engine, form(page_number=False), templates=store)
+    with_note, _ = run_shared_pipeline(engine, form(note=True), templates=store)
+    assert store.last_status == TEMPLATE_HIT
+    assert len(with_note) == len(without_note) + 2 # The page number and the note
+    store.close()
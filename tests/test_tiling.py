@@ -0,0 +1,109 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from ocr_result import OCRLines
+from split_image import iter_tiles
+from tiled_ocr import merge_tile_lines, ocr_tiled
+
+
+def receipt(height=3000, width=200, line_every=40, line_height=14):
+    """White page with a dark 'text line' bar every line_every pixels."""
+    img = np.full((height, width, 3), 255, dtype=np.uint8)
+    for y in range(10, height - line_height, line_every):
+        img[y:y + line_height, 20:180] = 0
+    return img
+
+
+def box(x0, y0, x1, y1):
+    return [[x0, y0], [x1, y0], [x1, y1], [x0, y1]]
+
+
+def test_tiles_cover_the_image_and_overlap():
+    img = receipt()
+    tiles = list(iter_tiles(img, target_sub_height=800, overlap=64, search=100))
+    assert len(tiles) > 1
+    assert tiles[0][0] == 0
+    assert tiles[-1][0] + tiles[-1][1].shape[0] == img.shape[0]
+    for (y0, t0), (y1, _) in zip(tiles, tiles[1:]):
+        cut = y0 + t0.shape[0]
+        assert y1 == cut - 64
+        assert 800 - 100 <= t0.shape[0] <= 800 + 100
+        assert not (img[cut] == 0).any() # Cut at a whitespace row
+        assert np.shares_memory(t0, img)
+
+
+def test_cut_search_reads_only_the_window():
+    img = receipt(height=20000, width=2000)
+    full_ink = (img.mean(axis=2) < 160).sum(axis=1)
+    tracemalloc.start()
+    tiles = [(y, t.shape[0]) for y, t in iter_tiles(img, target_sub_height=800, overlap=64, search=100)]
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert peak < 10 * 1024 * 1024 # The page is 120 MB as uint8, 960 MB as a float64 copy
+    for y, height in tiles[:-1]:
+        cut = y + height
+        assert full_ink[cut] == full_ink[cut - 100:cut + 101].min()
+
+
+def test_short_image_is_one_tile():
+    img = receipt(height=850)
+    assert [(y, t.shape[0]) for y, t in iter_tiles(img)] == [(0, 850)]
+
+
+@pytest.mark.parametrize("kwargs", [{"target_sub_height": 0}, {"overlap": -1}, {"search": -5},
+                                    {"target_sub_height": 200, "search": 100, "overlap": 100},
+                                    {"target_sub_height": 100, "search": 150, "overlap": 0}])
+def test_degenerate_parameters_raise(kwargs):
+    with pytest.raises(ValueError):
+        iter_tiles(receipt(), **kwargs) # Raised on the call, before any tile is requested
+
+
+def test_merge_keeps_the_complete_line_over_a_fragment():
+    # Tile 0 read line a whole; tile 1 only the fragment "ne a" (cut at its edge), with a higher score
+    lines = OCRLines([box(20, 100, 180, 114), box(30, 102, 90, 112), box(20, 140, 180, 154)],
+                     ["line a", "ne a", "line b"], [0.9, 0.99, 0.8])
+    merged = merge_tile_lines(lines, [0, 1, 1])
+    assert merged.texts == ["line a", "line b"]
+
+
+def test_merge_drops_duplicates_from_overlaps():
+    lines = OCRLines([box(20, 100, 180, 114), box(20, 101, 180, 115), box(20, 140, 180, 154)],
+                     ["line a", "line a'", "line b"], [0.9, 0.95, 0.8])
+    merged = merge_tile_lines(lines, [0, 1, 1])
+    assert merged.texts == ["line a'", "line b"]
+    assert len(merge_tile_lines(OCRLines())) == 0
+
+
+def test_merge_keeps_short_lines_of_one_tile():
+    # A short line mostly inside a wider box of the same tile (e.g. a superscript) is its own line
+    lines = OCRLines([box(20, 100, 180, 130), box(150, 102, 170, 112)], ["wide line", "2"], [0.9, 0.99])
+    assert sorted(merge_tile_lines(lines, [0, 0]).texts) == ["2", "wide line"]
+    assert merge_tile_lines(lines, [0, 1]).texts == ["wide line"]
+
+
+class BarOCR:
+    """Fake OCR engine: every run of dark rows in a tile is one text line."""
+
+    def ocr(self, tile, cls=True):
+        dark = (tile.mean(axis=2) < 128).any(axis=1)
+        lines = []
+        y = 0
+        while y < len(dark):
+            if dark[y]:
+                end = y
+                while end + 1 < len(dark) and dark[end + 1]:
+                    end += 1
+                lines.append([box(20, y, 180, end), ("line", 0.9)])
+                y = end + 1
+            else:
+                y += 1
+        return [lines]
+
+
+def test_ocr_tiled_finds_every_line_once():
+    img = receipt()
+    lines = ocr_tiled(BarOCR(), img, target_sub_height=800, overlap=64, search=100)
+    expected = list(range(10, img.shape[0] - 14, 40))
+    assert lines.bounds()[:, 1].astype(int).tolist() == expected
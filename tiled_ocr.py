@@ -0,0 +1,126 @@
+"""
+Streaming tiled OCR for very tall images (receipts, long scans).
+
+Replaces the split_image.py -> sub_image_NNN.png -> OCR-each-file workflow. Tiles are produced lazily
+in memory by split_image.iter_tiles (cut at whitespace rows, overlapping), fed straight into the OCR
+engine, shifted back to page coordinates and merged across the overlaps with de-duplication, so the
+full-page result arrives without temporary files or PNG encode/decode.
+"""
+import argparse
+import json
+import os
+import sys
+
+import cv2
+import numpy as np
+
+from ocr_result import OCRLines
+from split_image import iter_tiles
+
+# Boxes this close (in pixels) to a tile edge that was cut are treated as truncated
+EDGE_TOLERANCE = 2
+# Boxes from neighbouring tiles overlapping more than this are the same text line
+DUPLICATE_IOU = 0.5
+
+
+def merge_tile_lines(lines, tile_ids=None):
+    """
+    De-duplicates OCR lines (an OCRLines in page coordinates) collected from overlapping tiles;
+    tile_ids gives the tile of each line (without it every line counts as coming from its own tile).
+    Lines are kept greedily by score; a line is dropped when its box overlaps a kept box by more than
+    DUPLICATE_IOU. A line from another tile that lies mostly (80%) inside a kept box is a fragment of
+    it, cut at a tile edge: the larger, complete box is kept whichever scores higher. Lines of one tile
+    never remove each other by containment, so a short line next to a wider one survives.
+    """
+    if len(lines) == 0:
+        return lines
+    if tile_ids is None:
+        tile_ids = np.arange(len(lines))
+    tile_ids = np.asarray(tile_ids)
+    bounds = lines.bounds()
+    areas = np.maximum(bounds[:, 2] - bounds[:, 0], 0) * np.maximum(bounds[:, 3] - bounds[:, 1], 0)
+    order = np.argsort(-lines.scores, kind="stable")
+
+    kept = []
+    for idx in order:
+        if kept:
+            k = np.asarray(kept)
+            inter_w = np.clip(np.minimum(bounds[k, 2], bounds[idx, 2]) - np.maximum(bounds[k, 0], bounds[idx, 0]), 0, None)
+            inter_h = np.clip(np.minimum(bounds[k, 3], bounds[idx, 3]) - np.maximum(bounds[k, 1], bounds[idx, 1]), 0, None)
+            inter = inter_w * inter_h
+            union = areas[k] + areas[idx] - inter
+            iou = inter / np.maximum(union, 1e-6)
+            other_tile = tile_ids[k] != tile_ids[idx]
+            # Kept fragments of this (larger) line from other tiles give way to it
+            fragments = other_tile & (inter / np.maximum(areas[k], 1e-6) > 0.8) & (areas[k] < areas[idx])
+            inside_kept = other_tile & (inter / max(areas[idx], 1e-6) > 0.8)
+            if np.any((iou > DUPLICATE_IOU) & ~fragments) or np.any(inside_kept & ~fragments):
+                continue
+            kept = k[~fragments].tolist()
+        kept.append(idx)
+    return lines.select(sorted(kept))
+
+
+def ocr_tiled(ocr, img_np, target_sub_height=800, overlap=64, search=100, cls=True):
+    """
+    Runs OCR on a tall image tile by tile and returns the merged full-page lines (an OCRLines)
+    in reading order (top to bottom, then left to right).
+    """
+    img_height = img_np.shape[0]
+    tile_parts = []
+    tile_ids = []
+    tile_count = 0
+    for y_offset, tile in iter_tiles(img_np, target_sub_height, overlap, search):
+        tile_count += 1
+        tile_height = tile.shape[0]
+        is_last = y_offset + tile_height >= img_height
+        tile_lines = OCRLines.from_paddle(ocr.ocr(tile, cls=cls))
+        bounds = tile_lines.bounds()
+        # A line touching a cut edge is truncated; the neighbouring tile sees it whole
+        keep = np.ones(len(tile_lines), dtype=bool)
+        if y_offset > 0:
+            keep &= bounds[:, 1] > EDGE_TOLERANCE
+        if not is_last:
+            keep &= bounds[:, 3] < tile_height - 1 - EDGE_TOLERANCE
+        tile_parts.append(tile_lines.select(keep).shifted(dy=y_offset))
+        tile_ids.append(np.full(len(tile_parts[-1]), tile_count))
+
+    page_lines = OCRLines.concatenate(tile_parts)
+    merged = merge_tile_lines(page_lines, np.concatenate(tile_ids) if tile_ids else None).sorted_reading_order()
+    print(f"Tiled OCR: {tile_count} tiles, {len(page_lines)} lines before merge, {len(merged)} after")
+    return merged
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OCR a very tall image in overlapping in-memory tiles.")
+    parser.add_argument("image_path", type=str, help="Path to the input image file.")
+    parser.add_argument("--output", type=str, default=None, help="Optional JSON file for the merged lines.")
+    parser.add_argument("--height", type=int, default=800, help="Target height of each tile (default: 800).")
+    parser.add_argument("--overlap", type=int, default=64,
+                        help="Pixels each tile extends above the previous cut; should exceed the tallest text line (default: 64).")
+    parser.add_argument("--search", type=int, default=100,
+                        help="How far (in pixels) from the target height to look for a whitespace row to cut at (default: 100).")
+    args = parser.parse_args()
+
+    if args.height <= 0 or args.overlap < 0 or args.overlap >= args.height - args.search:
+        print("Error: --height must be positive and --overlap must be smaller than --height minus --search.")
+        sys.exit(1)
+
+    img = cv2.imread(args.image_path)
+    if img is None:
+        print(f"Error: Input image not found or unreadable at {args.image_path}")
+        sys.exit(1)
+
+    from ocrtest import create_ocr_engine
+    ocr = create_ocr_engine()
+    lines = ocr_tiled(ocr, img, args.height, args.overlap, args.search)
+
+    for i, (box, (text, score)) in enumerate(lines):
+        print(f"Line {i+1}: {text}    # Confidence: {score:.3f}")
+
+    if args.output:
+        output_dir = os.path.dirname(os.path.abspath(args.output))
+        os.makedirs(output_dir, exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(lines.to_records(), f, ensure_ascii=False, indent=2)
+        print(f"Saved {len(lines)} lines to {args.output}")